@@ -0,0 +1,210 @@
+# Per cycle summary of oven production, written once when cycle ends.
+# Only O6 has an oven_stop tag change script (ovenStopped -> queueCycle, summary stored
+# asynchronously), cycles of every oven are summarised by the backfill timer started from
+# the gateway startup script (start(): table created once, backfill every BACKFILL_INTERVAL).
+# getCycleReport returns one indexed row per cycle, without joining work orders
+# or querying temperature history of every cycle at render time.
+# Oven Cycle Report reads summary columns through its "ovprd" query (one row per basket,
+# joined to the summary of its cycle).
+import threading
+
+from java.lang import Runnable
+from java.util.concurrent import Executors, TimeUnit
+
+DB = 'ignition'
+TABLE = "ovcs_ovencyclesummary"
+OVEN_ROOT = "[default]SGA/EIB/TW/"
+TEMPERATURE_TAG = "/OvenParameters/PLCTags/Temperature_Average"
+WORK_ORDER_COLUMN = "ord_no"		# work order number column of wod_workord (as read by Oven Cycle Report)
+SAMPLE_MINUTES = 1					# resolution of temperature history used for statistics
+BACKFILL_INTERVAL = 15				# minutes between backfill runs
+BACKFILL_HOURS = 48					# cycles ended in this period are checked by each backfill run
+
+# backfill timer of previous script load is kept here, so it can be stopped on reload
+_GLOBALS_KEY = "sga_tw_ovens.CycleSummary"
+_lock = threading.Lock()
+_state = {"executor": None}
+
+def createTable():
+	sqlQuery = """
+		CREATE TABLE IF NOT EXISTS """ + TABLE + """
+			(
+				ovprd_id INT NOT NULL,
+				oven_no VARCHAR(8) NOT NULL,
+				fk_ovms_id INT NULL,
+				fk_rec_id INT NULL,
+				start_dt DATETIME NULL,
+				end_dt DATETIME NOT NULL,
+				duration_min INT NULL,
+				temp_min DOUBLE NULL,
+				temp_max DOUBLE NULL,
+				temp_avg DOUBLE NULL,
+				setpoint_dev_avg DOUBLE NULL,
+				setpoint_dev_max DOUBLE NULL,
+				work_order_count INT NOT NULL DEFAULT 0,
+				work_orders TEXT NULL,
+				baskets TEXT NULL,
+				PRIMARY KEY (ovprd_id),
+				INDEX ix_oven_end (oven_no, end_dt),
+				INDEX ix_end (end_dt)
+			)
+	"""
+	system.db.runUpdateQuery(sqlQuery, DB)
+
+def temperatureStats(oven_no, start_dt, end_dt, rec_id):
+	# min / max / avg of Temperature_Average and deviation from recipe set point (temp of running segment)
+	stats = {"temp_min": None, "temp_max": None, "temp_avg": None, "setpoint_dev_avg": None, "setpoint_dev_max": None}
+	
+	minutes = system.date.minutesBetween(start_dt, end_dt)
+	if minutes < 1:
+		return stats
+	
+	history = system.tag.queryTagHistory(paths = [OVEN_ROOT + "O" + str(oven_no) + TEMPERATURE_TAG], startDate = start_dt, endDate = end_dt,
+										  returnSize = max(1, minutes / SAMPLE_MINUTES), aggregationMode = "Average", returnFormat = "Wide", ignoreBadQuality = True)
+	
+	recipe = system.db.runPrepQuery("SELECT duration, temp FROM recms_recipemaster WHERE fk_rec_recms_id = ? ORDER BY segment ASC", [rec_id], DB)
+	temps = [row[1] for row in recipe]
+	bounds = sga_tw_ovens.Simulation.segmentBounds([row[0] for row in recipe])
+	
+	values = []
+	deviations = []
+	start = start_dt.getTime()
+	for row in range(history.getRowCount()):
+		value = history.getValueAt(row, 1)
+		if value is None:
+			continue
+		values.append(value)
+		
+		seg = sga_tw_ovens.Simulation.segmentAt(bounds, history.getValueAt(row, 0).getTime() - start)
+		if seg is not None and temps[seg] is not None:
+			deviations.append(abs(value - temps[seg]))
+	
+	if len(values) > 0:
+		stats["temp_min"] = min(values)
+		stats["temp_max"] = max(values)
+		stats["temp_avg"] = sum(values) / float(len(values))
+	
+	if len(deviations) > 0:
+		stats["setpoint_dev_avg"] = sum(deviations) / float(len(deviations))
+		stats["setpoint_dev_max"] = max(deviations)
+	
+	return stats
+
+def storeCycle(ovprd_id):
+	# summarise ended cycle (production row with end_dt), rerun replaces existing summary
+	production = system.db.runPrepQuery("""
+		SELECT p.ovprd_id, m.oven_no, p.fk_ovms_ovprd_id, p.fk_rec_ovprd_id, p.start_dt, p.end_dt
+		FROM ovprd_ovenproduction p
+			INNER JOIN ovms_ovenmaster m ON p.fk_ovms_ovprd_id = m.ovms_id
+		WHERE p.ovprd_id = ? AND p.end_dt IS NOT NULL""", [ovprd_id], DB)
+	
+	if len(production) < 1:
+		return False
+	
+	ovprd_id, oven_no, ovms_id, rec_id, start_dt, end_dt = list(production[0])
+	
+	workOrders = system.db.runPrepQuery("SELECT COUNT(*), GROUP_CONCAT(DISTINCT " + WORK_ORDER_COLUMN + "), GROUP_CONCAT(DISTINCT basket_no) FROM wod_workord WHERE fk_ovprd_wod_id = ?", [ovprd_id], DB)
+	
+	duration = None
+	stats = {"temp_min": None, "temp_max": None, "temp_avg": None, "setpoint_dev_avg": None, "setpoint_dev_max": None}
+	if start_dt is not None:
+		duration = system.date.minutesBetween(start_dt, end_dt)
+		try:
+			stats = temperatureStats(oven_no, start_dt, end_dt, rec_id)
+		except:
+			system.util.getLogger("SGA-TW-Ovens").warn("Temperature history not available for oven production " + str(ovprd_id))
+	
+	system.db.runPrepUpdate("REPLACE INTO " + TABLE + """
+		(ovprd_id, oven_no, fk_ovms_id, fk_rec_id, start_dt, end_dt, duration_min, temp_min, temp_max, temp_avg,
+		 setpoint_dev_avg, setpoint_dev_max, work_order_count, work_orders, baskets)
+		VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
+		[ovprd_id, str(oven_no), ovms_id, rec_id, start_dt, end_dt, duration, stats["temp_min"], stats["temp_max"], stats["temp_avg"],
+		 stats["setpoint_dev_avg"], stats["setpoint_dev_max"], workOrders[0][0], workOrders[0][1], workOrders[0][2]], DB)
+	
+	return True
+
+def backfill(startDate, endDate):
+	# summarise ended cycles of period that have no summary yet (backfill timer / script console)
+	cycles = system.db.runPrepQuery("""
+		SELECT p.ovprd_id
+		FROM ovprd_ovenproduction p
+			LEFT JOIN """ + TABLE + """ s ON s.ovprd_id = p.ovprd_id
+		WHERE p.end_dt >= ? AND p.end_dt < ? AND s.ovprd_id IS NULL
+		ORDER BY p.end_dt""", [startDate, endDate], DB)
+	
+	stored = 0
+	for row in cycles:
+		if storeCycle(row[0]):
+			stored += 1
+	return stored
+
+def getCycleReport(startDate, endDate, ovenNumbers = None):
+	# data source for Oven Cycle Report: one row per cycle ended in period
+	args = [startDate, endDate]
+	ovenFilter = ""
+	if ovenNumbers:
+		ovenFilter = " AND oven_no IN (" + ",".join(["?"] * len(ovenNumbers)) + ")"
+		args.extend([str(oven_no) for oven_no in ovenNumbers])
+	
+	sqlQuery = """
+		SELECT oven_no, ovprd_id, start_dt, end_dt, duration_min, temp_min, temp_max, temp_avg,
+			setpoint_dev_avg, setpoint_dev_max, work_order_count, work_orders, baskets
+		FROM """ + TABLE + """
+		WHERE end_dt >= ? AND end_dt < ?""" + ovenFilter + """
+		ORDER BY oven_no, end_dt"""
+	
+	return system.db.runPrepQuery(sqlQuery, args, DB)
+
+
+class _BackfillTask(Runnable):
+	
+	def run(self):
+		try:
+			now = system.date.now()
+			backfill(system.date.addHours(now, -BACKFILL_HOURS), now)
+		except:
+			system.util.getLogger("SGA-TW-Ovens").warn("Cycle summary backfill failed")
+
+def start():
+	# gateway startup script: table is created once, backfill runs on its own thread
+	with _lock:
+		if _state["executor"] is not None:
+			return
+	
+	previousStop = system.util.getGlobals().get(_GLOBALS_KEY)
+	if previousStop is not None and previousStop is not stop:
+		try:
+			previousStop()
+		except:
+			pass
+	
+	createTable()
+	
+	with _lock:
+		if _state["executor"] is not None:
+			return
+		
+		executor = Executors.newSingleThreadScheduledExecutor()
+		executor.scheduleWithFixedDelay(_BackfillTask(), 1, BACKFILL_INTERVAL, TimeUnit.MINUTES)
+		
+		_state["executor"] = executor
+		system.util.getGlobals()[_GLOBALS_KEY] = stop
+
+def stop():
+	with _lock:
+		executor = _state["executor"]
+		_state["executor"] = None
+	
+	if executor is not None:
+		executor.shutdownNow()
+
+def queueCycle(ovprd_id):
+	# called on tag change thread, temperature history query and summary run asynchronously
+	def store():
+		try:
+			start()
+			storeCycle(ovprd_id)
+		except:
+			system.util.getLogger("SGA-TW-Ovens").warn("Cycle summary failed for oven production " + str(ovprd_id))
+	
+	system.util.invokeAsynchronous(store)
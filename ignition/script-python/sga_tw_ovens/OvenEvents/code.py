@@ -0,0 +1,127 @@
+# Oven start / stop persistence for tag change events on [default]SGA/EIB/TW/O{n}/MasterReceipe/...
+# Called by gateway tag change scripts (event-scripts), set-based parameterised statements in one transaction per event:
+#   oven_start: Auto_Cycle_ReadyToStart -> sga_tw_ovens.OvenEvents.ovenStarted(event.tagPath)
+#   oven_stop:  Auto_Cycle_Completed    -> sga_tw_ovens.OvenEvents.ovenStopped(event.tagPath)
+DB = 'ignition'
+OVEN_ROOT = "[default]SGA/EIB/TW/"
+
+def ovenNumber(tagPath):
+	# O12/MasterReceipe/Auto_Cycle_Completed -> "12"
+	return str(tagPath).split(OVEN_ROOT)[1].split('/')[0][1:]
+
+def ovenPath(oven_no):
+	return OVEN_ROOT + "O" + str(oven_no)
+
+def recipeToSimulation(ovms_id, curve_pk, tx):
+	# copy recipe segments to sim_simulation rows of the oven (segment = position in recipe) with one UPDATE
+	receipeMaster = system.db.runPrepQuery("SELECT duration, power, temp FROM recms_recipemaster WHERE fk_rec_recms_id = ? ORDER BY segment ASC", [curve_pk], DB, tx)
+	if len(receipeMaster) < 1:
+		return 0
+	
+	args = []
+	for x in range(len(receipeMaster)):
+		args.extend([x, receipeMaster[x][0], receipeMaster[x][1], receipeMaster[x][2]])
+	args.append(ovms_id)
+	
+	segments = " UNION ALL ".join(["SELECT ? AS segment, ? AS duration, ? AS power, ? AS temp"] + ["SELECT ?, ?, ?, ?"] * (len(receipeMaster) - 1))
+	sqlQuery = """
+		UPDATE sim_simulation s
+			INNER JOIN (""" + segments + """) v ON s.segment = v.segment
+		SET s.duration = v.duration, s.power = v.power, s.temp = v.temp
+		WHERE s.fk_sim_ovms_id = ?
+	"""
+	return system.db.runPrepUpdate(sqlQuery, args, DB, tx)
+
+def ovenStarted(tagPath):
+	oven_no = ovenNumber(tagPath)
+	root = ovenPath(oven_no)
+	
+	qvs = system.tag.readBlocking([root + "/OvenParameters/PLCTags/Temperature_Average", root + "/MasterReceipe/Auto_Cycle_ReadyToStart", root + "/MasterReceipe/PLC_Status"])
+	temp = qvs[0].value
+	start = qvs[1].value
+	
+	#OVEN AUTO START FROM PLC
+	if start != 0:
+		return
+	
+	start_dt = system.date.now()
+	
+	tx = system.db.beginTransaction(DB)
+	try:
+		ovms_id = system.db.runScalarPrepQuery("SELECT ovms_id FROM ovms_ovenmaster WHERE oven_no = ?", [oven_no], DB, tx)
+		
+		curve_pk = system.db.runScalarPrepQuery("SELECT fk_rec_ovprd_id FROM ovprd_ovenproduction WHERE fk_ovms_ovprd_id = ? AND start_dt IS NULL AND fk_sta_ovprd_running_id IS NULL", [ovms_id], DB, tx)
+		if curve_pk is None:
+			curve_pk = 0
+		
+		table = system.db.runPrepQuery("SELECT sum(duration), sum(duration_min) FROM recms_recipemaster WHERE fk_rec_recms_id = ?", [curve_pk], DB, tx)
+		curve_hrs = table[0][0]
+		curve_min = table[0][1]
+		
+		#Updating to DB after oven start
+		if curve_hrs is not None and curve_min is not None:
+			curing_expected_end_dt = system.date.addMinutes(start_dt, int((curve_hrs * 60) + curve_min))
+			system.db.runPrepUpdate("UPDATE ovprd_ovenproduction SET start_dt = ?, start_temp = ?, curing_expected_end_dt = ?, fk_sta_ovprd_running_id = ? WHERE fk_ovms_ovprd_id = ? AND start_dt IS NULL AND fk_sta_ovprd_running_id IS NULL", [start_dt, temp, curing_expected_end_dt, 1, ovms_id], DB, tx)
+		
+		#capturing current oven recipe to sim simulation table for power simulation
+		recipeToSimulation(ovms_id, curve_pk, tx)
+		
+		system.db.commitTransaction(tx)
+	except:
+		system.db.rollbackTransaction(tx)
+		raise
+	finally:
+		system.db.closeTransaction(tx)
+	
+	#writing oven status to tag
+	if qvs[2].value == 1:
+		try:
+			system.tag.writeBlocking([root + "/OvenParameters/InternalTags/Oven_Status"], [4])
+		except:
+			pass
+
+def ovenStopped(tagPath):
+	oven_no = ovenNumber(tagPath)
+	root = ovenPath(oven_no)
+	
+	qvs = system.tag.readBlocking([root + "/OvenParameters/PLCTags/Temperature_Average", root + "/MasterReceipe/Auto_Cycle_Completed", root + "/Oven_Parameters/PLCTags/PLC_Status"])
+	temp = qvs[0].value
+	stop = qvs[1].value
+	
+	##OVEN AUTO STOP FROM PLC
+	if stop == 0:
+		end_dt = system.date.now()
+		
+		tx = system.db.beginTransaction(DB)
+		try:
+			ovms_id = system.db.runScalarPrepQuery("SELECT ovms_id FROM ovms_ovenmaster WHERE oven_no = ?", [oven_no], DB, tx)
+			
+			oven_prd_id = system.db.runScalarPrepQuery("SELECT ovprd_id FROM ovprd_ovenproduction WHERE fk_ovms_ovprd_id = ? AND fk_sta_ovprd_running_id = 1", [ovms_id], DB, tx)
+			if oven_prd_id is None:
+				oven_prd_id = 0
+			
+			system.db.runPrepUpdate("UPDATE ovprd_ovenproduction SET end_dt = ?, end_temp = ?, fk_sta_ovprd_running_id = ? WHERE fk_ovms_ovprd_id = ? AND end_dt IS NULL", [end_dt, temp, 2, ovms_id], DB, tx)
+			
+			# free all baskets of the production with one statement
+			system.db.runPrepUpdate("UPDATE basms_basketmaster SET allocation = 0 WHERE bas_id IN (SELECT basket_no FROM wod_workord WHERE fk_ovprd_wod_id = ?)", [oven_prd_id], DB, tx)
+			
+			system.db.commitTransaction(tx)
+		except:
+			system.db.rollbackTransaction(tx)
+			raise
+		finally:
+			system.db.closeTransaction(tx)
+		
+		# summary for Oven Cycle Report, stored asynchronously so it never blocks the stop event
+		if oven_prd_id:
+			sga_tw_ovens.CycleSummary.queueCycle(oven_prd_id)
+		
+		if qvs[2].value == 1:
+			try:
+				system.tag.writeBlocking([root + "/OvenParameters/InternalTags/Oven_Status"], [7])
+			except:
+				pass
+	
+	tagPaths = [root + "/MasterReceipe/Curve" + str(curve) + "_Selected_From_HMI" for curve in range(1, 6)]
+	tagPaths.append(root + "/MasterReceipe/SCADA_Mode_Selected")
+	system.tag.writeBlocking(tagPaths, [0, 0, 0, 0, 0, 1])
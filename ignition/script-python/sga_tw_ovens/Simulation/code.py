@@ -1,3 +1,5 @@
+from bisect import bisect_right
+
 now = system.date.now()	
 def ti(start,x):  
     return system.date.addHours(start,int(x))
@@ -37,40 +39,68 @@ def dist_to_Dataset(dict,time):
 		rows.append(row)
 	return system.dataset.toDataSet(Header,rows) 
 	  
+HOUR = 3600000		# ms
+
+def segmentBounds(rawDuration):
+	# segment boundaries in ms from start, whole hours like list_to_Dist (ti truncates to int)
+	bounds = [0]
+	for total in time_to_total(rawDuration):
+		bounds.append(int(total) * HOUR)
+	return bounds
+
+def segmentAt(bounds, offset):
+	# same result as whatSeg: last segment x with bounds[x] <= offset <= bounds[x+1], None if outside
+	nbSegments = len(bounds) - 1
+	if nbSegments < 1 or offset < 0 or offset > bounds[-1]:
+		return None
+	return min(bisect_right(bounds, offset) - 1, nbSegments - 1)
+
+def hourlyCurve(rawDuration, values, start, t_stamp, hours):
+	# value of running segment for every hour from t_stamp (0 outside of recipe), one pass
+	bounds = segmentBounds(rawDuration)
+	offset = t_stamp.getTime() - start.getTime()
+	curve = []
+	for hour in range(hours):
+		seg = segmentAt(bounds, offset + hour * HOUR)
+		if seg is not None : curve.append(int(values[seg]))
+		else : curve.append(0)
+	return curve
+
+def loadSegments(table, keyColumn, valueColumn, keys):
+	# duration and value lists of all requested keys with one query: {key: ([durations], [values])}
+	segments = dict([(key, ([], [])) for key in keys])
+	if len(keys) < 1:
+		return segments
+	sqlQuery = "SELECT " + keyColumn + ", duration, " + valueColumn + " FROM " + table + " WHERE " + keyColumn + " IN (" + ",".join(["?"] * len(keys)) + ") ORDER BY " + keyColumn + ", segment ASC"
+	for row in system.db.runPrepQuery(sqlQuery, list(keys)):
+		segments[row[0]][0].append(row[1])
+		segments[row[0]][1].append(row[2])
+	return segments
+
 def mainFunc(rec_id, selectedTime):
 
 #		rec_id  = 2
 		t_stamp = selectedTime #system.date.addHours(now,0)
-		RunningOvens = system.db.runQuery('''SELECT concat('Oven ',oven_no), start_dt, fk_rec_ovprd_id, fk_ovms_ovprd_id FROM  ovprd_ovenproduction 
+		RunningOvens = system.db.runPrepQuery('''SELECT concat('Oven ',oven_no), start_dt, fk_rec_ovprd_id, fk_ovms_ovprd_id FROM  ovprd_ovenproduction 
 												inner join  ovms_ovenmaster on fk_ovms_ovprd_id = ovms_id where fk_sta_ovprd_running_id = 1 or start_dt > now()
 											union
-												SELECT 'Selected Oven' , DATE_ADD(now(), INTERVAL -2 MINUTE), '%s', -2  as myColumn
-												order by fk_ovms_ovprd_id desc '''%(rec_id))
-												
-		cur_rec_total_time = int(system.db.runQuery("SELECT sum(duration) FROM  recms_recipemaster where fk_rec_recms_id = '%s'"%(rec_id)).getValueAt(0,0))													
+												SELECT 'Selected Oven' , DATE_ADD(now(), INTERVAL -2 MINUTE), ?, -2  as myColumn
+												order by fk_ovms_ovprd_id desc ''', [rec_id])
+		
+		# selected recipe and simulations of all running ovens, loaded once
+		recipe = system.db.runPrepQuery("SELECT duration, power FROM recms_recipemaster where fk_rec_recms_id = ? order by segment asc", [rec_id])
+		recipe = ([x[0] for x in recipe], [x[1] for x in recipe])
+		simulations = loadSegments("sim_simulation", "fk_sim_ovms_id", "power", set([receipe[3] for receipe in RunningOvens if receipe[3] != -2]))
+		
+		cur_rec_total_time = int(sum(recipe[0]))
 		ovenConsumingPower = {}
 #		print 'NO of Ovens in Run  '+ str(RunningOvens)
 		for receipe in RunningOvens :
-				if receipe[3] != -2 : masterData = system.db.runQuery("SELECT duration, power FROM sim_simulation where fk_sim_ovms_id = '%s' order by segment asc"%(receipe[3])) 
-				else :                masterData = system.db.runQuery("SELECT duration, power FROM recms_recipemaster where fk_rec_recms_id  = '%s' order by segment asc"%(receipe[2])) 
+				if receipe[3] != -2 : rawDuration, power = simulations[receipe[3]]
+				else :                rawDuration, power = recipe
 				
-				rawDuration = [x[0] for x in masterData]              #[2,1,1,1] # receipe duration	
-				start  = receipe[1]                                  
-				converted = time_to_total(rawDuration)                # convert 1,1,2 to 1,2,4
-				dist = list_to_Dist(converted,start)                  # Dictonary Convertion
-		
-				segList = []
-				for time in range(cur_rec_total_time):
-					dt = ti(t_stamp,time)
-					cur_Segment = whatSeg(dt,dist)                    # on which Segment it is Running
-					segList.append(cur_Segment)
-					
-				power = []	
-				for curSegment in segList :                           # Maping current power against Segment
-					if curSegment != '' : power.append(int(masterData.getValueAt(curSegment,1)))
-					else : power.append(0) 
-										   
-				ovenConsumingPower.update({receipe[0]: power})
+				# power of running segment for every hour (segment found with binary search)
+				ovenConsumingPower.update({receipe[0]: hourlyCurve(rawDuration, power, receipe[1], t_stamp, cur_rec_total_time)})
 		
 		finalDataset = dist_to_Dataset(ovenConsumingPower,t_stamp)
 		return finalDataset
@@ -80,22 +110,21 @@ def mainFunc(rec_id, selectedTime):
 		
 def findSeg(oven_id):	
 
-	RunningOvens = system.db.runQuery('''SELECT start_dt, fk_rec_ovprd_id FROM  ovprd_ovenproduction where fk_ovms_ovprd_id = '%s' and fk_sta_ovprd_running_id = 1 ''' %(oven_id))
+	RunningOvens = system.db.runPrepQuery('''SELECT start_dt, fk_rec_ovprd_id FROM  ovprd_ovenproduction where fk_ovms_ovprd_id = ? and fk_sta_ovprd_running_id = 1 ''', [oven_id])
 
 	for receipe in RunningOvens :
-		masterData = system.db.runQuery("SELECT duration FROM  sim_simulation where fk_sim_ovms_id = '%s' order by segment asc"%(receipe[1])) 
+		masterData = system.db.runPrepQuery("SELECT duration FROM  sim_simulation where fk_sim_ovms_id = ? order by segment asc", [receipe[1]]) 
 		rawDuration = [x[0] for x in masterData]               #[2,1,1,1] # from tags its time	
 		start  = receipe[0]                                  
-		converted = time_to_total(rawDuration)                 # convert 1,1,2 to 1,2,4
-		dist = list_to_Dist(converted,start)                   # Dictonary Convertion
-		cur_Segment = whatSeg(now,dist)                        # on which Segment it is Running
+		cur_Segment = segmentAt(segmentBounds(rawDuration), system.date.now().getTime() - start.getTime())   # on which Segment it is Running
+		if cur_Segment is None : return ''
 		return cur_Segment
 		
 
 
 def visualChart(start, oven_id):
 #	masterData = system.db.runQuery("SELECT duration, temp FROM sim_simulation where fk_sim_ovms_id = '%s' order by segment asc " %(oven_id))
-	masterData = system.db.runQuery("SELECT duration, temp FROM  recms_recipemaster where fk_rec_recms_id = '%s' order by segment asc " %(oven_id))
+	masterData = system.db.runPrepQuery("SELECT duration, temp FROM  recms_recipemaster where fk_rec_recms_id = ? order by segment asc ", [oven_id])
 	rawDuration = [x[0] for x in masterData] 
 	converted = time_to_total(rawDuration) 
 	minutes = [hr*60 for hr in converted] 
@@ -112,22 +141,11 @@ def visualChart(start, oven_id):
 def chart(start, oven_id):
 
 #	start  = now
-	masterData = system.db.runQuery("SELECT duration, temp FROM  sim_simulation where fk_sim_ovms_id = '%s' order by segment asc " %(oven_id))
+	masterData = system.db.runPrepQuery("SELECT duration, temp FROM  sim_simulation where fk_sim_ovms_id = ? order by segment asc ", [oven_id])
 	rawDuration = [x[0] for x in masterData] 
-	converted = time_to_total(rawDuration)           
-	dist = list_to_Dist(converted,start)
-      
-	segList = []
-#	for time in range(int(sum(rawDuration))):
-	for time in range(int(sum(rawDuration)+1)):
-		dt = ti(start, time)
-		cur_Segment = whatSeg(dt,dist)                    # on which Segment it is Running
-		segList.append(cur_Segment)
 	
-	temp = []	
-	for curSegment in segList :                           # Maping current power against Segment
-		if curSegment != '' : temp.append(int(masterData.getValueAt(curSegment,1)))
-		else : temp.append(0) 
+	# set point of running segment for every hour (segment found with binary search)
+	temp = hourlyCurve(rawDuration, [x[1] for x in masterData], start, start, int(sum(rawDuration)+1))
 		
 	Header = ['t_stamp', 'temperature']
 	rows = []
@@ -136,4 +154,3 @@ def chart(start, oven_id):
 		rows.append([dt,temp[setPt]])	
 	return system.dataset.toDataSet(Header,rows)
 
-			
\ No newline at end of file
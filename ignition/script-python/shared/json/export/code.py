@@ -271,59 +271,151 @@ def getTagsAsXls(path, attr={"value":"Value","quality":"Quality"}):
 # parameters
 # - startMillis	- start of the period
 # - endMillis - end of the period
+# all partitions covering the period are read (see getTagsHistoryPage)
 def getTagsHistoryAsJsonBeta(startMillis, endMillis):
 	
-	dataSource = "factory_history"
-	tagProvider = "default"
+	json = {}
+	cursor = None
 	
-	startDate = system.date.fromMillis(long(startMillis))
-	endDate = system.date.fromMillis(long(endMillis))
+	while True:
+		page = getTagsHistoryPage(startMillis, endMillis, cursor, includeRetired=False)
+		
+		for path, value, quality, timestamp in page["rows"]:
+			if path not in json:
+				json[path] = [[value, quality, timestamp]]
+			else:
+				json[path].append([value, quality, timestamp])
+		
+		cursor = page["cursor"]
+		if cursor is None:
+			return json
+
+
+#==============================================================================================
+# getHistoryPartitions( startMillis, endMillis ) 
+# 
+# In : period in millis
+# Out : list of [partition table, start millis, end millis] covering the period, in time order
+#==============================================================================================
+def getHistoryPartitions(startMillis, endMillis, dataSource="factory_history", tagProvider="default"):
+	query = """
+		SELECT p.pname, p.start_time, p.end_time
+		FROM sqlth_partitions p
+			JOIN sqlth_drv d ON d.id = p.drvid AND d.provider = ?
+		WHERE p.start_time < ? AND p.end_time > ?
+		ORDER BY p.start_time, p.pname
+	"""
+	partitions = system.db.runPrepQuery(query, [tagProvider, long(endMillis), long(startMillis)], dataSource)
 	
-	year = system.date.getYear(startDate)
-	month = system.date.getMonth(startDate) + 1
+	# same table can be listed for several drivers
+	result = []
+	for row in partitions:
+		if row[0] not in [partition[0] for partition in result]:
+			result.append([row[0], row[1], row[2]])
+	return result
+
+
+#==============================================================================================
+# getTagsHistoryPage( startMillis, endMillis, cursor ) 
+# 
+# In : period in millis (start included, end excluded), cursor returned by previous page (None for first page)
+# In : tagPaths to limit export to some tags (tag paths as stored in history, lower case), None for all
+# Out : {"rows": [[tagPath, value, quality, t_stamp], ...], "cursor": cursor of next page or None when done}
+#       Rows are ordered by partition, t_stamp and tag id, so export can be resumed with cursor
+#       (string, can be stored) and memory is bounded by pageSize.
+#==============================================================================================
+def getTagsHistoryPage(startMillis, endMillis, cursor=None, pageSize=10000, tagPaths=None, includeRetired=True, dataSource="factory_history", tagProvider="default"):
 	
-	tableName = "sqlt_data_1_"+str(year)+"_"+str(month).zfill(2)
+	startMillis = long(startMillis)
+	endMillis = long(endMillis)
 	
-	query = """
-				SELECT t.id, t.tagpath, d.dataintegrity, d.t_stamp, 
-				IF (t.datatype=0,d.intvalue,IF(t.datatype=1,d.floatvalue,IF(t.datatype=2,d.stringvalue,''))) value 
-				FROM 
-					( 
-					SELECT 
-						t.id,  
-						t.tagpath, 
-						t.datatype
-					FROM  
-						sqlth_te t  
-					JOIN sqlth_scinfo s ON s.id = t.scid 
-					JOIN sqlth_drv d ON d.ID=s.drvid AND d.provider=? 
-					WHERE  
-						t.retired IS NULL 
-					GROUP BY 
-						t.id, 
-						t.tagpath, 
-						t.datatype
-					ORDER BY 
-						t.tagpath 
-					) t 
-				LEFT JOIN """ +tableName+ """ d on (d.tagid = t.id) 
-				WHERE 
-				d.t_stamp > ?  AND d.t_stamp < ? 
-				order by d.t_stamp 
-		"""
-	tagData = system.db.runPrepQuery(query, [tagProvider, long(startMillis), long(endMillis)] , dataSource)
+	partitions = [partition[0] for partition in getHistoryPartitions(startMillis, endMillis, dataSource, tagProvider)]
 	
-	json = {}
+	# position after last returned row
+	partitionIdx = 0
+	lastStamp = startMillis - 1
+	lastTagId = 0
+	if cursor:
+		position = system.util.jsonDecode(cursor)
+		if position["p"] not in partitions:
+			raise ValueError("History partition " + str(position["p"]) + " of cursor is not available anymore.")
+		partitionIdx = partitions.index(position["p"])
+		lastStamp = long(position["t"])
+		lastTagId = int(position["id"])
+	
+	tagFilter = ""
+	if not includeRetired:
+		tagFilter += " AND t.retired IS NULL"
+	filterArgs = []
+	if tagPaths:
+		tagFilter += " AND t.tagpath IN (" + ",".join(["?"] * len(tagPaths)) + ")"
+		filterArgs = [str(tagPath).lower() for tagPath in tagPaths]
+	
+	rows = []
+	
+	while partitionIdx < len(partitions) and len(rows) < pageSize:
+		query = """
+			SELECT d.tagid, t.tagpath, d.dataintegrity, d.t_stamp,
+			IF (t.datatype=0,d.intvalue,IF(t.datatype=1,d.floatvalue,IF(t.datatype=2,d.stringvalue,''))) value
+			FROM """ + partitions[partitionIdx] + """ d
+				JOIN sqlth_te t ON t.id = d.tagid
+				JOIN sqlth_scinfo s ON s.id = t.scid
+				JOIN sqlth_drv v ON v.id = s.drvid AND v.provider = ?
+			WHERE
+				d.t_stamp >= ? AND d.t_stamp < ? AND
+				(d.t_stamp > ? OR (d.t_stamp = ? AND d.tagid > ?))
+				""" + tagFilter + """
+			ORDER BY d.t_stamp, d.tagid
+			LIMIT """ + str(int(pageSize - len(rows)))
 		
-	for idx in range(tagData.getRowCount()):
-		path = tagData.getValueAt(idx, 1)
-		value = tagData.getValueAt(idx, 4)
-		quality = tagData.getValueAt(idx, 2)
-		timestamp = tagData.getValueAt(idx, 3)
+		args = [tagProvider, startMillis, endMillis, lastStamp, lastStamp, lastTagId] + filterArgs
+		tagData = system.db.runPrepQuery(query, args, dataSource)
 		
-		if path not in json:
-			json[path] = [[value, quality, timestamp]]
-		else:
-			json[path].append([value, quality, timestamp])
-			
-	return json
\ No newline at end of file
+		for row in tagData:
+			rows.append([row[1], row[4], row[2], row[3]])
+		
+		if len(tagData) > 0:
+			lastStamp = long(tagData[len(tagData) - 1][3])
+			lastTagId = int(tagData[len(tagData) - 1][0])
+		
+		# partition done, next one starts from beginning of period
+		if len(rows) < pageSize:
+			partitionIdx += 1
+			lastStamp = startMillis - 1
+			lastTagId = 0
+	
+	nextCursor = None
+	if partitionIdx < len(partitions):
+		nextCursor = system.util.jsonEncode({"p": partitions[partitionIdx], "t": lastStamp, "id": lastTagId})
+	
+	return {"rows": rows, "cursor": nextCursor}
+
+
+#==============================================================================================
+# exportTagsHistoryAsJsonLines( filePath, startMillis, endMillis ) 
+# 
+# In : file to append to, period in millis, cursor to resume from (None to start)
+# In : maxPages to stop after some pages (e.g. one call per timer execution), None to export everything
+# Out : cursor to resume export with, None when period is exported
+#       One line per value: {"path":..., "value":..., "quality":..., "t_stamp":...}
+#==============================================================================================
+def exportTagsHistoryAsJsonLines(filePath, startMillis, endMillis, cursor=None, pageSize=10000, maxPages=None, tagPaths=None, dataSource="factory_history", tagProvider="default"):
+	
+	pages = 0
+	
+	while maxPages is None or pages < maxPages:
+		page = getTagsHistoryPage(startMillis, endMillis, cursor, pageSize, tagPaths, True, dataSource, tagProvider)
+		
+		exportFile = open(filePath, "a")
+		try:
+			for path, value, quality, timestamp in page["rows"]:
+				exportFile.write(system.util.jsonEncode({"path": path, "value": value, "quality": quality, "t_stamp": timestamp}) + "\n")
+		finally:
+			exportFile.close()
+		
+		pages += 1
+		cursor = page["cursor"]
+		if cursor is None:
+			return None
+	
+	return cursor
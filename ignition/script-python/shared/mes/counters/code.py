@@ -4,6 +4,256 @@
 # Modified by: Rok Zupan
 # ==============================================
 
+import threading
+import time
+
+from java.lang import Runnable
+from java.util.concurrent import Executors, TimeUnit
+
+# Counter increments are accumulated per tag and written by one flush thread:
+# read (one readBlocking for all tags) + write of value + accumulated delta.
+# A delta is removed only after its write came back good, otherwise it stays for next flush,
+# so every increment is applied exactly once and concurrent events can't overwrite each other.
+# Deltas of missing tags (Bad_NotFound) or failing MAX_FLUSH_FAILURES flushes in a row
+# are dropped, logged and kept in getDropped().
+FLUSH_INTERVAL = 1.0		# seconds between flushes
+EXISTS_MAX_AGE = 300.0		# seconds system.tag.exists result is reused
+MAX_FLUSH_FAILURES = 60		# failed flushes before delta is dropped
+
+# flusher of previous script load is kept here, so it can be stopped (and flushed) on reload
+_GLOBALS_KEY = "shared.mes.counters"
+
+_lock = threading.Lock()
+_flushLock = threading.Lock()
+_pending = {}		# tagPath -> [delta, minimum, failed flushes]
+_dropped = {}		# tagPath -> sum of dropped deltas
+_exists = {}		# tagPath -> (exists, timestamp)
+_state = {
+	"executor": None
+}
+
+
+#===============================================
+# Cached system.tag.exists
+#===============================================
+def tagExists( tagPath ):
+	now = time.time()
+	cached = _exists.get(tagPath)
+	
+	if cached is None or now - cached[1] > EXISTS_MAX_AGE:
+		cached = (system.tag.exists(tagPath), now)
+		_exists[tagPath] = cached
+	
+	return cached[0]
+
+
+def invalidateExists( tagPath = None ):
+	if tagPath is None:
+		_exists.clear()
+	else:
+		_exists.pop(tagPath, None)
+
+
+#===============================================
+# Accumulate delta for tag (written by flush)
+#===============================================
+def queueDelta( tagPath, deltaQuantity, minimum = None ):
+	"""
+	Adds deltaQuantity to tag on next flush, deltas of the same tag are summed.
+	minimum: lowest value written to tag (None for no limit)
+	"""
+	
+	_start()
+	
+	with _lock:
+		entry = _pending.get(tagPath)
+		if entry is None:
+			_pending[tagPath] = [deltaQuantity, minimum, 0]
+		else:
+			entry[0] += deltaQuantity
+			if minimum is not None:
+				entry[1] = minimum
+	
+	return True
+
+
+#===============================================
+# Write accumulated deltas to tags
+#===============================================
+def flush( tagPaths = None ):
+	"""
+	Writes accumulated deltas (of tagPaths only, or all tags when None).
+	Returns number of tags written, deltas of tags that could not be written stay queued
+	(dropped when tag is not found or after MAX_FLUSH_FAILURES).
+	"""
+	
+	with _flushLock:
+		with _lock:
+			if tagPaths is None:
+				tagPaths = list(_pending.keys())
+			
+			batch = []
+			for tagPath in tagPaths:
+				entry = _pending.pop(tagPath, None)
+				if entry is not None:
+					batch.append((tagPath, entry[0], entry[1], entry[2]))
+		
+		if len(batch) < 1:
+			return 0
+		
+		failed = []
+		notFound = []
+		written = 0
+		
+		try:
+			qvs = system.tag.readBlocking([item[0] for item in batch])
+		except:
+			qvs = None
+		
+		writePaths = []
+		writeValues = []
+		writeItems = []
+		
+		for idx, item in enumerate(batch):
+			if qvs is not None and _isNotFound(qvs[idx].quality):
+				notFound.append(item)
+				continue
+			if qvs is None or not qvs[idx].quality.isGood():
+				failed.append(item)
+				continue
+			
+			value = qvs[idx].value
+			if value is None:
+				value = 0
+			
+			value = value + item[1]
+			if item[2] is not None and value < item[2]:
+				value = item[2]
+			
+			writePaths.append(item[0])
+			writeValues.append(value)
+			writeItems.append(item)
+		
+		if len(writePaths) > 0:
+			try:
+				qualities = system.tag.writeBlocking(writePaths, writeValues)
+			except:
+				qualities = None
+			
+			for idx, item in enumerate(writeItems):
+				if qualities is not None and qualities[idx].isGood():
+					written += 1
+				elif qualities is not None and _isNotFound(qualities[idx]):
+					notFound.append(item)
+				else:
+					failed.append(item)
+		
+		dropped = list(notFound)
+		
+		if len(failed) > 0:
+			# keep for next flush, added to deltas queued in the meantime
+			with _lock:
+				for tagPath, deltaQuantity, minimum, failures in failed:
+					if failures + 1 >= MAX_FLUSH_FAILURES:
+						dropped.append((tagPath, deltaQuantity, minimum, failures + 1))
+						continue
+					
+					entry = _pending.get(tagPath)
+					if entry is None:
+						_pending[tagPath] = [deltaQuantity, minimum, failures + 1]
+					else:
+						entry[0] += deltaQuantity
+						entry[2] = max(entry[2], failures + 1)
+		
+		if len(dropped) > 0:
+			_drop(dropped)
+		
+		return written
+
+
+def _isNotFound( quality ):
+	return str(quality.name) == "Bad_NotFound"
+
+
+def _drop( items ):
+	logger = system.util.getLogger("MES-Counters")
+	
+	with _lock:
+		for tagPath, deltaQuantity, minimum, failures in items:
+			_dropped[tagPath] = _dropped.get(tagPath, 0) + deltaQuantity
+			# tag may have been deleted
+			invalidateExists(tagPath)
+	
+	for tagPath, deltaQuantity, minimum, failures in items:
+		logger.warn("Counter delta " + str(deltaQuantity) + " dropped for " + tagPath + " after " + str(failures) + " failed flushes (tag not found or not writable)")
+
+
+def getPending():
+	with _lock:
+		return dict([(tagPath, entry[0]) for tagPath, entry in _pending.items()])
+
+
+def getDropped( clear = False ):
+	"""
+	Returns sum of dropped deltas per tag path (dead letters), clear to reset them.
+	"""
+	
+	with _lock:
+		dropped = dict(_dropped)
+		if clear:
+			_dropped.clear()
+	
+	return dropped
+
+
+class _FlushTask(Runnable):
+	def run(self):
+		try:
+			flush()
+		except:
+			system.util.getLogger("MES-Counters").error("Counter flush failed")
+
+
+def _start():
+	if _state["executor"] is not None:
+		return
+	
+	# previous flusher writes its deltas before it stops, never wait for it while holding the lock
+	previousStop = system.util.getGlobals().get(_GLOBALS_KEY)
+	if previousStop is not None and previousStop is not stop:
+		try:
+			previousStop()
+		except:
+			pass
+	
+	with _lock:
+		if _state["executor"] is not None:
+			return
+		
+		executor = Executors.newSingleThreadScheduledExecutor()
+		interval = long(FLUSH_INTERVAL * 1000)
+		executor.scheduleWithFixedDelay(_FlushTask(), interval, interval, TimeUnit.MILLISECONDS)
+		
+		_state["executor"] = executor
+		system.util.getGlobals()[_GLOBALS_KEY] = stop
+
+
+def stop( timeout = 10.0 ):
+	"""
+	Stops flush thread after writing everything queued
+	"""
+	
+	with _lock:
+		executor = _state["executor"]
+		_state["executor"] = None
+	
+	if executor is None:
+		return
+	
+	executor.submit(_FlushTask())
+	executor.shutdown()
+	executor.awaitTermination(long(timeout * 1000), TimeUnit.MILLISECONDS)
+
 
 #===============================================
 # Add/Remove OUTFEED
@@ -15,18 +265,11 @@ def addOutfeed( callerTagPath, deltaQuantity ):
 	# We will look for the tagEndPath
 	tagPath = callerTagPath + tagEndPath
 	
-	if not system.tag.exists(tagPath):
+	if not tagExists(tagPath):
 		return False
 	
-	# Get existing value
-	qv = system.tag.read(tagPath)
-
-	# Write only if tag does not exist or is not connected
-	if qv.quality.isGood():
-		system.tag.write( tagPath , qv.value + deltaQuantity)
-		return True
-	else:
-		return False
+	# Added on next flush (see flush)
+	return queueDelta(tagPath, deltaQuantity)
 				
 #===============================================
 # Add/Remove INFEED
@@ -38,18 +281,11 @@ def addInfeed( callerTagPath, deltaQuantity ):
 	# We will look for the tagEndPath
 	tagPath = callerTagPath + tagEndPath
 	
-	if not system.tag.exists(tagPath):
+	if not tagExists(tagPath):
 		return False
 	
-	# Get existing value
-	qv = system.tag.read(tagPath)
-
-	# Write only if tag does not exist or is not connected
-	if qv.quality.isGood():
-		system.tag.write( tagPath , qv.value + deltaQuantity)
-		return True
-	else:
-		return False
+	# Added on next flush (see flush)
+	return queueDelta(tagPath, deltaQuantity)
 				
 #===============================================
 # Add/Remove REJECTS
@@ -69,18 +305,11 @@ def addRejects( callerTagPath, deltaQuantity ):
 	# Tag for mes outfeed for any machine - recorded as counter
 	rejectsTagPath = callerTagPath + tagEndPath
 	
-	# Get existing value
-	# If value is none, then set to 0
-	qv = system.tag.read(rejectsTagPath)
-	if qv.value is None:
-		qv.value = 0
-	
-	# Write only if tag does not exist or is not connected
-	if qv.quality.isGood():
-		system.tag.write( rejectsTagPath , qv.value + deltaQuantity)
-		return True
-	else:
+	if not tagExists(rejectsTagPath):
 		return False
+	
+	# Added on next flush, value None is taken as 0 (see flush)
+	return queueDelta(rejectsTagPath, deltaQuantity)
 
 
 #===============================================
@@ -88,15 +317,8 @@ def addRejects( callerTagPath, deltaQuantity ):
 #===============================================
 def addQuantityToTag( targetTagPath, deltaQuantity ):
 
-	if not system.tag.exists( targetTagPath ):
+	if not tagExists( targetTagPath ):
 		return False		
 
-	# Get existing value
-	qv = system.tag.read(targetTagPath)
-
-	# Write only if tag does not exist or is not connected
-	if qv.quality.isGood():
-		system.tag.write( targetTagPath , qv.value + deltaQuantity)
-		return True
-	else:
-		return False
+	# Added on next flush (see flush)
+	return queueDelta(targetTagPath, deltaQuantity)
@@ -10,6 +10,28 @@
 
 
 
+import threading
+import time
+
+# Compiled state definitions per equipment (see getStateIndex)
+STATE_INDEX_MAX_AGE = 600	# seconds, safety rebuild if tags were changed outside updateEquipmentStateTags
+
+_stateIndex = {}
+_stateIndexLock = threading.Lock()
+
+# MES equipment path <-> ignitionTagPath of mes UDT instances (see getEquipmentIndex)
+EQUIPMENT_INDEX_REBUILD_INTERVAL = 60	# seconds, minimum time between rebuilds caused by unknown equipment
+
+_equipmentIndex = {
+	"byEquipmentPath": {},		# param_mesObject value -> ignitionTagPath
+	"byIgnitionTagPath": {},	# ignitionTagPath -> param_mesObject value
+	"built": 0
+}
+_uuidEquipmentPaths = {}		# MES object UUID -> (equipment path, time loaded)
+UUID_CACHE_MAX_AGE = 600	# seconds, MES objects may be moved or renamed
+_equipmentIndexLock = threading.Lock()
+
+
 #===============================================
 # Update equipment STATE tags
 # 
@@ -101,6 +123,10 @@ def updateEquipmentStateTags( Ignition_Path ):
 	ds = system.dataset.toDataSet( headers, data)
 	
 	system.tag.write( dataset_path, ds)
+	
+	# Definitions changed, next lookup compiles them again
+	invalidateStateIndex(Ignition_Path)
+	
 #===============================================
 # Update equipment MODE tags
 # 
@@ -143,50 +169,236 @@ def updateEquipmentModeTags( Ignition_Path ):
 # Returns all the standard data corresponding to an equipment, and a code
 #===============================================	
 def getEquipmentStateOptions(ignitionTagPath, stateCode):
-	statesDatasetPath = ignitionTagPath + "\mes\param_statesDataset"
-
-	statesDS = system.tag.read(statesDatasetPath).value
-
-	for row in system.dataset.toPyDataSet(statesDS):
-		if row["Code"] == stateCode:
-			return row
+	row = getStateIndex(ignitionTagPath)["byCode"].get(stateCode)
+	
+	if row is None:
+		return False
 
-	return False
+	return row
 
 
 #===============================================
-# Function that will based on uuid and generate ignitionTagPath (pointer to root folder of equipment in tags)
+# getStateIndex
+# 
+# Returns compiled state definitions of equipment:
+#   byCode: code -> row of param_statesDataset
+#   byName: name -> code (first match in param_statesJson, same as states.getStateCode)
+#   byPath: fullPath -> code
+# Built once from param_statesDataset / param_statesJson and reused until
+# updateEquipmentStateTags rewrites them (or STATE_INDEX_MAX_AGE expires).
 #===============================================
-def findMesLinkUDTFromUUID(uuid):
+def getStateIndex(ignitionTagPath):
+	now = time.time()
+	
+	index = _stateIndex.get(ignitionTagPath)
+	if index is not None and now - index["built"] < STATE_INDEX_MAX_AGE:
+		return index
+	
+	with _stateIndexLock:
+		index = _stateIndex.get(ignitionTagPath)
+		if index is not None and now - index["built"] < STATE_INDEX_MAX_AGE:
+			return index
+		
+		index = _buildStateIndex(ignitionTagPath)
+		_stateIndex[ignitionTagPath] = index
+	
+	return index
+
+
+def _buildStateIndex(ignitionTagPath):
+	qvs = system.tag.readAll([ignitionTagPath + "/mes/param_statesDataset", ignitionTagPath + "/mes/param_statesJson"])
+	
+	byCode = {}
+	byPath = {}
+	
+	statesDS = qvs[0].value
+	if statesDS is not None:
+		pyDs = system.dataset.toPyDataSet(statesDS)
+		hasPath = "fullPath" in list(pyDs.getColumnNames())
+		for row in pyDs:
+			# first row wins, same as scanning the dataset
+			if row["Code"] not in byCode:
+				byCode[row["Code"]] = row
+			if hasPath and row["fullPath"] not in byPath:
+				byPath[row["fullPath"]] = row["Code"]
+	
+	byName = {}
+	
+	# same traversal order as recursive search of states.getStateCode: children first, then the state itself
+	def extract(json):
+		if isinstance(json, dict):
+			for k, v in json.items():
+				if isinstance(v, dict):
+					extract(v)
+					if "Code" in v and k not in byName:
+						byName[k] = v["Code"]
+	
 	try:
-		MESObject = system.mes.loadMESObject(uuid)
+		if qvs[1].value:
+			extract(system.util.jsonDecode(qvs[1].value))
 	except:
-		return None
-		
-	equipmentPath = MESObject.getEquipmentPath()
+		system.util.getLogger("STE-GW-Tags").warn("Cannot decode param_statesJson of " + ignitionTagPath)
+	
+	# good quality only, bad reads are tried again on next lookup
+	built = time.time()
+	if not (qvs[0].quality.isGood() and qvs[1].quality.isGood()):
+		built = 0
+	
+	return {"byCode": byCode, "byName": byName, "byPath": byPath, "built": built}
+
+
+def invalidateStateIndex(ignitionTagPath = None):
+	with _stateIndexLock:
+		if ignitionTagPath is None:
+			_stateIndex.clear()
+		else:
+			_stateIndex.pop(ignitionTagPath, None)
 
+
+def getStateCodeByPath(ignitionTagPath, statePath):
+	return getStateIndex(ignitionTagPath)["byPath"].get(statePath)
+
+
+#===============================================
+# Equipment index
+# 
+# param_mesObject (MES equipment path) of every mes UDT instance <-> ignitionTagPath
+# Built with one browse of [default] (gateway startup script, or first lookup).
+# getIgnitionTagPath checks each hit against mes/param_mesObject: edited UDTs are
+# updated, removed ones dropped, unknown equipment triggers a rebuild (at most once
+# per EQUIPMENT_INDEX_REBUILD_INTERVAL), which also drops cached MES object paths
+#===============================================
+def buildEquipmentIndex():
 	mesUDTs = system.tag.browse("[default]", {"tagType":"UdtInstance", "name":"mes", "recursive":True}).results
-	tagsToRead = []
 	
-
 	tags = []
 	tagPaths = []
-	
-	# build the list of tags to read to find mapping
 	for mesUDT in mesUDTs:
-		
-		param_mesObjectPath = str(mesUDT["fullPath"]) + "/param_mesObject"
-		
-		tags.append(param_mesObjectPath)
-		tagPaths.append((str(mesUDT["fullPath"])).replace("/mes", ""))
-		
+		tags.append(str(mesUDT["fullPath"]) + "/param_mesObject")
+		# UDT instance is named "mes", its parent folder is the equipment (folders like "mes_line" are kept)
+		tagPaths.append(str(mesUDT["fullPath"])[:-len("/mes")])
+	
 	tagValues = system.tag.readBlocking(tags)
 	
-	# find if there is a match between ignitionTagPath and MESObject
+	byEquipmentPath = {}
+	byIgnitionTagPath = {}
 	for x in range(0, len(tagValues)):
-		if equipmentPath in tagValues[x].value:
-			return str(tagPaths[x])
+		equipmentPath = tagValues[x].value
+		byIgnitionTagPath[tagPaths[x]] = equipmentPath
+		# first UDT wins, same as scanning in browse order
+		if equipmentPath and equipmentPath not in byEquipmentPath:
+			byEquipmentPath[equipmentPath] = tagPaths[x]
+	
+	with _equipmentIndexLock:
+		_equipmentIndex["byEquipmentPath"] = byEquipmentPath
+		_equipmentIndex["byIgnitionTagPath"] = byIgnitionTagPath
+		_equipmentIndex["built"] = time.time()
+		_uuidEquipmentPaths.clear()
+	
+	return len(byIgnitionTagPath)
+
+
+def getEquipmentIndex():
+	if _equipmentIndex["built"] == 0:
+		buildEquipmentIndex()
+	
+	return _equipmentIndex
+
+
+def updateEquipmentIndex(ignitionTagPath, equipmentPath = None):
+	# equipmentPath None: read from tag (e.g. when called for new UDT)
+	if equipmentPath is None:
+		equipmentPath = system.tag.readBlocking([ignitionTagPath + "/mes/param_mesObject"])[0].value
+	
+	index = getEquipmentIndex()
+	
+	with _equipmentIndexLock:
+		previous = index["byIgnitionTagPath"].get(ignitionTagPath)
+		if previous is not None and index["byEquipmentPath"].get(previous) == ignitionTagPath:
+			del index["byEquipmentPath"][previous]
+		
+		index["byIgnitionTagPath"][ignitionTagPath] = equipmentPath
+		if equipmentPath and equipmentPath not in index["byEquipmentPath"]:
+			index["byEquipmentPath"][equipmentPath] = ignitionTagPath
+
+
+def _removeFromEquipmentIndex(ignitionTagPath):
+	index = getEquipmentIndex()
+	
+	with _equipmentIndexLock:
+		previous = index["byIgnitionTagPath"].pop(ignitionTagPath, None)
+		if previous is not None and index["byEquipmentPath"].get(previous) == ignitionTagPath:
+			del index["byEquipmentPath"][previous]
+
+
+def getIgnitionTagPath(equipmentPath):
+	if not equipmentPath:
+		return None
+	
+	ignitionTagPath = _lookupEquipmentPath(getEquipmentIndex(), equipmentPath)
+	
+	if ignitionTagPath is not None:
+		# mapping is checked against the tag, so UDT edits and removals are corrected here
+		tagValue = system.tag.readBlocking([ignitionTagPath + "/mes/param_mesObject"])[0]
+		if str(tagValue.quality.name) == "Bad_NotFound":
+			_removeFromEquipmentIndex(ignitionTagPath)
+		elif tagValue.value == _equipmentIndex["byIgnitionTagPath"].get(ignitionTagPath):
+			return ignitionTagPath
+		else:
+			updateEquipmentIndex(ignitionTagPath, tagValue.value)
+	
+	# unknown or moved equipment, UDT may have been added outside of events
+	if time.time() - _equipmentIndex["built"] > EQUIPMENT_INDEX_REBUILD_INTERVAL:
+		buildEquipmentIndex()
+	
+	return _lookupEquipmentPath(_equipmentIndex, equipmentPath)
+
+
+def _lookupEquipmentPath(index, equipmentPath):
+	ignitionTagPath = index["byEquipmentPath"].get(equipmentPath)
+	if ignitionTagPath is not None:
+		return ignitionTagPath
+	
+	# param_mesObject may hold more than equipment path (previously matched with 'in')
+	for mesObject, ignitionTagPath in index["byEquipmentPath"].items():
+		if equipmentPath in mesObject:
+			return ignitionTagPath
+	
 	return None
+
+
+def getEquipmentPath(ignitionTagPath):
+	return getEquipmentIndex()["byIgnitionTagPath"].get(ignitionTagPath)
+
+
+#===============================================
+# Function that will based on uuid and generate ignitionTagPath (pointer to root folder of equipment in tags)
+#===============================================
+def findMesLinkUDTFromUUID(uuid):
+	cached = _uuidEquipmentPaths.get(uuid)
+	
+	if cached is None or time.time() - cached[1] > UUID_CACHE_MAX_AGE:
+		try:
+			MESObject = system.mes.loadMESObject(uuid)
+		except:
+			return None
+		
+		equipmentPath = MESObject.getEquipmentPath()
+		_uuidEquipmentPaths[uuid] = (equipmentPath, time.time())
+		cached = None
+	else:
+		equipmentPath = cached[0]
+
+	ignitionTagPath = getIgnitionTagPath(equipmentPath)
+	
+	if ignitionTagPath is None:
+		# MES object may have been moved or renamed since its path was cached
+		if cached is not None:
+			_uuidEquipmentPaths.pop(uuid, None)
+			return findMesLinkUDTFromUUID(uuid)
+		return None
+	
+	return str(ignitionTagPath)
 	
 def getCompatibleWorkcenterList(eqPath):
 	"""
@@ -274,14 +486,14 @@ def syncWorkcenterFromUdtToMesObject():
 	None
 		Adds or sets MES Equipment object custom property sap_work_center
 	""" 
-	#Browse all MES UDTs
-	#system.tag.browse
-	mesTagPaths = system.tag.browse("[default]", {"tagType":"Udtinstance", "name":"mes", "recursive":True}).results
+	#All MES UDTs, index is rebuilt so UDTs added since last build are synchronized too
+	buildEquipmentIndex()
+	ignitionTagPaths = getEquipmentIndex()["byIgnitionTagPath"].keys()
 	tagsToRead = []
 	#Loop and append param_mesObject and param_sapWorkCenter tags to get equipment path and workcenter
-	for mesTagPath in mesTagPaths:
-		workcenter = str(mesTagPath["fullPath"]) + "/param_sapWorkCenter"
-		equipmentPath = str(mesTagPath["fullPath"]) + "/param_mesObject"
+	for ignitionTagPath in ignitionTagPaths:
+		workcenter = ignitionTagPath + "/mes/param_sapWorkCenter"
+		equipmentPath = ignitionTagPath + "/mes/param_mesObject"
 		tagsToRead.append(equipmentPath)
 		tagsToRead.append(workcenter)
 	
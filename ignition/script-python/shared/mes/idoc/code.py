@@ -0,0 +1,504 @@
+#===============================================
+#===============================================
+#
+# mes.idoc.*
+#
+# Shredding of SAP work order IDocs (pfce_MESJsonProperty.jsonString)
+# to typed, indexed tables used by mes.workorder:
+#   mes_wo_header     - one row per work order (E1AFKOL)
+#   mes_wo_operation  - one row per operation (E1AFFLL.E1AFVOL[*])
+#   mes_wo_component  - one row per component (E1AFFLL.E1AFVOL[*].E1RESBL[*])
+#
+# Values are stored as text, same as returned by the JSON queries
+# (TRIM(BOTH '"' FROM CAST(... AS CHAR))), lists / objects as json text.
+#
+# Readers only query shredded tables. They are kept in sync on a gateway
+# thread (start(), called by mes.workorder readers):
+#   syncReceivedIdocs() - work orders of newly received IDocs
+#                         (sap_idocs_received.id), shredded within seconds
+#   syncWorkOrders()    - pass over pfce_MESJsonProperty in key order,
+#                         re-shreds changed (MD5 of jsonString) or enabled /
+#                         disabled properties, deletes removed ones
+#===============================================
+#===============================================
+
+import threading
+import time
+
+from java.lang import Runnable
+from java.util.concurrent import Executors, TimeUnit
+
+DATABASE = "mes_analysis"
+# received IDocs
+IDOC_DATABASE = "factory_sap"
+
+# seconds between sync runs, seconds of work per run
+SYNC_INTERVAL = 10.0
+SYNC_BUDGET = 5.0
+# shredding attempts before a property is parked
+FAILURE_LIMIT = 3
+
+# sync of previous script load is kept here, so it can be stopped on reload
+_GLOBALS_KEY = "shared.mes.idoc"
+
+_lock = threading.Lock()
+_state = {"tablesCreated": False, "executor": None, "lastKey": "", "lastIdocId": None, "passes": 0}
+# propertyUUID: (jsonHash, failed attempts)
+_failures = {}
+
+# (field name, path in E1AFKOL)
+HEADER_FIELDS = [
+	("workOrderName", "AUFNR"),
+	("material", "MATNR"),
+	("materialDescription", "MATNR_EXTERNAL"),
+	("units", "BMEINS"),
+	("quantity", "BMENGE"),
+	("type", "AUART"),
+	("category", "AUTYP"),
+	("plant", "WERKS"),
+	("dueDate", "GLTRS"),
+	("basicStartDate", "GSTRP"),
+	("basicFinishDate", "GLTRP"),
+	("mainMaterialStorage", "E1AFPOL.LGORT")
+]
+
+# (field name, path in E1AFVOL)
+OPERATION_FIELDS = [
+	("operationNumber", "VORNR"),
+	("workCenter", "ARBPL"),
+	("stepDescription", "ZE1AFVOL_TX[*].TDLINE"),
+	("operationQuantity", "MGVRG"),
+	("operationUnits", "MEINH"),
+	("operationStatus", "E1JSTVL[*].STAT"),
+	("shortText", "LTXA1"),
+	("earliestStartDate", "FSADV"),
+	("earliestStartTime", "FSAVZ"),
+	("earliestFinishDate", "FSEDD"),
+	("earliestFinishTime", "FSEDZ"),
+	("confirmationNumber", "ZE1AFVOL.ZZRUECK"),
+	("processingTime", "BEARZ"),
+	("processingTimeUnit", "BEAZE"),
+	("waitTime", "LIEGZ"),
+	("waitTimeUnit", "LIGZE"),
+	("setupTime", "VGW01"),
+	("setupTimeUnit", "VGE01"),
+	("machineTime", "VGW02"),
+	("machineTimeUnit", "VGE02"),
+	("laborTime", "VGW03"),
+	("laborTimeUnit", "VGE03"),
+	("interoperationTime", "TRANZ"),
+	("queueTime", "WARTZ"),
+	("queueTimeUnit", "WRTEZ"),
+	("controlKey", "STEUS"),
+	("baseOperationQuantity", "BMSCH"),
+	("aionData", "ZE1AFVOL_MES_DATA")
+]
+
+# (field name, path in E1RESBL)
+COMPONENT_FIELDS = [
+	("requiredQuantity", "BDMNG"),
+	("measureUnit", "MEINS"),
+	("materialNumber", "MATNR"),
+	("materialDescription", "MATNR_EXTERNAL"),
+	("consumMaterialStorage", "LGORT"),
+	("itemCategory", "POSTP"),
+	("priceUnit", "ZRESBLAD.PEINH"),
+	("movingPrice", "ZRESBLAD.VERPR"),
+	("currency", "ZRESBLAD.WAERS"),
+	("standardPrice", "ZRESBLAD.STPRS"),
+	("batchNumber", "CHARG"),
+	("backflushFlag", "ZRESBLAD.RGEKZ"),
+	("confirmationUnits", "ZRESBLAD.I_ISOCODE_UM"),
+	("materialInstance", "ZRESBLAD.C_INSTANCE"),
+	("managedByBatch", "ZE1RESBL.SPLKZ")
+]
+
+# fields holding json text instead of plain values
+JSON_FIELDS = ["stepDescription", "operationStatus", "aionData"]
+
+
+#==========================================================
+# Creates shredded work order tables if they don't exist
+#==========================================================
+def createTables():
+	
+	def columns(fields):
+		definitions = []
+		for name, path in fields:
+			if name in JSON_FIELDS:
+				definitions.append(name + " TEXT NULL")
+			else:
+				definitions.append(name + " VARCHAR(255) NULL")
+		return ",\n".join(definitions)
+	
+	sqlQueries = [
+		"""
+		CREATE TABLE IF NOT EXISTS mes_wo_header (
+			propertyUUID VARCHAR(64) NOT NULL,
+			enabled TINYINT NOT NULL,
+			jsonHash CHAR(32) NOT NULL,
+			""" + columns(HEADER_FIELDS) + """,
+			PRIMARY KEY (propertyUUID),
+			INDEX ix_workOrder (workOrderName, enabled),
+			INDEX ix_plantMaterial (plant, material, enabled)
+		)
+		""",
+		"""
+		CREATE TABLE IF NOT EXISTS mes_wo_operation (
+			propertyUUID VARCHAR(64) NOT NULL,
+			idx SMALLINT NOT NULL,
+			workOrderName VARCHAR(32) NULL,
+			""" + columns(OPERATION_FIELDS) + """,
+			PRIMARY KEY (propertyUUID, idx),
+			INDEX ix_workOrder (workOrderName, workCenter, operationNumber),
+			INDEX ix_workCenter (workCenter, operationNumber)
+		)
+		""",
+		"""
+		CREATE TABLE IF NOT EXISTS mes_wo_component (
+			propertyUUID VARCHAR(64) NOT NULL,
+			idx SMALLINT NOT NULL,
+			idy SMALLINT NOT NULL,
+			workOrderName VARCHAR(32) NULL,
+			operationNumber VARCHAR(255) NULL,
+			workCenter VARCHAR(255) NULL,
+			""" + columns(COMPONENT_FIELDS) + """,
+			PRIMARY KEY (propertyUUID, idx, idy),
+			INDEX ix_workOrder (workOrderName, workCenter, operationNumber)
+		)
+		"""
+	]
+	
+	for sqlQuery in sqlQueries:
+		system.db.runUpdateQuery(sqlQuery, DATABASE)
+	
+	_state["tablesCreated"] = True
+
+
+def _ensureTables():
+	if not _state["tablesCreated"]:
+		createTables()
+
+
+#==========================================================
+# Helpers reading json like MySQL JSON path did
+# - single object where list is expected is taken as list of one
+# - [*] collects values of all list items
+#==========================================================
+def _asList(value):
+	if value is None:
+		return []
+	if isinstance(value, dict):
+		return [value]
+	try:
+		return list(value)
+	except:
+		return [value]
+
+
+def _extract(node, path):
+	values = [node]
+	wildcard = False
+	
+	for part in path.split("."):
+		key = part
+		if part.endswith("[*]"):
+			key = part[:-3]
+			wildcard = True
+		
+		nextValues = []
+		for value in values:
+			if not isinstance(value, dict) or key not in value:
+				continue
+			if part.endswith("[*]"):
+				nextValues.extend(_asList(value[key]))
+			else:
+				nextValues.append(value[key])
+		values = nextValues
+	
+	if wildcard:
+		return values if len(values) > 0 else None
+	
+	return values[0] if len(values) > 0 else None
+
+
+def _toText(name, value):
+	if value is None:
+		return None
+	if name in JSON_FIELDS or isinstance(value, (dict, list)):
+		return system.util.jsonEncode(value)
+	if isinstance(value, basestring):
+		return value
+	return unicode(value)
+
+
+def _row(node, fields):
+	return [_toText(name, _extract(node, path)) for name, path in fields]
+
+
+def _insert(table, columns, rows, tx, rowsPerStatement = 200):
+	for start in range(0, len(rows), rowsPerStatement):
+		chunk = rows[start:start + rowsPerStatement]
+		args = []
+		for row in chunk:
+			args.extend(row)
+		
+		placeholder = "(" + ",".join(["?"] * len(columns)) + ")"
+		sqlQuery = "INSERT INTO " + table + " (" + ",".join(columns) + ") VALUES " + ",".join([placeholder] * len(chunk))
+		system.db.runPrepUpdate(sqlQuery, args, DATABASE, tx)
+
+
+def _delete(propertyUUID, tx):
+	for table in ["mes_wo_component", "mes_wo_operation", "mes_wo_header"]:
+		system.db.runPrepUpdate("DELETE FROM " + table + " WHERE propertyUUID = ?", [propertyUUID], DATABASE, tx)
+
+
+#==========================================================
+# Shreds one pfce_MESJsonProperty row
+# Existing operations / components of the property are replaced
+#==========================================================
+def shredProperty(propertyUUID, jsonString, enabled, jsonHash):
+	# broken json is stored as empty work order, so sync doesn't retry it forever
+	try:
+		workOrder = system.util.jsonDecode(jsonString)
+	except:
+		workOrder = None
+	if not isinstance(workOrder, dict):
+		workOrder = {}
+	
+	header = _row(workOrder, HEADER_FIELDS)
+	workOrderName = header[0]
+	
+	operationColumns = ["propertyUUID", "idx", "workOrderName"] + [name for name, path in OPERATION_FIELDS]
+	componentColumns = ["propertyUUID", "idx", "idy", "workOrderName", "operationNumber", "workCenter"] + [name for name, path in COMPONENT_FIELDS]
+	
+	operations = []
+	components = []
+	
+	for idx, operation in enumerate(_asList(_extract(workOrder, "E1AFFLL.E1AFVOL"))):
+		operationRow = _row(operation, OPERATION_FIELDS)
+		operations.append([propertyUUID, idx, workOrderName] + operationRow)
+		
+		for idy, component in enumerate(_asList(_extract(operation, "E1RESBL"))):
+			components.append([propertyUUID, idx, idy, workOrderName, operationRow[0], operationRow[1]] + _row(component, COMPONENT_FIELDS))
+	
+	headerColumns = ["propertyUUID", "enabled", "jsonHash"] + [name for name, path in HEADER_FIELDS]
+	
+	tx = system.db.beginTransaction(DATABASE)
+	try:
+		_delete(propertyUUID, tx)
+		
+		_insert("mes_wo_header", headerColumns, [[propertyUUID, 1 if enabled else 0, jsonHash] + header], tx)
+		_insert("mes_wo_operation", operationColumns, operations, tx)
+		_insert("mes_wo_component", componentColumns, components, tx)
+		
+		system.db.commitTransaction(tx)
+	except:
+		system.db.rollbackTransaction(tx)
+		raise
+	finally:
+		system.db.closeTransaction(tx)
+	
+	# cached work order details are outdated now
+	if workOrderName is not None:
+		shared.mes.workorder.invalidateWorkOrder(workOrderName)
+	
+	return len(operations)
+
+
+#==========================================================
+# Shreds all pfce_MESJsonProperty rows of one work order (AUFNR,
+# with or without leading zeros)
+# To be called when work order IDoc is received or updated
+# Returns number of shredded rows
+#==========================================================
+def shredWorkOrder(workOrderName):
+	_ensureTables()
+	
+	sql_query = """
+		SELECT MESPropertyUUID, Enabled, jsonString, MD5(jsonString) jsonHash
+		FROM pfce_MESJsonProperty
+		WHERE TRIM(LEADING '0' FROM JSON_UNQUOTE(jsonString->"$.AUFNR")) = ?
+	"""
+	rows = system.db.runPrepQuery(sql_query, [str(workOrderName).lstrip("0")], DATABASE)
+	
+	for row in rows:
+		shredProperty(row["MESPropertyUUID"], row["jsonString"], row["Enabled"], row["jsonHash"])
+	
+	return len(rows)
+
+
+#==========================================================
+# Shreds work orders of IDocs received since last call
+# (sap_idocs_received.id), first call only remembers newest id,
+# older IDocs are covered by syncWorkOrders passes
+# Returns number of shredded rows
+#==========================================================
+def syncReceivedIdocs(batchSize=200):
+	if _state["lastIdocId"] is None:
+		_state["lastIdocId"] = system.db.runScalarQuery("SELECT IFNULL(MAX(id), 0) FROM sap_idocs_received", IDOC_DATABASE)
+		return 0
+	
+	sql_query = """
+		SELECT id, v_aufnr
+		FROM sap_idocs_received
+		WHERE id > ?
+		ORDER BY id
+		LIMIT """ + str(int(batchSize))
+	rows = system.db.runPrepQuery(sql_query, [_state["lastIdocId"]], IDOC_DATABASE)
+	
+	shredded = 0
+	for workOrderName in set([row["v_aufnr"] for row in rows if row["v_aufnr"]]):
+		try:
+			shredded += shredWorkOrder(workOrderName)
+		except:
+			system.util.getLogger("MES-IDoc").warn("Shredding failed for work order " + str(workOrderName))
+	
+	if len(rows) > 0:
+		_state["lastIdocId"] = rows[len(rows) - 1]["id"]
+	
+	return shredded
+
+
+#==========================================================
+# Checks next batchSize pfce_MESJsonProperty rows (ordered by
+# MESPropertyUUID, continuing after last key seen) and shreds
+# new, changed (MD5 of jsonString) or enabled / disabled ones
+# After last batch work orders removed from MES are deleted and
+# next call starts from first key again
+# Rows failing FAILURE_LIMIT times are parked (logged, skipped)
+# until their jsonString changes
+# Returns number of shredded rows
+#==========================================================
+def syncWorkOrders(batchSize=200):
+	_ensureTables()
+	logger = system.util.getLogger("MES-IDoc")
+	
+	sql_query = """
+		SELECT p.MESPropertyUUID, IF(p.Enabled, 1, 0) enabled, MD5(p.jsonString) jsonHash,
+			h.jsonHash shreddedHash, h.enabled shreddedEnabled
+		FROM pfce_MESJsonProperty p
+		LEFT JOIN mes_wo_header h ON (h.propertyUUID = p.MESPropertyUUID)
+		WHERE p.MESPropertyUUID > ?
+		ORDER BY p.MESPropertyUUID
+		LIMIT """ + str(int(batchSize))
+	
+	rows = system.db.runPrepQuery(sql_query, [_state["lastKey"]], DATABASE)
+	
+	shredded = 0
+	for row in rows:
+		propertyUUID = row["MESPropertyUUID"]
+		jsonHash = row["jsonHash"]
+		
+		if row["shreddedHash"] == jsonHash and row["shreddedEnabled"] == row["enabled"]:
+			continue
+		
+		failure = _failures.get(propertyUUID)
+		if failure is not None and failure[0] == jsonHash and failure[1] >= FAILURE_LIMIT:
+			continue
+		
+		try:
+			jsonString = system.db.runScalarPrepQuery("SELECT jsonString FROM pfce_MESJsonProperty WHERE MESPropertyUUID = ?", [propertyUUID], DATABASE)
+			shredProperty(propertyUUID, jsonString, row["enabled"], jsonHash)
+			_failures.pop(propertyUUID, None)
+			shredded += 1
+		except:
+			count = failure[1] + 1 if failure is not None and failure[0] == jsonHash else 1
+			_failures[propertyUUID] = (jsonHash, count)
+			if count >= FAILURE_LIMIT:
+				logger.error("Shredding failed " + str(count) + " times for property " + str(propertyUUID) + ", parked until its IDoc changes")
+			else:
+				logger.warn("Shredding failed for property " + str(propertyUUID))
+	
+	if len(rows) == int(batchSize):
+		_state["lastKey"] = rows[len(rows) - 1]["MESPropertyUUID"]
+		return shredded
+	
+	# pass over all properties done, work orders removed from MES
+	for table in ["mes_wo_component", "mes_wo_operation", "mes_wo_header"]:
+		system.db.runUpdateQuery("""
+			DELETE t FROM """ + table + """ t
+			LEFT JOIN pfce_MESJsonProperty p ON (p.MESPropertyUUID = t.propertyUUID)
+			WHERE p.MESPropertyUUID IS NULL
+		""", DATABASE)
+	
+	_state["lastKey"] = ""
+	_state["passes"] += 1
+	
+	return shredded
+
+
+#==========================================================
+# One sync run on gateway thread: received IDocs first,
+# then syncWorkOrders batches for at most SYNC_BUDGET seconds
+#==========================================================
+def syncNow(batchSize=200):
+	started = time.time()
+	
+	# not all gateways have factory_sap
+	try:
+		syncReceivedIdocs(batchSize)
+	except:
+		pass
+	
+	passes = _state["passes"]
+	while time.time() - started < SYNC_BUDGET:
+		syncWorkOrders(batchSize)
+		if _state["passes"] != passes:
+			break
+
+
+class _SyncTask(Runnable):
+	
+	def run(self):
+		try:
+			syncNow()
+		except:
+			system.util.getLogger("MES-IDoc").warn("Work order sync failed")
+
+
+#==========================================================
+# Starts sync of shredded tables on gateway thread (every
+# SYNC_INTERVAL seconds), called by mes.workorder readers
+# Sync of previous script load is stopped
+#==========================================================
+def start():
+	with _lock:
+		if _state["executor"] is not None:
+			return
+	
+	previousStop = system.util.getGlobals().get(_GLOBALS_KEY)
+	if previousStop is not None and previousStop is not stop:
+		try:
+			previousStop()
+		except:
+			pass
+	
+	with _lock:
+		if _state["executor"] is not None:
+			return
+		
+		executor = Executors.newSingleThreadScheduledExecutor()
+		executor.scheduleWithFixedDelay(_SyncTask(), 0, long(SYNC_INTERVAL * 1000), TimeUnit.MILLISECONDS)
+		
+		_state["executor"] = executor
+		system.util.getGlobals()[_GLOBALS_KEY] = stop
+
+
+def stop(timeout=30.0):
+	with _lock:
+		executor = _state["executor"]
+		_state["executor"] = None
+	
+	if executor is None:
+		return
+	
+	executor.shutdown()
+	executor.awaitTermination(long(timeout * 1000), TimeUnit.MILLISECONDS)
+
+
+#==========================================================
+# Returns parked properties (propertyUUID: (jsonHash, failures))
+#==========================================================
+def getParkedProperties():
+	return dict([(key, value) for key, value in _failures.items() if value[1] >= FAILURE_LIMIT])
@@ -14,35 +14,8 @@ def getStateCode(ignitionTagPath, stateName):
 	stateCode: str
 		state code
 	"""	
-	def searchForStateCode(json, key):
-		array = []
-	
-		def extract(json, array, key):
-			result =  None
-			
-			if isinstance(json, dict):
-				for k, v in json.items():
-					if isinstance(v, dict):
-						extract(v, array, key)
-					if k == key:
-						result = v["Code"]
-						array.append(result)
-	
-			return array
-			
-		results = extract(json, array, key)
-	
-		return results
-
-
-	statesDefinitionValues = system.tag.read(ignitionTagPath + "/mes/param_statesJson").value
-	statesDefinitionValues = system.util.jsonDecode(statesDefinitionValues)
-	stateCode = searchForStateCode(statesDefinitionValues, stateName)
-	
-	if len(stateCode)  > 0:
-		return stateCode[0]
-	else:
-		return None
+	# compiled from param_statesJson once per equipment (see shared.mes.equipment.getStateIndex)
+	return shared.mes.equipment.getStateIndex(ignitionTagPath)["byName"].get(stateName)
 
 
 def setStateOnEquipment(ignitionTagPath, stateName):
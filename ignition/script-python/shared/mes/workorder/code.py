@@ -41,9 +41,144 @@
 # Change log:
 # - Modifiction of stepMaterials and getSAPProductionStepDetails with ISO UOM
 # - Modification of data retrival for materialDescription and measureUnits
+#
+# V1.9
+# Change log:
+# - getSAPProductionStepDetails and getStepMaterials read shredded tables (mes.idoc)
+#   instead of JSON_EXTRACT over idx 0..31, no more operations / components lost above index 31
+# - Added work order detail cache (LRU, invalidated on new IDoc version), see getCacheStats
+# - Added getWorkOrdersPage / iterWorkOrders (paginated, indexed filters)
 #===============================================
 #===============================================
 
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+
+#==========================================================
+# Work order detail cache (gateway scope)
+# Key: (function, work order, workcenter, operation, fields...)
+# LRU with size cap, entries of a work order are dropped when
+# its shredded version changes (jsonHash / enabled of its
+# mes_wo_header rows, read through index ix_workOrder) or when
+# mes.idoc shreds it again on this gateway
+#==========================================================
+CACHE_MAX_ENTRIES = 500
+# version of a work order is checked at most once per interval (s)
+CACHE_VERSION_CHECK_INTERVAL = 5.0
+
+_cache = OrderedDict()
+_cacheVersions = {}
+_cacheStats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+_cacheLock = threading.Lock()
+
+
+def _workOrderVersion(workOrderName):
+	# shredded copy kept up to date by mes.idoc, hashes are stored there
+	sql_query = """SELECT GROUP_CONCAT(propertyUUID, jsonHash, enabled ORDER BY propertyUUID)
+					FROM mes_wo_header WHERE workOrderName = ?"""
+	return system.db.runScalarPrepQuery(sql_query, [workOrderName], "mes_analysis")
+
+
+def _cacheGet(key):
+	workOrderName = key[1]
+	
+	if not isinstance(workOrderName, basestring):
+		return None
+	
+	now = time.time()
+	
+	with _cacheLock:
+		checked = _cacheVersions.get(workOrderName)
+		checkRequired = checked is None or now - checked[1] > CACHE_VERSION_CHECK_INTERVAL
+	
+	if checkRequired:
+		# versions only move while shredded tables are synced
+		shared.mes.idoc.start()
+		version = _workOrderVersion(workOrderName)
+		
+		with _cacheLock:
+			if checked is not None and checked[0] != version:
+				_dropWorkOrder(workOrderName)
+			_cacheVersions[workOrderName] = (version, now)
+	
+	with _cacheLock:
+		if key in _cache:
+			value = _cache.pop(key)
+			_cache[key] = value
+			_cacheStats["hits"] += 1
+			return copy.deepcopy(value) if isinstance(value, dict) else value
+		
+		_cacheStats["misses"] += 1
+	
+	return None
+
+
+def _cachePut(key, value):
+	if not isinstance(key[1], basestring) or value is None:
+		return value
+	
+	with _cacheLock:
+		_cache.pop(key, None)
+		_cache[key] = copy.deepcopy(value) if isinstance(value, dict) else value
+		
+		while len(_cache) > CACHE_MAX_ENTRIES:
+			_cache.popitem(last=False)
+			_cacheStats["evictions"] += 1
+	
+	return value
+
+
+def _dropWorkOrder(workOrderName):
+	# call with _cacheLock held
+	for key in [key for key in _cache if key[1] == workOrderName]:
+		del _cache[key]
+		_cacheStats["invalidations"] += 1
+
+
+def _fieldsKey(fields):
+	if fields is None or isinstance(fields, basestring):
+		return fields
+	return tuple(fields)
+
+
+#==========================================================
+# Drops cached details of work order (all if None)
+# Called by mes.idoc when work order is shredded again
+#==========================================================
+def invalidateWorkOrder(workOrderName=None):
+	with _cacheLock:
+		if workOrderName is None:
+			_cacheStats["invalidations"] += len(_cache)
+			_cache.clear()
+			_cacheVersions.clear()
+		else:
+			_dropWorkOrder(str(workOrderName))
+			_cacheVersions.pop(str(workOrderName), None)
+
+
+#==========================================================
+# Returns cache statistics (hits, misses, evictions,
+# invalidations, entries, hitRate)
+#==========================================================
+def getCacheStats():
+	with _cacheLock:
+		stats = dict(_cacheStats)
+		stats["entries"] = len(_cache)
+	
+	lookups = stats["hits"] + stats["misses"]
+	stats["hitRate"] = float(stats["hits"]) / lookups if lookups > 0 else 0.0
+	
+	return stats
+
+
+def resetCacheStats():
+	with _cacheLock:
+		for key in _cacheStats:
+			_cacheStats[key] = 0
+
 
 #==========================================================
 # this fuction will get ENABLED Work orders from MES
@@ -59,13 +194,10 @@ def getOrdersByText(searchText):
 
 
 #==========================================================
-# Returns key SAP data from MES PFCE table
-# All parameters are optional
-# No param = all WO, all fields
+# Field options of getWorkOrders (column expression on jsonString)
 #==========================================================
-def getWorkOrders( workOrderName=None, workOrderNameFilter=None, equipmentPathFilter=None, materialNameFilter=None, fields=None):
+def _workOrderOptions():
 
-	# options
 	options={}
 	options["name"] = 		"""TRIM(BOTH '"' FROM CAST(jsonString->"$.AUFNR" AS CHAR CHARACTER SET utf8))"""
 	#options["description"]= """TRIM(BOTH '"' FROM CAST(jsonString->"$.E1AFLTH[*].E1AFLTP[*].TDLINE" AS CHAR CHARACTER SET utf8))"""
@@ -126,6 +258,24 @@ def getWorkOrders( workOrderName=None, workOrderNameFilter=None, equipmentPathFi
 	options['confirmationISOUnits'] = """TRIM(BOTH '"' FROM CAST(jsonString->'$.ZE1AFKOL.H_ISOCODE_UM' AS CHAR CHARACTER SET utf8))"""
 	options['materialInstance'] = """TRIM(BOTH '"' FROM CAST(jsonString->'$.ZE1AFKOL.INSTANCE' AS CHAR CHARACTER SET utf8))"""
 	options['productGroup'] = """TRIM(BOTH '"' FROM CAST(jsonString->'$.ZE1AFKOL.SATNR' AS CHAR CHARACTER SET utf8))"""
+
+	return options
+
+#==========================================================
+# Returns key SAP data from MES PFCE table
+# All parameters are optional
+# No param = all WO, all fields
+#==========================================================
+def getWorkOrders( workOrderName=None, workOrderNameFilter=None, equipmentPathFilter=None, materialNameFilter=None, fields=None):
+
+	# only single work order requests are cached
+	cacheKey = ("getWorkOrders", workOrderName, _fieldsKey(fields))
+	dataset = _cacheGet(cacheKey)
+	if dataset is not None:
+		return dataset
+
+	# options
+	options = _workOrderOptions()
 	
 
 	# BUILD SELECT
@@ -179,7 +329,110 @@ def getWorkOrders( workOrderName=None, workOrderNameFilter=None, equipmentPathFi
 	sql_query = "SELECT " + selectClause + """ FROM pfce_MESJsonProperty where jsonString->"$.AUFNR" """ + inClause
 	dataset = system.db.runPrepQuery(sql_query, database="mes_analysis")
 
-	return dataset
+	return _cachePut(cacheKey, dataset)
+
+#==========================================================
+# Turns user filter to LIKE pattern: * is the only wildcard,
+# % and _ are matched literally
+#==========================================================
+def _likePattern(value):
+	value = unicode(value).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+	return value.replace("*", "%")
+
+#==========================================================
+# Returns one page of work orders from shredded header table (mes.idoc)
+# Filters use indexed columns instead of MES filter enumeration:
+# workOrderNameFilter / materialNameFilter accept * as wildcard
+# plant - WERKS, workCenter - ARBPL of any operation
+# fields - same field names as getWorkOrders
+# cursor - returned by previous page, None for first page
+# Returns (dataset, cursor), cursor is None after last page
+#==========================================================
+def getWorkOrdersPage(workOrderNameFilter=None, materialNameFilter=None, plant=None, workCenter=None, fields=None, pageSize=500, cursor=None, enabledOnly=True):
+
+	options = _workOrderOptions()
+
+	# fields available in header table, others are read from json of returned rows only
+	options["name"] = 					"h.workOrderName"
+	options["quantity"] = 				"CAST(h.quantity AS DECIMAL)"
+	options["units"] = 					"h.units"
+	options["material"] = 				"h.material"
+	options["materialDescription"] = 	"""IFNULL(h.materialDescription, "")"""
+	options["type"] = 					"h.type"
+	options["category"] = 				"h.category"
+	options["dueDate"] = 				"h.dueDate"
+	options["plant"] = 					"h.plant"
+	options["storage"] = 				"h.mainMaterialStorage"
+
+	if fields==None:
+		fields = options.keys()
+	else:
+		for field in fields:
+			if field not in options.keys():
+				raise ValueError("getWorkOrdersPage: syntax error in the field name : " + field)
+
+	myList = ["h.workOrderName cursorName", "h.propertyUUID cursorUUID"]
+	for field in fields:
+		myList.append( options[field] + " " + field )
+	selectClause = ",".join( myList )
+
+	whereClause = ""
+	args = []
+
+	if enabledOnly:
+		whereClause += " AND h.enabled = 1"
+	if workOrderNameFilter:
+		whereClause += " AND h.workOrderName LIKE ?"
+		args.append(_likePattern(workOrderNameFilter))
+	if materialNameFilter:
+		whereClause += " AND h.material LIKE ?"
+		args.append(_likePattern(materialNameFilter))
+	if plant:
+		whereClause += " AND h.plant = ?"
+		args.append(str(plant))
+	if workCenter:
+		whereClause += " AND EXISTS (SELECT 1 FROM mes_wo_operation o WHERE o.propertyUUID = h.propertyUUID AND o.workCenter = ?)"
+		args.append(str(workCenter))
+	if cursor:
+		# keyset pagination, no OFFSET scans
+		whereClause += " AND (h.workOrderName > ? OR (h.workOrderName = ? AND h.propertyUUID > ?))"
+		args.extend([cursor[0], cursor[0], cursor[1]])
+
+	# header table follows new / changed IDocs on gateway thread
+	shared.mes.idoc.start()
+
+	sql_query = "SELECT " + selectClause + """
+					FROM mes_wo_header h
+					JOIN pfce_MESJsonProperty ON (pfce_MESJsonProperty.MESPropertyUUID = h.propertyUUID)
+					WHERE 1=1 """ + whereClause + """
+					ORDER BY h.workOrderName, h.propertyUUID
+					LIMIT """ + str(int(pageSize))
+
+	dataset = system.db.runPrepQuery(sql_query, args, "mes_analysis")
+
+	nextCursor = None
+	if dataset.getRowCount() == int(pageSize):
+		last = dataset.getRowCount() - 1
+		nextCursor = [dataset.getValueAt(last, "cursorName"), dataset.getValueAt(last, "cursorUUID")]
+
+	return system.dataset.filterColumns(dataset, list(fields)), nextCursor
+
+
+#==========================================================
+# Yields work orders page by page (dataset per page),
+# parameters same as getWorkOrdersPage
+# Example:
+#   for page in iterWorkOrders(plant="1234", fields=["name", "material"]):
+#       ...
+#==========================================================
+def iterWorkOrders(workOrderNameFilter=None, materialNameFilter=None, plant=None, workCenter=None, fields=None, pageSize=500, enabledOnly=True):
+	cursor = None
+	while True:
+		page, cursor = getWorkOrdersPage(workOrderNameFilter, materialNameFilter, plant, workCenter, fields, pageSize, cursor, enabledOnly)
+		if page.getRowCount() > 0:
+			yield page
+		if cursor is None:
+			return
 
 #==========================================================
 # Returns production step data from MES PFCE table
@@ -288,8 +541,8 @@ def getProductionStep_old(workOrderName=None, workCenter=None, operationNumber=N
 	return dataset
 
 #==========================================================
-# Returns production step data from MES PFCE table
-# workOrderName not mandatory searching with like
+# Returns production step data from shredded work order tables (mes.idoc)
+# workOrderName not mandatory
 # workCenter - ARBPL - not mandatory
 # operationNumber - VORNR - not mandatory
 # fields - fields that we want to have
@@ -298,52 +551,53 @@ def getProductionStep_old(workOrderName=None, workCenter=None, operationNumber=N
 #==========================================================
 def getSAPProductionStepDetails(workOrderName=None, workCenter=None, operationNumber=None, fields=None, order=None, limit=None):
 
+	cacheKey = ("getSAPProductionStepDetails", workOrderName, workCenter, operationNumber, _fieldsKey(fields), order, limit)
+	dataset = _cacheGet(cacheKey)
+	if dataset is not None:
+		return dataset
+
 	# options
 	options={}
-	options["workOrderName"] = 		"""TRIM(BOTH '"' FROM CAST(jsonString->"$.AUFNR" AS CHAR CHARACTER SET utf8))"""
-	options["operationNumber"] = 	"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].VORNR')) AS CHAR CHARACTER SET utf8))"""
-	options["stepDescription"]= 	"""IFNULL(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].ZE1AFVOL_TX[*].TDLINE')), "[]") """
-	options["workCenter"] =  	 	"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].ARBPL')) AS CHAR CHARACTER SET utf8))"""
-	options["operationQuantity"] = 	"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].MGVRG')) AS CHAR CHARACTER SET utf8))"""
-	options["operationUnits"] = 	"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].MEINH')) AS CHAR CHARACTER SET utf8))"""
-	options["material"] = 	"""TRIM(BOTH '"' FROM CAST(jsonString->"$.MATNR" AS CHAR CHARACTER SET utf8))"""
-	## Changed by 2021-02-15 Patrik Pusnik SDSGA-3966 
-	#options["materialDescription"] = """IFNULL(TRIM(BOTH '"' FROM CAST(jsonString->"$.MATNR_EXTERNAL" AS CHAR CHARACTER SET utf8)), "") """
-	options["materialDescription"] = """IFNULL(CAST(JSON_UNQUOTE(jsonString->"$.MATNR_EXTERNAL") AS CHAR CHARACTER SET utf8), "")"""
-	## Changed by Izi&Patrik - Synchornizing all instances
-	#options["operationStatus"] =	"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].STAT')) AS CHAR CHARACTER SET utf8))"""
-	options["operationStatus"] =	"""IFNULL(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].E1JSTVL[*].STAT')), "[]") """
-	options["shortText"] = 			"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].LTXA1')) AS CHAR CHARACTER SET utf8))"""
-	options["earliestStartDate"] = 	"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].FSADV')) AS CHAR CHARACTER SET utf8))"""
-	options["earliestStartTime"] = 	"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].FSAVZ')) AS CHAR CHARACTER SET utf8))"""
-	options["earliestFinishDate"] = """TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].FSEDD')) AS CHAR CHARACTER SET utf8))"""
-	options["earliestFinishTime"] = """TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].FSEDZ')) AS CHAR CHARACTER SET utf8))"""
-	options["confirmationNumber"] = """TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].ZE1AFVOL.ZZRUECK')) AS CHAR CHARACTER SET utf8))"""
-	options["processingTime"] = 	"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].BEARZ')) AS CHAR CHARACTER SET utf8))"""
-	options["processingTimeUnit"] = """TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].BEAZE')) AS CHAR CHARACTER SET utf8))"""
-	options["waitTime"] = 			"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].LIEGZ')) AS CHAR CHARACTER SET utf8))"""
-	options["waitTimeUnit"] = 		"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].LIGZE')) AS CHAR CHARACTER SET utf8))"""
+	options["workOrderName"] = 		"h.workOrderName"
+	options["operationNumber"] = 	"o.operationNumber"
+	options["stepDescription"]= 	"""IFNULL(o.stepDescription, "[]")"""
+	options["workCenter"] =  	 	"o.workCenter"
+	options["operationQuantity"] = 	"o.operationQuantity"
+	options["operationUnits"] = 	"o.operationUnits"
+	options["material"] = 			"h.material"
+	options["materialDescription"] = """IFNULL(h.materialDescription, "")"""
+	options["operationStatus"] =	"""IFNULL(o.operationStatus, "[]")"""
+	options["shortText"] = 			"o.shortText"
+	options["earliestStartDate"] = 	"o.earliestStartDate"
+	options["earliestStartTime"] = 	"o.earliestStartTime"
+	options["earliestFinishDate"] = "o.earliestFinishDate"
+	options["earliestFinishTime"] = "o.earliestFinishTime"
+	options["confirmationNumber"] = "o.confirmationNumber"
+	options["processingTime"] = 	"o.processingTime"
+	options["processingTimeUnit"] = "o.processingTimeUnit"
+	options["waitTime"] = 			"o.waitTime"
+	options["waitTimeUnit"] = 		"o.waitTimeUnit"
 	
-	options["setupTime"] = 			"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].VGW01')) AS CHAR CHARACTER SET utf8))"""
-	options["setupTimeUnit"] = 		"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].VGE01')) AS CHAR CHARACTER SET utf8))"""
-	options["machineTime"] = 		"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].VGW02')) AS CHAR CHARACTER SET utf8))"""
-	options["machineTimeUnit"] = 	"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].VGE02')) AS CHAR CHARACTER SET utf8))"""
-	options["laborTime"] = 			"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].VGW03')) AS CHAR CHARACTER SET utf8))"""
-	options["laborTimeUnit"] = 		"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].VGE03')) AS CHAR CHARACTER SET utf8))"""
+	options["setupTime"] = 			"o.setupTime"
+	options["setupTimeUnit"] = 		"o.setupTimeUnit"
+	options["machineTime"] = 		"o.machineTime"
+	options["machineTimeUnit"] = 	"o.machineTimeUnit"
+	options["laborTime"] = 			"o.laborTime"
+	options["laborTimeUnit"] = 		"o.laborTimeUnit"
 	
-	options["interoperationTime"] = """TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].TRANZ')) AS CHAR CHARACTER SET utf8))"""
-	options["queueTime"] = 			"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].WARTZ')) AS CHAR CHARACTER SET utf8))"""
-	options["queueTimeUnit"] = 		"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].WRTEZ')) AS CHAR CHARACTER SET utf8))"""
+	options["interoperationTime"] = "o.interoperationTime"
+	options["queueTime"] = 			"o.queueTime"
+	options["queueTimeUnit"] = 		"o.queueTimeUnit"
 	
-	options["controlKey"] =  	 	"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].STEUS')) AS CHAR CHARACTER SET utf8))"""
-	options["units"] = 		"""TRIM(BOTH '"' FROM CAST(jsonString->"$.BMEINS" AS CHAR CHARACTER SET utf8))"""
-	options['basicFinishDate'] = """TRIM(BOTH '"' FROM CAST(jsonString->'$.GLTRP' AS CHAR CHARACTER SET utf8))"""
-	options['basicStartDate'] = """TRIM(BOTH '"' FROM CAST(jsonString->'$.GSTRP' AS CHAR CHARACTER SET utf8))"""
-	options["dueDate"] = 	"""TRIM(BOTH '"' FROM CAST(jsonString->"$.GLTRS" AS CHAR CHARACTER SET utf8))"""
-	options["quantity"] = 	"""CAST(jsonString->"$.BMENGE" AS DECIMAL)"""
-
-	options['aionData'] = """TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].ZE1AFVOL_MES_DATA')) AS CHAR CHARACTER SET utf8))"""
-	options['baseOperationQuantity'] = """TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].BMSCH')) AS CHAR CHARACTER SET utf8))"""
+	options["controlKey"] =  	 	"o.controlKey"
+	options["units"] = 				"h.units"
+	options['basicFinishDate'] = 	"h.basicFinishDate"
+	options['basicStartDate'] = 	"h.basicStartDate"
+	options["dueDate"] = 			"h.dueDate"
+	options["quantity"] = 			"CAST(h.quantity AS DECIMAL)"
+
+	options['aionData'] = 			"o.aionData"
+	options['baseOperationQuantity'] = "o.baseOperationQuantity"
 	
 	
 	
@@ -370,16 +624,20 @@ def getSAPProductionStepDetails(workOrderName=None, workCenter=None, operationNu
 	inClause = ""
 	orderClause = ""
 	limitClause = ""
+	args = []
+
+	# shredded tables follow new / changed IDocs on gateway thread
+	shared.mes.idoc.start()
 
 	if workOrderName:
-		inClause = inClause + """ AND jsonString->"$.AUFNR" = """ +"\""+ workOrderName + "\""
-	if workCenter and operationNumber:
-		inClause = inClause + """ AND (JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].ARBPL')) = """ +"\""+ str(workCenter) + "\""
-		inClause = inClause + """ AND JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].VORNR')) = """ +"\""+ operationNumber + "\")"
-	elif workCenter:
-		inClause = inClause + """ AND JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].ARBPL')) = """ +"\""+ str(workCenter) + "\""
-	elif operationNumber:
-		inClause = inClause + """ AND JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].VORNR')) = """ +"\""+ operationNumber + "\""
+		inClause = inClause + " AND h.workOrderName = ?"
+		args.append(str(workOrderName))
+	if workCenter:
+		inClause = inClause + " AND o.workCenter = ?"
+		args.append(str(workCenter))
+	if operationNumber:
+		inClause = inClause + " AND o.operationNumber = ?"
+		args.append(str(operationNumber))
 
 
 	if order:
@@ -391,83 +649,48 @@ def getSAPProductionStepDetails(workOrderName=None, workCenter=None, operationNu
 	# Retrieve data
 
 	sql_query = " SELECT "+ selectClause + """
+					FROM mes_wo_operation o
+					JOIN mes_wo_header h ON (h.propertyUUID = o.propertyUUID)
+					WHERE h.enabled = 1 """ + inClause + orderClause + limitClause
 
-					FROM pfce_MESJsonProperty
-					JOIN (
-						SELECT  0 AS idx UNION
-						SELECT  1 AS idx UNION
-						SELECT  2 AS idx UNION
-						SELECT  3 AS idx UNION
-						SELECT  4 AS idx UNION
-						SELECT  5 AS idx UNION
-						SELECT  6 AS idx UNION
-						SELECT  7 AS idx UNION
-						SELECT  8 AS idx UNION
-						SELECT  9 AS idx UNION
-						SELECT  10 AS idx UNION
-						SELECT  11 AS idx UNION
-						SELECT  12 AS idx UNION
-						SELECT  13 AS idx UNION
-						SELECT  14 AS idx UNION
-						SELECT  15 AS idx UNION
-						SELECT  16 AS idx UNION
-						SELECT  17 AS idx UNION
-						SELECT  18 AS idx UNION
-						SELECT  19 AS idx UNION
-						SELECT  20 AS idx UNION
-						SELECT  21 AS idx UNION
-						SELECT  22 AS idx UNION
-						SELECT  23 AS idx UNION
-						SELECT  24 AS idx UNION
-						SELECT  25 AS idx UNION
-						SELECT  26 AS idx UNION
-						SELECT  27 AS idx UNION
-						SELECT  28 AS idx UNION
-						SELECT  29 AS idx UNION
-						SELECT  30 AS idx UNION
-						SELECT  31
-					  ) AS indexes
-						WHERE Enabled=1 AND
-							JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, ']')) IS NOT NULL """ + inClause + orderClause + limitClause
 
-
-	dataset = system.db.runPrepQuery(query=sql_query, database="mes_analysis")
-	return dataset
+	dataset = system.db.runPrepQuery(query=sql_query, args=args, database="mes_analysis")
+	return _cachePut(cacheKey, dataset)
 
 #==========================================================
-# Returns production step data that contains material consumption from MES PFCE table
+# Returns production step data that contains material consumption from shredded work order tables (mes.idoc)
 # workOrderName mandatory - work order for wich we are checking the existance of the material
 # other parameters not mandatory
 #==========================================================
 def getStepMaterials( workOrderName=None,workCenter=None, operationNumber=None, fields=None, order=None):
 
+	cacheKey = ("getStepMaterials", workOrderName, workCenter, operationNumber, _fieldsKey(fields), order)
+	dataset = _cacheGet(cacheKey)
+	if dataset is not None:
+		return dataset
+
 	# options
 	options={}
-	options["operationNumber"] = 	"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].VORNR')) AS CHAR CHARACTER SET utf8))"""
-	#options["stepDescription"]= 	"""IFNULL(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].ZE1AFVOL_TX[*].TDLINE')), "[]") """
-	options["workCenter"] =  	 	"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].ARBPL')) AS CHAR CHARACTER SET utf8))"""
-
-	options["requiredQuantity"] =  	 	"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].E1RESBL[', idy, '].BDMNG')) AS CHAR CHARACTER SET utf8))"""
-	## Changed by Patrik Pusnik 2021-02-15 SDSGA-3966
-	#options["measureUnit"] =  	 		"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].E1RESBL[', idy, '].MEINS')) AS CHAR CHARACTER SET utf8))"""
-	options["measureUnit"] =  	 		"""CAST(JSON_UNQUOTE(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].E1RESBL[', idy, '].MEINS'))) AS CHAR CHARACTER SET utf8)"""
-	options["materialNumber"] =  	 	"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].E1RESBL[', idy, '].MATNR')) AS CHAR CHARACTER SET utf8))"""
-	## Changed by Patrik Pusnik 2021-02-15 SDSGA-3966
-	#options["materialDescription"] =  	"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].E1RESBL[', idy, '].MATNR_EXTERNAL')) AS CHAR CHARACTER SET utf8))"""
-	options["materialDescription"] =  	"""CAST(JSON_UNQUOTE(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].E1RESBL[', idy, '].MATNR_EXTERNAL'))) AS CHAR CHARACTER SET utf8)"""
-	options["consumMaterialStorage"] = 	"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].E1RESBL[', idy, '].LGORT')) AS CHAR CHARACTER SET utf8))"""
-	options["itemCategory"] = 			"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].E1RESBL[', idy, '].POSTP')) AS CHAR CHARACTER SET utf8))"""
-	options["mainMaterialStorage"] = 	"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFPOL.LGORT')) AS CHAR CHARACTER SET utf8))"""
-	options["priceUnit"] = 				"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].E1RESBL[', idy, '].ZRESBLAD.PEINH')) AS CHAR CHARACTER SET utf8))"""
-	options["movingPrice"] = 			"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].E1RESBL[', idy, '].ZRESBLAD.VERPR')) AS CHAR CHARACTER SET utf8))"""
-	options["currency"] = 				"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].E1RESBL[', idy, '].ZRESBLAD.WAERS')) AS CHAR CHARACTER SET utf8))"""
-	options["standardPrice"] =			"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].E1RESBL[', idy, '].ZRESBLAD.STPRS')) AS CHAR CHARACTER SET utf8))"""
-	options["batchNumber"] =			"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].E1RESBL[', idy, '].CHARG')) AS CHAR CHARACTER SET utf8))"""
-
-	options["backflushFlag"] = 			"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].E1RESBL[', idy, '].ZRESBLAD.RGEKZ')) AS CHAR CHARACTER SET utf8))"""
-	options["confirmationUnits"] = 		"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].E1RESBL[', idy, '].ZRESBLAD.I_ISOCODE_UM')) AS CHAR CHARACTER SET utf8))"""
-	options["materialInstance"] = 		"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].E1RESBL[', idy, '].ZRESBLAD.C_INSTANCE')) AS CHAR CHARACTER SET utf8))"""
-	options["managedByBatch"] = 		"""TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].E1RESBL[', idy, '].ZE1RESBL.SPLKZ')) AS CHAR CHARACTER SET utf8))"""
+	options["operationNumber"] = 		"c.operationNumber"
+	options["workCenter"] =  	 		"c.workCenter"
+
+	options["requiredQuantity"] =  	 	"c.requiredQuantity"
+	options["measureUnit"] =  	 		"c.measureUnit"
+	options["materialNumber"] =  	 	"c.materialNumber"
+	options["materialDescription"] =  	"c.materialDescription"
+	options["consumMaterialStorage"] = 	"c.consumMaterialStorage"
+	options["itemCategory"] = 			"c.itemCategory"
+	options["mainMaterialStorage"] = 	"h.mainMaterialStorage"
+	options["priceUnit"] = 				"c.priceUnit"
+	options["movingPrice"] = 			"c.movingPrice"
+	options["currency"] = 				"c.currency"
+	options["standardPrice"] =			"c.standardPrice"
+	options["batchNumber"] =			"c.batchNumber"
+
+	options["backflushFlag"] = 			"c.backflushFlag"
+	options["confirmationUnits"] = 		"c.confirmationUnits"
+	options["materialInstance"] = 		"c.materialInstance"
+	options["managedByBatch"] = 		"c.managedByBatch"
 	
 	
 	# BUILD SELECT
@@ -492,102 +715,31 @@ def getStepMaterials( workOrderName=None,workCenter=None, operationNumber=None,
 
 	inClause = ""
 	orderClause = ""
+	args = [str(workOrderName)]
 	
 	if order:
 		orderClause = " ORDER BY " + order
 	elif fields:
 		orderClause = " ORDER BY " + fields[0]
 	
-		
-	
+	if workCenter:
+		inClause = inClause + " AND c.workCenter = ?"
+		args.append(str(workCenter))
+	if operationNumber:
+		inClause = inClause + " AND c.operationNumber = ?"
+		args.append(str(operationNumber))
 
-	if workCenter and operationNumber:
-		inClause = inClause + """ AND (JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].ARBPL')) = """ +"\""+ str(workCenter) + "\""
-		inClause = inClause + """ AND JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].VORNR')) = """ +"\""+ operationNumber + "\")"
-	elif workCenter:
-		inClause = inClause + """ AND JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].ARBPL')) = """ +"\""+ str(workCenter) + "\""
-	elif operationNumber:
-		inClause = inClause + """ AND JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].VORNR')) = """ +"\""+ operationNumber + "\""
+	# shredded tables follow new / changed IDocs on gateway thread
+	shared.mes.idoc.start()
 
 	# Retrieve data
-
-	# EDIT DOMI : changed pfce_mesjsonpropery to pfce_MESJsonProperty
 	sql_query = " SELECT "+ selectClause + """
-					FROM pfce_MESJsonProperty
-					JOIN (
-						SELECT  0 AS idx UNION
-						SELECT  1 AS idx UNION
-						SELECT  2 AS idx UNION
-						SELECT  3 AS idx UNION
-						SELECT  4 AS idx UNION
-						SELECT  5 AS idx UNION
-						SELECT  6 AS idx UNION
-						SELECT  7 AS idx UNION
-						SELECT  8 AS idx UNION
-						SELECT  9 AS idx UNION
-						SELECT  10 AS idx UNION
-						SELECT  11 AS idx UNION
-						SELECT  12 AS idx UNION
-						SELECT  13 AS idx UNION
-						SELECT  14 AS idx UNION
-						SELECT  15 AS idx UNION
-						SELECT  16 AS idx UNION
-						SELECT  17 AS idx UNION
-						SELECT  18 AS idx UNION
-						SELECT  19 AS idx UNION
-						SELECT  20 AS idx UNION
-						SELECT  21 AS idx UNION
-						SELECT  22 AS idx UNION
-						SELECT  23 AS idx UNION
-						SELECT  24 AS idx UNION
-						SELECT  25 AS idx UNION
-						SELECT  26 AS idx UNION
-						SELECT  27 AS idx UNION
-						SELECT  28 AS idx UNION
-						SELECT  29 AS idx UNION
-						SELECT  30 AS idx UNION
-					  SELECT  31
-					  ) AS steeps
-					JOIN (
-						SELECT  0 AS idy UNION
-						SELECT  1 AS idy UNION
-						SELECT  2 AS idy UNION
-						SELECT  3 AS idy UNION
-						SELECT  4 AS idy UNION
-						SELECT  5 AS idy UNION
-						SELECT  6 AS idy UNION
-						SELECT  7 AS idy UNION
-						SELECT  8 AS idy UNION
-						SELECT  9 AS idy UNION
-						SELECT  10 AS idy UNION
-						SELECT  11 AS idy UNION
-						SELECT  12 AS idy UNION
-						SELECT  13 AS idy UNION
-						SELECT  14 AS idy UNION
-						SELECT  15 AS idy UNION
-						SELECT  16 AS idy UNION
-						SELECT  17 AS idy UNION
-						SELECT  18 AS idy UNION
-						SELECT  19 AS idy UNION
-						SELECT  20 AS idy UNION
-						SELECT  21 AS idy UNION
-						SELECT  22 AS idy UNION
-						SELECT  23 AS idy UNION
-						SELECT  24 AS idy UNION
-						SELECT  25 AS idy UNION
-						SELECT  26 AS idy UNION
-						SELECT  27 AS idy UNION
-						SELECT  28 AS idy UNION
-						SELECT  29 AS idy UNION
-						SELECT  30 AS idy UNION
-					  SELECT  31
-					  ) AS materials
-					WHERE jsonString->"$.AUFNR" = ?
-						AND JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, ']')) IS NOT NULL
-						AND JSON_EXTRACT(jsonString, CONCAT('$.E1AFFLL.E1AFVOL[', idx, '].E1RESBL[', idy, ']')) IS NOT NULL """ + inClause + orderClause
+					FROM mes_wo_component c
+					JOIN mes_wo_header h ON (h.propertyUUID = c.propertyUUID)
+					WHERE c.workOrderName = ? """ + inClause + orderClause
 
-	dataset = system.db.runPrepQuery( query=sql_query, args=[workOrderName], database="mes_analysis")
-	return dataset
+	dataset = system.db.runPrepQuery( query=sql_query, args=args, database="mes_analysis")
+	return _cachePut(cacheKey, dataset)
 	
 	
 #==========================================================
@@ -632,6 +784,11 @@ def getProductDetails2(workOrderName, details=None):
 # details - product parameters that should be in result if None all will be prepared
 #==========================================================
 def getProductDetails(workOrderName, details=None):
+	cacheKey = ("getProductDetails", workOrderName, _fieldsKey(details))
+	dataset = _cacheGet(cacheKey)
+	if dataset is not None:
+		return dataset
+	
 	sql_query = """SELECT 
 				TRIM(BOTH '"' FROM CAST(JSON_EXTRACT(jsonString, CONCAT('$.ZMATCH')) AS CHAR CHARACTER SET utf8)) 
 				FROM pfce_MESJsonProperty 
@@ -656,9 +813,9 @@ def getProductDetails(workOrderName, details=None):
 			
 			returnDS = system.dataset.toDataSet(headers, data)
 	
-			return returnDS
+			return _cachePut(cacheKey, returnDS)
 		else:
-			return system.dataset.toDataSet(headers, [])
+			return _cachePut(cacheKey, system.dataset.toDataSet(headers, []))
 	else:
 		return dataset
 		
@@ -681,6 +838,11 @@ def getWorkOrderAionData(workOrderName=None, workCenter=None, operationNumber=No
 	if operationNumber is not None and not isinstance(operationNumber, basestring):
 		operationNumber = str(operationNumber)
 	
+	cacheKey = ("getWorkOrderAionData", workOrderName, workCenter, operationNumber, _fieldsKey(aionFields))
+	cached = _cacheGet(cacheKey)
+	if cached is not None:
+		return cached
+	
 	
 	ds = getSAPProductionStepDetails(workOrderName=workOrderName,workCenter=workCenter, operationNumber=operationNumber, fields=["aionData"])
 	# There is something wrong. Go debug.
@@ -763,4 +925,4 @@ def getWorkOrderAionData(workOrderName=None, workCenter=None, operationNumber=No
 	for field in missingFields:
 		json[field] = "Not found"
 	#print system.util.jsonEncode(json, 4)       
-	return json		
\ No newline at end of file
+	return _cachePut(cacheKey, json)		
\ No newline at end of file
@@ -112,22 +112,67 @@ from shared.mp.excel.exceptions import *
 import datetime
 
 
+def _getFormatCache(file):
+	# Per workbook cache of XF lookups: xf_index -> format string / (background, font colour) indexes
+	cache = getattr(file, "_mpFormatCache", None)
+	if cache is None:
+		cache = {"format": {}, "colors": {}}
+		file._mpFormatCache = cache
+	return cache
+
+
+def _getFormatString(file, xfIndex):
+	formats = _getFormatCache(file)["format"]
+	try:
+		return formats[xfIndex]
+	except KeyError:
+		formatStr = file.format_map[file.xf_list[xfIndex].format_key].format_str
+		formats[xfIndex] = formatStr
+		return formatStr
+
+
+def _getColorIndexes(file, xfIndex):
+	colors = _getFormatCache(file)["colors"]
+	try:
+		return colors[xfIndex]
+	except KeyError:
+		format = file.xf_list[xfIndex]
+		colorIndexes = (format.background.pattern_colour_index, file.font_list[format.font_index].colour_index)
+		colors[xfIndex] = colorIndexes
+		return colorIndexes
+
+
+def _getCell(sheet, row, col):
+	# Same cell as sheet.cell, also for cells past end of row when workbook is opened with ragged_rows
+	if col < sheet.row_len(row):
+		return sheet.cell(rowx=row, colx=col)
+	# empty cell takes row, column or default format (same as padding of non ragged sheet)
+	xfIndex = None
+	if sheet.formatting_info:
+		xfIndex = 15
+		rowInfo = sheet.rowinfo_map.get(row)
+		colInfo = sheet.colinfo_map.get(col)
+		if rowInfo is not None and rowInfo.xf_index > -1:
+			xfIndex = rowInfo.xf_index
+		elif colInfo is not None and colInfo.xf_index > -1:
+			xfIndex = colInfo.xf_index
+	return xlrd.sheet.Cell(xlrd.XL_CELL_EMPTY, "", xfIndex)
+
+
 class CellFormatter:
 	def _getFormattedCellValue(self, file, cell):
-		format = file.xf_list[cell.xf_index]
-		formatKey = format.format_key
-		f = file.format_map[formatKey]
-		if f.format_str[-1] == "%":
+		formatStr = _getFormatString(file, cell.xf_index)
+		if formatStr[-1] == "%":
 			return str((cell.value*100)).decode("utf8")+"%"
-		elif f.format_str == "m/d/yy":
+		elif formatStr == "m/d/yy":
 			dateTuple = xlrd.xldate_as_tuple(cell.value, file.datemode)
 			return str(datetime.datetime(dateTuple[0], dateTuple[1], dateTuple[2], dateTuple[3], dateTuple[4], dateTuple[5]))
-		elif f.format_str.split(".")[0] == "0" and len(f.format_str) > 1:
-			formatSplitted = f.format_str.split(".")
+		elif formatStr.split(".")[0] == "0" and len(formatStr) > 1:
+			formatSplitted = formatStr.split(".")
 			if len(formatSplitted) > 1:
 				floatingNumber = len(formatSplitted[1])
 				return str(round(float(cell.value),floatingNumber))
-		elif len(f.format_str.split(".")) <= 1 and isinstance(cell.value,float):
+		elif len(formatStr.split(".")) <= 1 and isinstance(cell.value,float):
 			return str(int(round(cell.value)))
 		else:
 			return str(cell.value).decode("utf8")	
@@ -160,7 +205,7 @@ class ExcelField(CellFormatter):
 	def parse(self, file):
 		tag = self.getTag()
 		sheet = file.sheet_by_name(self.getSheetName())
-		cell = sheet.cell(rowx=self.getCellRow(), colx=self.getCellCol())
+		cell = _getCell(sheet, self.getCellRow(), self.getCellCol())
 		try:
 			cellValue = self._getFormattedCellValue(file, cell)
 		except ValueError:
@@ -217,7 +262,7 @@ class ExcelTable(CellFormatter):
 		headers = []
 		for col in range(startCell[0],endCell[0]):
 			for row in range(startCell[1],endCell[1]):
-				title = self._makeMultiline(sheet.cell_value(rowx=row, colx=col), self._headersMaxOneLineChars)
+				title = self._makeMultiline(_getCell(sheet, row, col).value, self._headersMaxOneLineChars)
 				headers.append(str(title).decode("utf8"))
 		return headers
 	
@@ -248,7 +293,7 @@ class ExcelTable(CellFormatter):
 		for row in range(startCellRow, endCellRow):
 			rowContent = []
 			for col in range(startCellCol, endCellCol):
-				cell = sheet.cell(rowx=row, colx=col)
+				cell = _getCell(sheet, row, col)
 				try:
 					cellValue = self._makeMultiline(self._getFormattedCellValue(file, cell), self._contentMaxOneLineChars)
 				except ValueError:
@@ -260,10 +305,7 @@ class ExcelTable(CellFormatter):
 	
 	def _setCellParams(self, file, cell, row, col):
 		if self.getParamsTag():
-			format = file.xf_list[cell.xf_index]
-			font = file.font_list[format.font_index]
-			bg = format.background.pattern_colour_index
-			fg = font.colour_index
+			bg, fg = _getColorIndexes(file, cell.xf_index)
 			paramKeyName = "%s,%s"%(row, col)
 			colors = self._getColorMap()
 			params = self._getCellsParams()
@@ -342,11 +384,17 @@ class ExcelTable(CellFormatter):
 
 
 class XLSparser:
-	def __init__(self, filePath, excelTables=[], excelFields=[]):
+	# streaming=True opens workbook on demand (only sheets used by tables / fields are loaded,
+	# one at a time, rows are not padded) for large workbooks that don't fit client heap
+	def __init__(self, filePath, excelTables=[], excelFields=[], streaming=False):
 		if not isinstance(filePath, str):
 			raise WrongTypeError(str, type(filePath))
 		self._path = filePath
-		self._file = xlrd.open_workbook(filename=filePath, formatting_info=True)
+		self._streaming = streaming
+		if streaming:
+			self._file = xlrd.open_workbook(filename=filePath, formatting_info=True, on_demand=True, use_mmap=True, ragged_rows=True)
+		else:
+			self._file = xlrd.open_workbook(filename=filePath, formatting_info=True)
 		self._excelTables = excelTables
 		self._excelFields = excelFields
 	
@@ -362,6 +410,9 @@ class XLSparser:
 	def getFile(self):
 		return self._file
 	
+	def isStreaming(self):
+		return self._streaming
+	
 	def parseTables(self):
 		tables = self.getTables()
 		file = self.getFile()
@@ -373,7 +424,27 @@ class XLSparser:
 		file = self.getFile()
 		for field in fields:
 			field.parse(file)
+	
+	def _parseSheetBySheet(self):
+		# tables first, then fields (same order as parse), sheets are unloaded once all their items are parsed
+		items = self.getTables() + self.getFields()
+		file = self.getFile()
+		remaining = {}
+		for item in items:
+			remaining[item.getSheetName()] = remaining.get(item.getSheetName(), 0) + 1
+		try:
+			for item in items:
+				item.parse(file)
+				sheetName = item.getSheetName()
+				remaining[sheetName] -= 1
+				if remaining[sheetName] == 0 and file.sheet_loaded(sheetName):
+					file.unload_sheet(sheetName)
+		finally:
+			file.release_resources()
 		
 	def parse(self):
-		self.parseTables()
-		self.parseFields()
\ No newline at end of file
+		if self.isStreaming():
+			self._parseSheetBySheet()
+		else:
+			self.parseTables()
+			self.parseFields()
@@ -37,19 +37,24 @@ class MEStag:
 
 
 class MEScounter(MEStag):
+	# Increments go through shared.mes.counters accumulator (written on its next flush),
+	# so concurrent increments of the same tag are all applied. Value never goes below 0.
 	def incrementValue(self, delta):
+		shared.mes.counters.queueDelta(self.getPath(), delta, 0)
 		self._value += delta;
 		if self._value < 0:
 			self._value = 0
-			self.setValue(self._value)
 			return 0
 		else:
-			self.setValue(self._value)
 			return 1
 	
 	def readAndIncrementValue(self, delta):
 		self._readValue()
 		return self.incrementValue(delta)
+	
+	def flush(self):
+		shared.mes.counters.flush([self.getPath()])
+		return self._readValue()
 
 
 class MESanalysisTag(MEStag, MESanalysis):
@@ -1,6 +1,6 @@
 #===============================================================================
 
-def prepareTransaction(testEnvironment=True):
+def prepareTransaction(testEnvironment=True, operations=None):
 
 	"""
 	Function to define a new BAPI transaction. This is the start of every SAP communication.
@@ -10,6 +10,9 @@ def prepareTransaction(testEnvironment=True):
 	testEnvironment : boolean 
 		   default true
 		flag to check if the BAPI transaction goes to T16 environment
+	operations : list
+		   default None
+		SAP operations stored with the transaction in the same write (see TransactionBuilder)
 	
 	Returns
 	-------
@@ -31,20 +34,87 @@ def prepareTransaction(testEnvironment=True):
 	
 	# Generate unique uudi	
 	generatedUuid = str(uuid.uuid4())
+	
+	if operations is None:
+		operations = []
+	
+	for jsonParameters in operations:
+		jsonParameters["parameterValues"]["sessionUUID"] = generatedUuid
 		
 	# Add line to database
 	sql = "INSERT INTO " + tableName + " (uuid, request_received_timestamp, factory_gateway, request) VALUES (?,?,?,?)"
-	rows = system.db.runPrepUpdate(sql, args=[generatedUuid, timestamp, factoryGateway, system.util.jsonEncode([])], database="sga_sap_bapi")
+	rows = system.db.runPrepUpdate(sql, args=[generatedUuid, timestamp, factoryGateway, system.util.jsonEncode(operations)], database="sga_sap_bapi")
 	
 	return generatedUuid
 
 #===============================================================================
 
+class TransactionBuilder(object):
+	"""
+	Collects SAP operations in memory and stores them with one write.
+	Replaces prepareTransaction + addOperation per operation, which rewrites the request array once per operation.
+	
+	Usage
+	-----
+	builder = shared.sap.bapi.TransactionBuilder(testEnvironment)
+	for bapi in bapiTemplates:
+		builder.addOperation(bapi)
+	uuid = builder.save()
+	"""
+	
+	def __init__(self, testEnvironment=True, uuid=None):
+		"""
+		Parameters
+		----------
+		testEnvironment : boolean 
+			   default true
+			flag to check if the BAPI transaction goes to T16 environment
+		uuid : str
+			   default None
+			existing transaction to append to, None to create transaction on save
+		"""
+		
+		self.testEnvironment = testEnvironment
+		self.uuid = uuid
+		self.operations = []
+	
+	def addOperation(self, jsonParameters):
+		"""
+		Same as addOperation function, operation is only kept in memory until save.
+		"""
+		
+		self.operations.append(jsonParameters)
+		return self
+	
+	def addOperations(self, operations):
+		for jsonParameters in operations:
+			self.operations.append(jsonParameters)
+		return self
+	
+	def save(self):
+		"""
+		Stores collected operations (creates transaction row if builder has no uuid yet).
+		
+		Returns
+		-------
+		str
+			uuid that identifies this transaction, None if uuid is not in the database
+		"""
+		
+		if self.uuid is None:
+			self.uuid = prepareTransaction(self.testEnvironment, self.operations)
+		elif len(self.operations) > 0:
+			if addOperations(self.uuid, self.operations, self.testEnvironment) < 1:
+				return None
+		
+		self.operations = []
+		return self.uuid
+
+#===============================================================================
+
 def prepareOperation(uuid, sapOperation):
 
-	if sapOperation in shared.sap.templates.__dict__:
-		template = shared.sap.templates.__dict__[sapOperation]
-	else:
+	if shared.sap.templateFactory.compileTemplate(sapOperation) is None:
 		return "Bapi not found"
 	# Old code
 	"""
@@ -80,21 +150,21 @@ def prepareOperation(uuid, sapOperation):
 	else:
 		return "Bapi not found"
 	"""	
-	#template["parameterValues"]["sessionUUID"] = uuid		
-	return template
+	#template["parameterValues"]["sessionUUID"] = uuid
+	# fresh copy, shared template must not be modified by callers (addOperation sets sessionUUID)
+	return shared.sap.templateFactory.newRequest(sapOperation)
 	
 #===============================================================================	
 	
 def addOperation(uuid, jsonParameters, testEnvironment=True):
 	"""
 	Function to add a SAP operation to transaction. Depending on the operation the jsonParameters will change. 
+	For several operations use addOperations or TransactionBuilder (one write for all of them).
 	
 	Parameters
 	----------
 	uuid: str
 		unique identifier for transaction
-	sapOperation: str
-		SAP operation that will be triggered on central server
 	jsonParameters: dict
 		the SAP inputs required to start the SAP operation
 	testEnvironment : boolean 
@@ -107,6 +177,34 @@ def addOperation(uuid, jsonParameters, testEnvironment=True):
 		uuid that identifies this transaction.
 	"""
 	
+	# TO DO : CHECK VALIDITY OF JSON etc...
+	if addOperations(uuid, [jsonParameters], testEnvironment) > 0:
+		return "Successfully added sap operation to database"
+		
+	return "The uuid is not in the database, please use beginTransaction to get uuid."
+
+#===============================================================================
+
+def addOperations(uuid, operations, testEnvironment=True):
+	"""
+	Function to append several SAP operations to transaction with one statement.
+	
+	Parameters
+	----------
+	uuid: str
+		unique identifier for transaction
+	operations: list
+		list of jsonParameters (see addOperation)
+	testEnvironment : boolean 
+		   default true
+		flag to check if the BAPI transaction goes to T16 environment
+	
+	Returns
+	-------
+	int
+		number of updated rows, 0 if uuid is not in the database
+	"""
+	
 	# Select target system
 	if testEnvironment:
 		tableName = "transactions_test"
@@ -116,25 +214,149 @@ def addOperation(uuid, jsonParameters, testEnvironment=True):
 	# Get globales
 	currentTime = system.tag.read("[System]Gateway/CurrentDateTime").value
 	
-	# Try to update / adding the operation
-	# TO DO : CHECK VALIDITY OF JSON etc...
+	for jsonParameters in operations:
+		jsonParameters["parameterValues"]["sessionUUID"] = uuid
 	
-	# Find id for this UUID
-	checkSql = "SELECT id FROM " + tableName + " WHERE uuid = ?"	
-	id = system.db.runScalarPrepQuery(checkSql,args=[uuid], database="sga_sap_bapi")
+	# Whole array is appended at once, update of unknown uuid changes no row
+	sql = "UPDATE " + tableName + " SET request = JSON_MERGE_PRESERVE(request, CAST(? AS JSON)), request_received_timestamp = ? WHERE uuid = ?"
+	args = [system.util.jsonEncode(operations), currentTime, uuid]
 	
-	# If found, try to add JSON request querry to the array of requests
-	if id:
-		sql = "UPDATE " + tableName + " SET request = JSON_ARRAY_APPEND(request, '$', CAST(? AS JSON)), request_received_timestamp = ? WHERE uuid = ?"
-		jsonParameters["parameterValues"]["sessionUUID"] = uuid
-		#Standard json to send to centrals
-		requestJson = jsonParameters
-		args = [system.util.jsonEncode(requestJson), currentTime, uuid]
-		rows = system.db.runPrepUpdate(sql, args, database="sga_sap_bapi")
-		
-		return "Successfully added sap operation to database"
-		
-	return "The uuid is not in the database, please use beginTransaction to get uuid."
+	return system.db.runPrepUpdate(sql, args, database="sga_sap_bapi")
+
+#===============================================================================
+
+def getTransactionTarget(testEnvironment=True):
+	"""
+	Function to get transactions table and hub gateway used for selected SAP system.
+	
+	Parameters
+	----------
+	testEnvironment : boolean 
+		   default true
+		flag to check if the BAPI transaction goes to T16 environment
+	
+	Returns
+	-------
+	tuple
+		(tableName, remoteGateway)
+	"""
+	
+	if testEnvironment:
+		return "transactions_test", "IDS-HUB5"
+	
+	return "transactions_prod", system.tag.read("[default]Factory/param_gw_interfaces").value
+
+#===============================================================================
+
+def buildTransactionPayload(uuid, tableName, factoryCode=None):
+	"""
+	Function to build payload sent to central server for one transaction.
+	
+	Parameters
+	----------
+	uuid: str
+		unique identifier for transaction
+	tableName: str
+		transactions_test or transactions_prod
+	factoryCode: str
+		   default None (read from Factory/param_code)
+		code of the factory
+	
+	Returns
+	-------
+	dict
+		payload with pfceInternals and requests, None if uuid is not in table
+	"""
+	
+	if factoryCode is None:
+		factoryCode = system.tag.read("[default]Factory/param_code").value
+	
+	# Get table of requests to be processed
+	sql = "SELECT factory_gateway, request FROM " + tableName + " WHERE uuid = ?"
+	pyDs = system.db.runPrepQuery(sql, args=[uuid], database="sga_sap_bapi")
+	
+	if len(pyDs) < 1:
+		return None
+	
+	row = pyDs[0]
+	
+	# Prepare internal set of data used for communication
+	pfceInternals = {"fromFactory":row["factory_gateway"],
+					 "factoryCode": factoryCode,
+					 "uuid":uuid,
+					}
+	
+	# Build the main payload
+	return {"pfceInternals":pfceInternals,
+			"requests":row["request"]}
+
+#===============================================================================
+
+def setTransactionStatus(uuid, tableName, statusCommunication, proposedTemplate=None):
+	"""
+	Function to update status_communication of transaction (and debug column when template is given).
+	
+	Parameters
+	----------
+	uuid: str
+		unique identifier for transaction
+	tableName: str
+		transactions_test or transactions_prod
+	statusCommunication: int
+		1 queued, 2 sent to central server, 3 answer received, 4 communication failed
+	proposedTemplate: list
+		   default None
+		templates stored to debug column
+	
+	Returns
+	-------
+	int
+		number of updated rows
+	"""
+	
+	if proposedTemplate is None:
+		updateSql = "UPDATE "+tableName+ " SET status_communication = ? WHERE uuid = ?"
+		args = [statusCommunication, uuid]
+	else:
+		updateSql = "UPDATE "+tableName+ " SET status_communication = ?, debug = ? WHERE uuid = ?"
+		args = [statusCommunication, system.util.jsonEncode(proposedTemplate), uuid]
+	
+	return system.db.runPrepUpdate(updateSql, args=args, database="sga_sap_bapi")
+
+#===============================================================================
+
+def storeTransactionAnswer(uuid, tableName, answer):
+	"""
+	Function to store answer of central server to transaction row.
+	
+	Parameters
+	----------
+	uuid: str
+		unique identifier for transaction
+	tableName: str
+		transactions_test or transactions_prod
+	answer: dict
+		answer of central server (status_sap_action, answers, text)
+	
+	Returns
+	-------
+	str
+		text for GUI
+	"""
+	
+	# Parse the result
+	statusSapAction = answer["status_sap_action"]
+	answers = answer["answers"]
+	guiText = answer["text"]
+
+	# Get time update 
+	answerSentTime = system.tag.read("[System]Gateway/CurrentDateTime").value #system.date.now() NOT ALIGNED WITH TIMEZONE
+	
+	# Try to update with the feedback
+	updateSql = "UPDATE "+ tableName +" SET answer = ?, answer_sent_timestamp = ?, status_communication = ?, status_sap_action = ? WHERE uuid = ?" 
+	rows = system.db.runPrepUpdate(updateSql, args=[system.util.jsonEncode(answers), answerSentTime, 3,statusSapAction, uuid], database="sga_sap_bapi")
+	
+	return guiText
 
 #===============================================================================
 
@@ -142,6 +364,7 @@ def tryTransaction(uuid, testEnvironment=True, proposedTemplate=[]):
 	"""
 	Function to test a SAP operations of transaction. This will send the request to central server and it will execute the BAPI commands. Depending on the SAP return
 	the system will rollback the transaction or leave the session open.
+	Blocks until central server answers (up to 300 s), use submitTransaction to send it in background.
 	
 	Parameters
 	----------
@@ -158,58 +381,72 @@ def tryTransaction(uuid, testEnvironment=True, proposedTemplate=[]):
 	"""
 	
 	# Select target system
-	if testEnvironment:
-		tableName = "transactions_test"
-		remoteGateway = "IDS-HUB5"
-	else:
-		tableName = "transactions_prod"
-		remoteGateway = system.tag.read("[default]Factory/param_gw_interfaces").value
-
-	# Get globals
-	factoryCode = system.tag.read("[default]Factory/param_code").value
-					
-	# Get table of requests to be processed
-	sql = "SELECT * FROM " + tableName + " WHERE uuid = ?"
-	ds = system.db.runPrepQuery(sql, args=[uuid], database="sga_sap_bapi")
-	pyDs = system.dataset.toPyDataSet(ds)
+	tableName, remoteGateway = getTransactionTarget(testEnvironment)
 	
-	if len(pyDs)>0:
-			
-		row = pyDs[0]
-		
-		# Prepare internal set of data used for communication
-		pfceInternals = {"fromFactory":row["factory_gateway"],
-						 "factoryCode": factoryCode,
-						 "uuid":uuid,
-						}
-		
-		# Build the main payload
-		payload = {"pfceInternals":pfceInternals,
-				   "requests":row["request"]}
+	payload = buildTransactionPayload(uuid, tableName)
+	
+	if payload is not None:
 		
 		# Update status of communication to 2
-		updateSql = "UPDATE "+tableName+ " SET status_communication = ?, debug = ? WHERE uuid = ?"
-		rows = system.db.runPrepUpdate(updateSql, args=[2, system.util.jsonEncode(proposedTemplate) ,uuid], database="sga_sap_bapi")
+		setTransactionStatus(uuid, tableName, 2, proposedTemplate)
 
 		# Try the full transaction
 		answer = system.util.sendRequest("pfce_sap_bapi", "tryTransaction", payload = payload, remoteServer = remoteGateway, timeoutSec=300)
 		
-		# Parse the result
-		statusSapAction = answer["status_sap_action"]
-		answers = answer["answers"]
-		guiText = answer["text"]
-
-		# Get time update 
-		answerSentTime = system.tag.read("[System]Gateway/CurrentDateTime").value #system.date.now() NOT ALIGNED WITH TIMEZONE
-		
-		# Try to update with the feedback
-		updateSql = "UPDATE "+ tableName +" SET answer = ?, answer_sent_timestamp = ?, status_communication = ?, status_sap_action = ? WHERE uuid = ?" 
-		rows = system.db.runPrepUpdate(updateSql, args=[system.util.jsonEncode(answers), answerSentTime, 3,statusSapAction, uuid], database="sga_sap_bapi")
-		
-		return guiText
+		return storeTransactionAnswer(uuid, tableName, answer)
 
 	return "No line with this UUID in table."
 
+#===============================================================================
+
+def submitTransaction(uuid, testEnvironment=True, proposedTemplate=[], coalesce=False):
+	"""
+	Function to send transaction to central server in background (see shared.sap.bapiPipeline).
+	Returns immediately, progress is visible in status_communication or with getTransactionStatus.
+	
+	Parameters
+	----------
+	uuid: str
+		unique identifier for transaction
+	testEnvironment : boolean 
+		   default true
+		flag to check if the BAPI transaction goes to T16 environment
+	proposedTemplate: list
+		templates stored to debug column
+	coalesce: boolean
+		   default false
+		transaction can be sent together with other queued transactions for the same hub
+	
+	Returns
+	-------
+	str
+		uuid of the transaction
+	"""
+	
+	return shared.sap.bapiPipeline.submit(uuid, testEnvironment, proposedTemplate, coalesce)
+
+#===============================================================================
+
+def getTransactionStatus(uuid, testEnvironment=True):
+	"""
+	Function to poll status of transaction sent with submitTransaction.
+	
+	Parameters
+	----------
+	uuid: str
+		unique identifier for transaction
+	testEnvironment : boolean 
+		   default true
+		flag to check if the BAPI transaction goes to T16 environment
+	
+	Returns
+	-------
+	dict
+		uuid, status (status_communication), statusSapAction, text, error
+	"""
+	
+	return shared.sap.bapiPipeline.getStatus(uuid, testEnvironment)
+
 #===============================================================================	
 # DEPRECATED, NO ?
 
@@ -336,7 +573,7 @@ def getFilledConfirmationTemplate(ignitionTagPath, workorder, stepId = None, tes
 		filledTemplate = fillTimeTicketTemplate(data, testPo)
 	filledTemplates.append(filledTemplate)	
 	
-	filledTemplate = shared.sap.templates.BAPI_TRANSACTION_COMMIT
+	filledTemplate = shared.sap.templateFactory.newRequest("BAPI_TRANSACTION_COMMIT")
 	filledTemplates.append(filledTemplate)	
 		
 	return filledTemplates
@@ -460,8 +697,7 @@ def getDataForWorkorderSpecificRow(ignitionTagPath, workorder, stepIds = []):
 	return mesPyDs
 
 def fillGoodsMovementTemplate(mesPyDs):
-	from copy import deepcopy
-	template = deepcopy(shared.sap.templates.BAPI_GOODSMVT_CREATE)
+	template = shared.sap.templateFactory.newRequest("BAPI_GOODSMVT_CREATE")
 	templateInput = template["parameterValues"]["input"]["inputRoot"]["INPUT"]
 	templateItem = template["parameterValues"]["input"]["inputRoot"]["TABLES"]["GOODSMVT_ITEM"]["item"]
 	
@@ -495,21 +731,26 @@ def fillGoodsMovementTemplate(mesPyDs):
 					pass
 
 def fillTimeTicketTemplate(mesPyDs, testPo):
-	from copy import deepcopy
-	template = deepcopy(shared.sap.templates.BAPI_PRODORDCONF_CREATE_TT)
-	templateItemTT = deepcopy(template["parameterValues"]["input"]["inputRoot"]["TABLES"]["TIMETICKETS"]["item"])
-	templateItemGM = deepcopy(template["parameterValues"]["input"]["inputRoot"]["TABLES"]["GOODSMOVEMENTS"]["item"])
-	templateItemGMlink = deepcopy(template["parameterValues"]["input"]["inputRoot"]["TABLES"]["LINK_CONF_GOODSMOV"]["item"])
+	# compiled once per script load, items are created by factories instead of deepcopy
+	compiledTemplate = shared.sap.templateFactory.compileTemplate("BAPI_PRODORDCONF_CREATE_TT")
+	template = compiledTemplate.request()
+	templateItemTT = compiledTemplate.items["TIMETICKETS"]
+	templateItemGM = compiledTemplate.items["GOODSMOVEMENTS"]
+	templateItemGMlink = compiledTemplate.items["LINK_CONF_GOODSMOV"]
 
 	#print mesPyDs
 	tmpItem = []
 	tmpGoodsMovement = []
 	tmpLink = []
+	# plant level constants, read once per confirmation
+	factoryPlant = system.tag.read("[default]Factory/param_code").value #find datapoint
+	parser = shared.utils.date.date_time_iso_8061_parser()
+	
 	ttCounter = 1
 	goodsCounter = 1
 	for row in mesPyDs:
 		
-		mainTemplate = deepcopy(templateItemTT[0])
+		mainTemplate = templateItemTT.new()
 		
 
 		outfeed = row["outfeed"]
@@ -520,11 +761,10 @@ def fillTimeTicketTemplate(mesPyDs, testPo):
 		
 		if testPo:
 			workorder = testPo
-		plant = system.tag.read("[default]Factory/param_code").value #find datapoint
+		plant = factoryPlant
 		mesData = row["mesData"]
 		
 		mesDataJson = system.util.jsonDecode(mesData)
-		parser = shared.utils.date.date_time_iso_8061_parser()
 		startDate =  parser.parse(mesDataJson["start"])
 		endDate = parser.parse(mesDataJson["end"])
 		
@@ -536,8 +776,8 @@ def fillTimeTicketTemplate(mesPyDs, testPo):
 			matPyDs = system.dataset.toPyDataSet(matDs)
 			
 			for consumedMat in matPyDs:
-				goodsTemplate = deepcopy(templateItemGM[0])
-				linkTemplate = deepcopy(templateItemGMlink[0])
+				goodsTemplate = templateItemGM.new()
+				linkTemplate = templateItemGMlink.new()
 				
 				materialCode = consumedMat['materialNumber']
 				materialName = consumedMat['materialDesc']
@@ -619,11 +859,12 @@ def fillTimeTicketTemplate(mesPyDs, testPo):
 			
 			
 def fillTimeTicketTemplateConcatinated(mesPyDs, testPo):
-	from copy import deepcopy
-	template = deepcopy(shared.sap.templates.BAPI_PRODORDCONF_CREATE_TT)
-	templateItemTT = deepcopy(template["parameterValues"]["input"]["inputRoot"]["TABLES"]["TIMETICKETS"]["item"])
-	templateItemGM = deepcopy(template["parameterValues"]["input"]["inputRoot"]["TABLES"]["GOODSMOVEMENTS"]["item"])
-	templateItemGMlink = deepcopy(template["parameterValues"]["input"]["inputRoot"]["TABLES"]["LINK_CONF_GOODSMOV"]["item"])
+	# compiled once per script load, items are created by factories instead of deepcopy
+	compiledTemplate = shared.sap.templateFactory.compileTemplate("BAPI_PRODORDCONF_CREATE_TT")
+	template = compiledTemplate.request()
+	templateItemTT = compiledTemplate.items["TIMETICKETS"]
+	templateItemGM = compiledTemplate.items["GOODSMOVEMENTS"]
+	templateItemGMlink = compiledTemplate.items["LINK_CONF_GOODSMOV"]
 
 
 	tmpItem = []
@@ -639,6 +880,10 @@ def fillTimeTicketTemplateConcatinated(mesPyDs, testPo):
 	ttEndDate = None
 	ttDuration = 0
 	
+	# plant level constants, read once per confirmation
+	factoryPlant = system.tag.read("[default]Factory/param_code").value #find datapoint
+	parser = shared.utils.date.date_time_iso_8061_parser()
+	
 	ttCounter = 1
 	goodsCounter = 1
 	for row in mesPyDs:
@@ -651,11 +896,10 @@ def fillTimeTicketTemplateConcatinated(mesPyDs, testPo):
 		
 		if testPo:
 			workorder = testPo
-		plant = system.tag.read("[default]Factory/param_code").value #find datapoint
+		plant = factoryPlant
 		mesData = row["mesData"]
 		
 		mesDataJson = system.util.jsonDecode(mesData)
-		parser = shared.utils.date.date_time_iso_8061_parser()
 		startDate =  parser.parse(mesDataJson["start"])
 		endDate = parser.parse(mesDataJson["end"])
 		
@@ -681,8 +925,8 @@ def fillTimeTicketTemplateConcatinated(mesPyDs, testPo):
 			matPyDs = system.dataset.toPyDataSet(matDs)
 			
 			for consumedMat in matPyDs:
-				goodsTemplate = deepcopy(templateItemGM[0])
-				linkTemplate = deepcopy(templateItemGMlink[0])
+				goodsTemplate = templateItemGM.new()
+				linkTemplate = templateItemGMlink.new()
 				
 				materialCode = consumedMat['materialNumber']
 				materialName = consumedMat['materialDesc']
@@ -739,10 +983,10 @@ def fillTimeTicketTemplateConcatinated(mesPyDs, testPo):
 				ttReject += 1
 		ttYield += outfeed
 		
-	mainTemplate = deepcopy(templateItemTT[0])
+	mainTemplate = templateItemTT.new()
 	
 	for gm in dictGoodsMovement:
-		linkTemplate = deepcopy(templateItemGMlink[0])
+		linkTemplate = templateItemGMlink.new()
 		gmTemplateInstance = dictGoodsMovement[gm]
 		
 		
@@ -786,11 +1030,12 @@ def fillTimeTicketTemplateConcatinated(mesPyDs, testPo):
 	return template
 	
 def fillTimeTicketTemplateConcatinatedBackflush(mesPyDs, testPo, bomData, backflushBehavior):
-	from copy import deepcopy
-	template = deepcopy(shared.sap.templates.BAPI_PRODORDCONF_CREATE_TT)
-	templateItemTT = deepcopy(template["parameterValues"]["input"]["inputRoot"]["TABLES"]["TIMETICKETS"]["item"])
-	templateItemGM = deepcopy(template["parameterValues"]["input"]["inputRoot"]["TABLES"]["GOODSMOVEMENTS"]["item"])
-	templateItemGMlink = deepcopy(template["parameterValues"]["input"]["inputRoot"]["TABLES"]["LINK_CONF_GOODSMOV"]["item"])
+	# compiled once per script load, items are created by factories instead of deepcopy
+	compiledTemplate = shared.sap.templateFactory.compileTemplate("BAPI_PRODORDCONF_CREATE_TT")
+	template = compiledTemplate.request()
+	templateItemTT = compiledTemplate.items["TIMETICKETS"]
+	templateItemGM = compiledTemplate.items["GOODSMOVEMENTS"]
+	templateItemGMlink = compiledTemplate.items["LINK_CONF_GOODSMOV"]
 
 
 	tmpItem = []
@@ -806,6 +1051,10 @@ def fillTimeTicketTemplateConcatinatedBackflush(mesPyDs, testPo, bomData, backfl
 	ttEndDate = None
 	ttDuration = 0
 	
+	# plant level constants, read once per confirmation
+	factoryPlant = system.tag.read("[default]Factory/param_code").value #find datapoint
+	parser = shared.utils.date.date_time_iso_8061_parser()
+	
 	ttCounter = 1
 	goodsCounter = 1
 	p16Workorder = ""
@@ -819,11 +1068,10 @@ def fillTimeTicketTemplateConcatinatedBackflush(mesPyDs, testPo, bomData, backfl
 		p16Workorder = row["workorder"]
 		if testPo:
 			workorder = testPo
-		plant = system.tag.read("[default]Factory/param_code").value #find datapoint
+		plant = factoryPlant
 		mesData = row["mesData"]
 		
 		mesDataJson = system.util.jsonDecode(mesData)
-		parser = shared.utils.date.date_time_iso_8061_parser()
 		startDate =  parser.parse(mesDataJson["start"])
 		endDate = parser.parse(mesDataJson["end"])
 		
@@ -849,8 +1097,8 @@ def fillTimeTicketTemplateConcatinatedBackflush(mesPyDs, testPo, bomData, backfl
 			matPyDs = system.dataset.toPyDataSet(matDs)
 			
 			for consumedMat in matPyDs:
-				goodsTemplate = deepcopy(templateItemGM[0])
-				linkTemplate = deepcopy(templateItemGMlink[0])
+				goodsTemplate = templateItemGM.new()
+				linkTemplate = templateItemGMlink.new()
 				
 				materialCode = consumedMat['materialNumber']
 				materialName = consumedMat['materialDesc']
@@ -907,7 +1155,7 @@ def fillTimeTicketTemplateConcatinatedBackflush(mesPyDs, testPo, bomData, backfl
 				ttReject += 1
 		ttYield += outfeed
 		
-	mainTemplate = deepcopy(templateItemTT[0])		
+	mainTemplate = templateItemTT.new()		
 	
 	if ttYield > 0:
 		# duration = system.date.minutesBetween(ttStartDate, ttEndDate)
@@ -933,7 +1181,7 @@ def fillTimeTicketTemplateConcatinatedBackflush(mesPyDs, testPo, bomData, backfl
 	if len(dictGoodsMovement) > 0:
 			
 		for gm in dictGoodsMovement:
-			linkTemplate = deepcopy(templateItemGMlink[0])
+			linkTemplate = templateItemGMlink.new()
 			gmTemplateInstance = dictGoodsMovement[gm]
 			
 			
@@ -953,8 +1201,8 @@ def fillTimeTicketTemplateConcatinatedBackflush(mesPyDs, testPo, bomData, backfl
 			for mat in bomData:
 				
 				if mat["itemCategory"] == "L":
-					goodsTemplate = deepcopy(templateItemGM[0])
-					linkTemplate = deepcopy(templateItemGMlink[0])
+					goodsTemplate = templateItemGM.new()
+					linkTemplate = templateItemGMlink.new()
 					goodsTemplate["BATCH"] = mat["batchNumber"]
 					
 					if backflushBehavior == "NoConsumption":
@@ -992,11 +1240,12 @@ def fillTimeTicketTemplateConcatinatedBackflush(mesPyDs, testPo, bomData, backfl
 	
 
 def prepareTemplate(gmTemplates, rejects, rejectsCodes, yields, duration, mesDs, finalConfirmation, rejectCodeJson={}):
-	from copy import deepcopy
-	template = deepcopy(shared.sap.templates.BAPI_PRODORDCONF_CREATE_TT)
-	templateItemTT = deepcopy(template["parameterValues"]["input"]["inputRoot"]["TABLES"]["TIMETICKETS"]["item"])
-	templateItemGM = deepcopy(template["parameterValues"]["input"]["inputRoot"]["TABLES"]["GOODSMOVEMENTS"]["item"])
-	templateItemGMlink = deepcopy(template["parameterValues"]["input"]["inputRoot"]["TABLES"]["LINK_CONF_GOODSMOV"]["item"])
+	# compiled once per script load, items are created by factories instead of deepcopy
+	compiledTemplate = shared.sap.templateFactory.compileTemplate("BAPI_PRODORDCONF_CREATE_TT")
+	template = compiledTemplate.request()
+	templateItemTT = compiledTemplate.items["TIMETICKETS"]
+	templateItemGM = compiledTemplate.items["GOODSMOVEMENTS"]
+	templateItemGMlink = compiledTemplate.items["LINK_CONF_GOODSMOV"]
 
 	#print rejectCodeJson
 
@@ -1034,7 +1283,7 @@ def prepareTemplate(gmTemplates, rejects, rejectsCodes, yields, duration, mesDs,
 		cnt = 1
 		for code in rejectCodeJson:
 			rejNum = rejectCodeJson[code]
-			mainTemplate = deepcopy(templateItemTT[0])	
+			mainTemplate = templateItemTT.new()	
 			if cnt == 1:
 				mainTemplate["DEV_REASON"] = code
 				mainTemplate["SCRAP"] = "%.3f" % float(rejNum)
@@ -1083,7 +1332,7 @@ def prepareTemplate(gmTemplates, rejects, rejectsCodes, yields, duration, mesDs,
 			cnt += 1
 			tmpItem.append(mainTemplate)
 	else:
-		mainTemplate = deepcopy(templateItemTT[0])	
+		mainTemplate = templateItemTT.new()	
 		mainTemplate["DEV_REASON"] = rejectsCodes
 		mainTemplate["SCRAP"] = "%.3f" % float(rejects)
 		mainTemplate["YIELD"] = "%.3f" % float(yields)
@@ -1108,8 +1357,8 @@ def prepareTemplate(gmTemplates, rejects, rejectsCodes, yields, duration, mesDs,
 		tmpItem.append(mainTemplate)
 	# build goods movement
 	for gm in gmTemplates:
-		goodsTemplate = deepcopy(templateItemGM[0])
-		linkTemplate = deepcopy(templateItemGMlink[0])
+		goodsTemplate = templateItemGM.new()
+		linkTemplate = templateItemGMlink.new()
 		
 		#Prepare goods movement
 		goodsTemplate["BATCH"] = gm.batchNumber
@@ -1154,7 +1403,7 @@ def prepareTemplate(gmTemplates, rejects, rejectsCodes, yields, duration, mesDs,
 	filledTemplates = []
 	
 	filledTemplates.append(template)
-	filledTemplate = shared.sap.templates.BAPI_TRANSACTION_COMMIT
+	filledTemplate = shared.sap.templateFactory.newRequest("BAPI_TRANSACTION_COMMIT")
 	filledTemplates.append(filledTemplate)
 	
 	return filledTemplates	
@@ -1455,4 +1704,82 @@ def prepareWindowData(mesMat, bomMat, ignitionTagPath, workorder,confirmationMod
 	gmDs = system.dataset.toDataSet(goodsMovementHeaders,goodsMovementData)
 	
 	return gmDs, goodsCounter,ttYield,ttReject,ttRejectCode,totalQuantity,ttDuration,outUnits, system.util.jsonEncode(ttRejectCodes)
-		
\ No newline at end of file
+		
+
+def benchmarkTimeTicketTemplate(pieces=5000, materialsPerPiece=3, testPo="1000000"):
+	"""
+	Benchmark of time ticket confirmation build (run from script console on gateway with Factory tags)
+	Compares deepcopy per item (old way) with compiled template factories on synthetic MES rows.
+	
+	Parameters
+	----------
+	pieces : int
+		number of MES rows (pieces) in confirmation
+	materialsPerPiece : int
+		consumed materials per piece (all stock items, each one a goods movement)
+	testPo : str
+		work order used in synthetic rows
+	
+	Returns
+	-------
+	dict
+		seconds spent: deepcopyItems, factoryItems, fillTimeTicketTemplate, fillTimeTicketTemplateConcatinated
+	"""
+	import time
+	from copy import deepcopy
+	
+	materialHeaders = ["materialNumber", "materialDesc", "unit", "usedQuantity", "orderedQuantity", "percentage",
+					   "storage", "batchNumber", "materialMovement", "plant", "date", "itemCategory"]
+	materialValues = []
+	for idx in range(materialsPerPiece):
+		materialValues.append(["10000" + str(idx), "Material " + str(idx), "KG", 0.25, 100.0, 1.0, "0001", "B" + str(idx), "261", "", "", "L"])
+	
+	mesData = system.util.jsonEncode({
+		"start": "2021-01-01T06:00:00.000+01:00",
+		"end": "2021-01-01T06:01:00.000+01:00",
+		"materialConsumption": {"value": {"headers": materialHeaders, "values": materialValues}}
+	})
+	
+	mesRows = []
+	for idx in range(pieces):
+		mesRows.append({
+			"outfeed": 1,
+			"jsonReject": None,
+			"workcenter": "WC01",
+			"operationNumber": "0010",
+			"workorder": testPo,
+			"mesData": mesData
+		})
+	
+	results = {}
+	
+	# old way: deepcopy of template item per piece and per consumed material
+	start = time.time()
+	template = deepcopy(shared.sap.templates.BAPI_PRODORDCONF_CREATE_TT)
+	tables = template["parameterValues"]["input"]["inputRoot"]["TABLES"]
+	for idx in range(pieces):
+		deepcopy(tables["TIMETICKETS"]["item"][0])
+		for mat in range(materialsPerPiece):
+			deepcopy(tables["GOODSMOVEMENTS"]["item"][0])
+			deepcopy(tables["LINK_CONF_GOODSMOV"]["item"][0])
+	results["deepcopyItems"] = time.time() - start
+	
+	# same number of items from factories
+	start = time.time()
+	compiledTemplate = shared.sap.templateFactory.compileTemplate("BAPI_PRODORDCONF_CREATE_TT")
+	for idx in range(pieces):
+		compiledTemplate.items["TIMETICKETS"].new()
+		for mat in range(materialsPerPiece):
+			compiledTemplate.items["GOODSMOVEMENTS"].new()
+			compiledTemplate.items["LINK_CONF_GOODSMOV"].new()
+	results["factoryItems"] = time.time() - start
+	
+	start = time.time()
+	fillTimeTicketTemplate(mesRows, testPo)
+	results["fillTimeTicketTemplate"] = time.time() - start
+	
+	start = time.time()
+	fillTimeTicketTemplateConcatinated(mesRows, testPo)
+	results["fillTimeTicketTemplateConcatinated"] = time.time() - start
+	
+	return results
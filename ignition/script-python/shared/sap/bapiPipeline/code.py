@@ -0,0 +1,544 @@
+import threading
+import time
+from collections import OrderedDict
+
+from java.lang import Runnable
+from java.util.concurrent import Executors, TimeUnit
+
+# Background sending of BAPI transactions to hub gateways
+# Callers only queue the uuid and return. A bounded pool of gateway threads sends
+# transactions, at most one thread per hub at a time, so transactions for one hub
+# are sent in the order they were submitted. Queued transactions marked as
+# coalescable are sent to the hub in one request (handler tryTransactions).
+# Progress is kept in status_communication of transactions_* row:
+# 1 queued, 2 sent to central server, 3 answer received, 4 communication failed
+# Queue is held in memory, recover() (gateway startup script) takes over rows left by a restart.
+STATUS_QUEUED = 1
+STATUS_SENT = 2
+STATUS_ANSWERED = 3
+STATUS_FAILED = 4
+
+WORKERS = 4				# gateway threads sending requests
+COALESCE_MAX = 20		# transactions sent together in one request
+SEND_TIMEOUT = 300		# seconds to wait for hub answer
+KEEP_FINISHED = 500		# finished transactions kept in memory for polling
+
+BATCH_HANDLER = "tryTransactions"
+
+# pool of previous script load is kept here, so it can be stopped on reload
+_GLOBALS_KEY = "shared.sap.bapiPipeline"
+
+_lock = threading.Lock()
+_hubQueues = {}				# (tableName, remoteGateway) -> list of jobs
+_activeHubs = set()			# hubs that have a thread sending
+_jobs = OrderedDict()		# uuid -> job
+_state = {
+	"executor": None
+}
+_stats = {
+	"submitted": 0,
+	"requests": 0,
+	"coalesced": 0,
+	"answered": 0,
+	"failed": 0
+}
+
+
+class _Job(object):
+	"""
+	Transaction waiting for or holding answer of central server
+	"""
+	
+	__slots__ = ["uuid", "tableName", "remoteGateway", "proposedTemplate", "coalesce", "status", "statusSapAction",
+				 "text", "error", "submitted", "finished", "done", "callbacks"]
+	
+	def __init__(self, uuid, tableName, remoteGateway, proposedTemplate, coalesce):
+		self.uuid = uuid
+		self.tableName = tableName
+		self.remoteGateway = remoteGateway
+		self.proposedTemplate = proposedTemplate
+		self.coalesce = coalesce
+		self.status = STATUS_QUEUED
+		self.statusSapAction = None
+		self.text = None
+		self.error = None
+		self.submitted = time.time()
+		self.finished = None
+		self.done = threading.Event()
+		self.callbacks = []
+	
+	def asDict(self):
+		return {
+			"uuid": self.uuid,
+			"status": self.status,
+			"statusSapAction": self.statusSapAction,
+			"text": self.text,
+			"error": self.error
+		}
+
+
+def _finish(job, status, answer=None, error=None):
+	"""
+	Helper that stores result of job and notifies waiting threads and subscribers
+	"""
+	
+	if answer is not None:
+		try:
+			job.text = shared.sap.bapi.storeTransactionAnswer(job.uuid, job.tableName, answer)
+			job.statusSapAction = answer["status_sap_action"]
+		except:
+			status = STATUS_FAILED
+			error = "Answer could not be stored: " + str(answer)
+	
+	if status == STATUS_FAILED:
+		try:
+			shared.sap.bapi.setTransactionStatus(job.uuid, job.tableName, STATUS_FAILED)
+		except:
+			pass
+		system.util.getLogger("PFCE-SAP-BAPI").error("BAPI transaction " + job.uuid + " failed: " + str(error))
+	
+	with _lock:
+		job.status = status
+		job.error = error
+		job.finished = time.time()
+		callbacks = job.callbacks[:]
+		del job.callbacks[:]
+		_stats["answered" if status == STATUS_ANSWERED else "failed"] += 1
+	
+	job.done.set()
+	
+	for callback in callbacks:
+		_notify(callback, job)
+
+
+def _notify(callback, job):
+	"""
+	Helper that calls subscriber, errors of subscriber never stop the pipeline
+	"""
+	
+	try:
+		callback(job.asDict())
+	except:
+		system.util.getLogger("PFCE-SAP-BAPI").warn("BAPI transaction subscriber failed for " + job.uuid)
+
+
+def _sendOne(job, factoryCode):
+	"""
+	Helper that sends one transaction with tryTransaction handler
+	"""
+	
+	payload = shared.sap.bapi.buildTransactionPayload(job.uuid, job.tableName, factoryCode)
+	if payload is None:
+		_finish(job, STATUS_FAILED, error="No line with this UUID in table.")
+		return
+	
+	shared.sap.bapi.setTransactionStatus(job.uuid, job.tableName, STATUS_SENT)
+	
+	with _lock:
+		job.status = STATUS_SENT
+		_stats["requests"] += 1
+	
+	try:
+		answer = system.util.sendRequest("pfce_sap_bapi", "tryTransaction", payload = payload, remoteServer = job.remoteGateway, timeoutSec=SEND_TIMEOUT)
+	except Exception, e:
+		_finish(job, STATUS_FAILED, error=str(e))
+		return
+	
+	_finish(job, STATUS_ANSWERED, answer=answer)
+
+
+def _sendBatch(jobs, factoryCode):
+	"""
+	Helper that sends several transactions for one hub in one request
+	Hub answers {"answers": {uuid: answer of tryTransaction}}, transactions missing in answer fail.
+	"""
+	
+	transactions = []
+	sentJobs = []
+	for job in jobs:
+		payload = shared.sap.bapi.buildTransactionPayload(job.uuid, job.tableName, factoryCode)
+		if payload is None:
+			_finish(job, STATUS_FAILED, error="No line with this UUID in table.")
+			continue
+		transactions.append(payload)
+		sentJobs.append(job)
+	
+	if len(sentJobs) < 1:
+		return
+	
+	for job in sentJobs:
+		shared.sap.bapi.setTransactionStatus(job.uuid, job.tableName, STATUS_SENT)
+	
+	with _lock:
+		for job in sentJobs:
+			job.status = STATUS_SENT
+		_stats["requests"] += 1
+		_stats["coalesced"] += len(sentJobs)
+	
+	payload = {"pfceInternals": {"factoryCode": factoryCode,
+								 "uuids": [job.uuid for job in sentJobs]},
+			   "transactions": transactions}
+	
+	try:
+		answer = system.util.sendRequest("pfce_sap_bapi", BATCH_HANDLER, payload = payload, remoteServer = sentJobs[0].remoteGateway, timeoutSec=SEND_TIMEOUT)
+		answers = answer["answers"]
+	except Exception, e:
+		# hub may have executed part of the batch, transactions are never resent automatically
+		for job in sentJobs:
+			_finish(job, STATUS_FAILED, error=str(e))
+		return
+	
+	for job in sentJobs:
+		if job.uuid in answers:
+			_finish(job, STATUS_ANSWERED, answer=answers[job.uuid])
+		else:
+			_finish(job, STATUS_FAILED, error="No answer for transaction in " + BATCH_HANDLER + " answer.")
+
+
+def _takeJobs(hub):
+	"""
+	Helper that takes next request worth of jobs for hub
+	Returns empty list (and releases hub) when queue is empty.
+	"""
+	
+	with _lock:
+		queue = _hubQueues.get(hub, [])
+		
+		if len(queue) < 1:
+			_activeHubs.discard(hub)
+			_hubQueues.pop(hub, None)
+			return []
+		
+		if not queue[0].coalesce:
+			return [queue.pop(0)]
+		
+		# coalescable jobs that follow each other share one request
+		end = 1
+		while end < len(queue) and end < COALESCE_MAX and queue[end].coalesce:
+			end += 1
+		
+		jobs = queue[:end]
+		del queue[:end]
+		return jobs
+
+
+class _HubTask(Runnable):
+	"""
+	Runnable that sends everything queued for one hub
+	"""
+	
+	def __init__(self, hub):
+		self.hub = hub
+	
+	def run(self):
+		factoryCode = None
+		
+		while True:
+			jobs = _takeJobs(self.hub)
+			if len(jobs) < 1:
+				return
+			
+			try:
+				if factoryCode is None:
+					factoryCode = system.tag.read("[default]Factory/param_code").value
+				
+				if len(jobs) == 1:
+					_sendOne(jobs[0], factoryCode)
+				else:
+					_sendBatch(jobs, factoryCode)
+			except Exception, e:
+				for job in jobs:
+					if not job.done.isSet():
+						_finish(job, STATUS_FAILED, error=str(e))
+
+
+def _executor():
+	"""
+	Helper that returns thread pool, pool of previous script load is stopped
+	Never call with _lock held: previous pool is stopped on its own thread, without the lock.
+	"""
+	
+	with _lock:
+		if _state["executor"] is not None:
+			return _state["executor"]
+	
+	# previous pool finishes its queued transactions (up to SEND_TIMEOUT), nobody waits for it
+	previousStop = system.util.getGlobals().get(_GLOBALS_KEY)
+	if previousStop is not None and previousStop is not stop:
+		stopThread = threading.Thread(target=previousStop, name="bapiPipeline-stop-previous")
+		stopThread.setDaemon(True)
+		stopThread.start()
+	
+	with _lock:
+		if _state["executor"] is None:
+			_state["executor"] = Executors.newFixedThreadPool(WORKERS)
+			system.util.getGlobals()[_GLOBALS_KEY] = stop
+		
+		return _state["executor"]
+
+
+def submit(uuid, testEnvironment=True, proposedTemplate=[], coalesce=False):
+	"""
+	Function that queues transaction for sending and returns immediately
+	
+	Parameters
+	----------
+	uuid: str
+		unique identifier for transaction (from shared.sap.bapi.prepareTransaction)
+	testEnvironment: bool
+		flag to check if the BAPI transaction goes to T16 environment
+	proposedTemplate: list
+		templates stored to debug column
+	coalesce: bool
+		transaction can share request with other coalescable transactions for the same hub
+		(hub needs tryTransactions handler)
+	
+	Returns
+	-------
+	str
+		uuid of the transaction
+	"""
+	
+	tableName, remoteGateway = shared.sap.bapi.getTransactionTarget(testEnvironment)
+	
+	shared.sap.bapi.setTransactionStatus(uuid, tableName, STATUS_QUEUED, proposedTemplate)
+	
+	_enqueue(_Job(uuid, tableName, remoteGateway, proposedTemplate, coalesce))
+	
+	return uuid
+
+
+def _enqueue(job):
+	"""
+	Helper that queues job behind transactions already waiting for its hub
+	"""
+	
+	hub = (job.tableName, job.remoteGateway)
+	
+	with _lock:
+		_jobs[job.uuid] = job
+		_trimJobs()
+		_hubQueues.setdefault(hub, []).append(job)
+		_stats["submitted"] += 1
+		
+		startTask = hub not in _activeHubs
+		if startTask:
+			_activeHubs.add(hub)
+	
+	if startTask:
+		_executor().execute(_HubTask(hub))
+
+
+def recover(maxAge=SEND_TIMEOUT):
+	"""
+	Function that takes over transactions of this gateway left behind by a restart (queue is in memory only)
+	Rows still queued (status 1) are submitted again in the order they were received. Rows sent (status 2)
+	more than maxAge seconds after they were received are marked failed (4): hub may have executed them,
+	so they are never resent automatically. Transactions known to this script load are not touched.
+	Called from gateway startup script.
+	
+	Parameters
+	----------
+	maxAge: float
+		seconds after which a sent transaction without answer is considered lost
+	
+	Returns
+	-------
+	dict
+		resubmitted, failed
+	"""
+	
+	logger = system.util.getLogger("PFCE-SAP-BAPI")
+	factoryGateway = system.tag.read("[System]Gateway/SystemName").value
+	sentBefore = system.date.addSeconds(system.date.now(), -int(maxAge))
+	result = {"resubmitted": 0, "failed": 0}
+	
+	for testEnvironment in [True, False]:
+		tableName, remoteGateway = shared.sap.bapi.getTransactionTarget(testEnvironment)
+		
+		sql = """
+			SELECT uuid, status_communication, request_received_timestamp
+			FROM """ + tableName + """
+			WHERE factory_gateway = ? AND status_communication IN (?, ?)
+			ORDER BY request_received_timestamp
+		"""
+		pyDs = system.db.runPrepQuery(sql, args=[factoryGateway, STATUS_QUEUED, STATUS_SENT], database="sga_sap_bapi")
+		
+		for row in pyDs:
+			uuid = row["uuid"]
+			
+			with _lock:
+				if uuid in _jobs:
+					continue
+			
+			if row["status_communication"] == STATUS_QUEUED:
+				_enqueue(_Job(uuid, tableName, remoteGateway, None, False))
+				result["resubmitted"] += 1
+			elif row["request_received_timestamp"] is not None and system.date.isBefore(row["request_received_timestamp"], sentBefore):
+				shared.sap.bapi.setTransactionStatus(uuid, tableName, STATUS_FAILED)
+				result["failed"] += 1
+				logger.error("BAPI transaction " + uuid + " was sent but no answer was stored, marked failed")
+	
+	if result["resubmitted"] > 0 or result["failed"] > 0:
+		logger.info("BAPI pipeline recovered transactions: " + str(result))
+	
+	return result
+
+
+def _trimJobs():
+	"""
+	Helper that forgets oldest finished jobs, called with _lock held
+	"""
+	
+	if len(_jobs) <= KEEP_FINISHED:
+		return
+	
+	for uuid in list(_jobs.keys()):
+		if len(_jobs) <= KEEP_FINISHED:
+			return
+		if _jobs[uuid].done.isSet():
+			del _jobs[uuid]
+
+
+def getStatus(uuid, testEnvironment=True):
+	"""
+	Function that returns status of transaction, from memory or from transactions table
+	
+	Parameters
+	----------
+	uuid: str
+		unique identifier for transaction
+	testEnvironment: bool
+		flag to check if the BAPI transaction goes to T16 environment (used when reading table)
+	
+	Returns
+	-------
+	dict
+		uuid, status (status_communication), statusSapAction, text, error
+		status is None when uuid is unknown
+	"""
+	
+	with _lock:
+		job = _jobs.get(uuid)
+		if job is not None:
+			return job.asDict()
+	
+	# submitted by other gateway / script load, only table is known
+	tableName = shared.sap.bapi.getTransactionTarget(testEnvironment)[0]
+	sql = "SELECT status_communication, status_sap_action FROM " + tableName + " WHERE uuid = ?"
+	pyDs = system.db.runPrepQuery(sql, args=[uuid], database="sga_sap_bapi")
+	
+	status = {"uuid": uuid, "status": None, "statusSapAction": None, "text": None, "error": None}
+	if len(pyDs) > 0:
+		status["status"] = pyDs[0]["status_communication"]
+		status["statusSapAction"] = pyDs[0]["status_sap_action"]
+	
+	return status
+
+
+def wait(uuid, timeout=SEND_TIMEOUT):
+	"""
+	Function that blocks until submitted transaction is finished
+	
+	Parameters
+	----------
+	uuid: str
+		unique identifier for transaction
+	timeout: float
+		seconds to wait
+	
+	Returns
+	-------
+	dict
+		same as getStatus, None if transaction was not submitted in this script load
+	"""
+	
+	with _lock:
+		job = _jobs.get(uuid)
+	
+	if job is None:
+		return None
+	
+	job.done.wait(timeout)
+	
+	return job.asDict()
+
+
+def subscribe(uuid, callback):
+	"""
+	Function that registers callback called once transaction is finished
+	Callback gets status dict (see getStatus) and runs on pipeline thread, so it must be short.
+	When transaction is already finished callback is called immediately.
+	
+	Parameters
+	----------
+	uuid: str
+		unique identifier for transaction
+	callback: function
+		function(status)
+	
+	Returns
+	-------
+	bool
+		False if transaction was not submitted in this script load
+	"""
+	
+	with _lock:
+		job = _jobs.get(uuid)
+		if job is None:
+			return False
+		
+		if not job.done.isSet():
+			job.callbacks.append(callback)
+			return True
+	
+	_notify(callback, job)
+	
+	return True
+
+
+def stop(timeout=SEND_TIMEOUT):
+	"""
+	Function that stops thread pool after queued transactions are sent
+	
+	Parameters
+	----------
+	timeout: float
+		seconds to wait
+	
+	Returns
+	-------
+	None
+	"""
+	
+	with _lock:
+		executor = _state["executor"]
+		_state["executor"] = None
+	
+	if executor is None:
+		return
+	
+	executor.shutdown()
+	executor.awaitTermination(long(timeout * 1000), TimeUnit.MILLISECONDS)
+
+
+def getStats():
+	"""
+	Function that returns pipeline counters
+	
+	Parameters
+	----------
+	None
+	
+	Returns
+	-------
+	dict
+		submitted, requests, coalesced, answered, failed, queued (waiting per hub) and activeHubs
+	"""
+	
+	with _lock:
+		stats = dict(_stats)
+		stats["queued"] = sum([len(queue) for queue in _hubQueues.values()])
+		stats["activeHubs"] = len(_activeHubs)
+	
+	return stats
@@ -0,0 +1,181 @@
+#===============================================================================
+# Compiled BAPI templates
+#
+# Every template in shared.sap.templates is compiled once per script load to:
+#  - request skeleton (template without TABLES items)
+#  - one ItemFactory per TABLES entry, built from its template item
+#
+# Items are flat (field -> default), so a new item is one dict copy instead of
+# deepcopy of the whole template; sub-tables (non flat defaults) are copied only
+# for the item that gets them (copy on write).
+#===============================================================================
+
+import threading
+from copy import deepcopy
+
+_compiled = {}
+_compiledLock = threading.Lock()
+
+#===============================================================================
+
+class ItemFactory(object):
+	"""
+	Immutable factory of one BAPI table item
+	
+	Parameters
+	----------
+	item : dict
+		template item (field -> default value)
+	"""
+	
+	__slots__ = ("fields", "_defaults", "_nested")
+	
+	def __init__(self, item):
+		self.fields = tuple(sorted(item.keys()))
+		self._defaults = dict(item)
+		self._nested = tuple([key for key in self.fields if isinstance(item[key], (dict, list))])
+	
+	def new(self, **values):
+		"""
+		Returns new item with default values, overridden by values
+		"""
+		item = dict(self._defaults)
+		
+		for key in self._nested:
+			if key not in values:
+				item[key] = deepcopy(item[key])
+		
+		if values:
+			item.update(values)
+		
+		return item
+	
+	def __getitem__(self, idx):
+		# old code used template["...]["item"][0] as item template
+		if idx != 0:
+			raise IndexError(idx)
+		return self.new()
+
+#===============================================================================
+
+class CompiledTemplate(object):
+	"""
+	Compiled BAPI template, gives fresh requests and item factories
+	
+	Parameters
+	----------
+	name : str
+		name of template in shared.sap.templates
+	template : dict
+		template as defined in shared.sap.templates
+	"""
+	
+	__slots__ = ("name", "items", "_skeleton", "_defaultItems")
+	
+	def __init__(self, name, template):
+		self.name = name
+		self.items = {}
+		self._defaultItems = {}
+		
+		skeleton = deepcopy(template)
+		
+		for tableName, table in _tables(skeleton).items():
+			if isinstance(table, dict) and isinstance(table.get("item"), list):
+				if len(table["item"]) > 0 and isinstance(table["item"][0], dict):
+					self.items[tableName] = ItemFactory(table["item"][0])
+				self._defaultItems[tableName] = table["item"]
+				table["item"] = []
+		
+		self._skeleton = skeleton
+	
+	def item(self, tableName, **values):
+		"""
+		Returns new item of table
+		"""
+		return self.items[tableName].new(**values)
+	
+	def request(self, tables=None):
+		"""
+		Returns new request (not shared with template or other requests)
+		
+		Parameters
+		----------
+		tables : dict
+			table name -> list of items, tables not given keep template items
+		
+		Returns
+		-------
+		dict
+			request ready to be filled and added to transaction
+		"""
+		request = deepcopy(self._skeleton)
+		
+		if tables is None:
+			tables = {}
+		
+		requestTables = _tables(request)
+		for tableName in self._defaultItems:
+			if tableName in tables:
+				requestTables[tableName]["item"] = tables[tableName]
+			else:
+				requestTables[tableName]["item"] = deepcopy(self._defaultItems[tableName])
+		
+		return request
+
+#===============================================================================
+
+def _tables(template):
+	try:
+		tables = template["parameterValues"]["input"]["inputRoot"]["TABLES"]
+	except (KeyError, TypeError):
+		return {}
+	
+	if isinstance(tables, dict):
+		return tables
+	
+	return {}
+
+#===============================================================================
+
+def compileTemplate(name):
+	"""
+	Returns compiled template, compiled on first use
+	
+	Parameters
+	----------
+	name : str
+		name of template in shared.sap.templates (BAPI_PRODORDCONF_CREATE_TT, ...)
+	
+	Returns
+	-------
+	CompiledTemplate
+		None if there is no such template
+	"""
+	
+	compiled = _compiled.get(name)
+	if compiled is not None:
+		return compiled
+	
+	template = shared.sap.templates.__dict__.get(name)
+	if not isinstance(template, dict) or "bapi" not in template:
+		return None
+	
+	compiled = CompiledTemplate(name, template)
+	
+	with _compiledLock:
+		_compiled.setdefault(name, compiled)
+	
+	return _compiled[name]
+
+#===============================================================================
+
+def newRequest(name, tables=None):
+	"""
+	Returns fresh request of template, see CompiledTemplate.request
+	"""
+	
+	compiled = compileTemplate(name)
+	if compiled is None:
+		return None
+	
+	return compiled.request(tables)
@@ -0,0 +1,660 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from java.lang import Runnable
+from java.util import Date
+from java.util.concurrent import Executors, RejectedExecutionException, TimeUnit
+
+# Buffered writer for cycles table
+# Tag change threads only queue rows (with a ticket) and return immediately.
+# One gateway thread stores queued rows in one transaction on size or time threshold,
+# one multi-row INSERT per transaction, ids are generated by the database (AUTO_INCREMENT)
+# and derived from LAST_INSERT_ID().
+# When sga_twpress is unavailable rows are spooled to a local file and replayed in order.
+DATABASE = "sga_twpress"
+TABLE = "cycles"
+
+BATCH_SIZE = 200			# rows in queue that trigger immediate flush
+FLUSH_INTERVAL = 2.0		# seconds between scheduled flushes
+RETRY_INTERVAL = 15.0		# seconds between replay attempts while database is down
+ROWS_PER_TRANSACTION = 200
+STORED_IDS = 10000			# ticket -> id entries kept for getCycleId
+
+# relative to gateway install folder
+SPOOL_FILE = os.path.join("data", "sga_twpress_cycles.spool")
+REJECTED_FILE = SPOOL_FILE + ".rejected"
+
+# writer of previous script load is kept here, so it can be stopped on reload
+_GLOBALS_KEY = "shared.sga.tw.cycleWriter"
+
+_queue = []
+_lock = threading.Lock()
+_storedIds = OrderedDict()		# ticket -> cycles.id of stored rows, oldest first
+_state = {
+	"ticketPrefix": "%x" % long(time.time() * 1000),
+	"ticketCount": 0,
+	"executor": None,
+	"lastFailure": 0.0,
+	"indexChecked": False,
+	"consecutiveIds": None
+}
+_stats = {
+	"queued": 0,
+	"inserted": 0,
+	"spooled": 0,
+	"replayed": 0,
+	"alreadyStored": 0,
+	"rejected": 0,
+	"failedFlushes": 0
+}
+
+
+def _encodeValue(value):
+	"""
+	Helper that makes value json serializable for spool file
+	"""
+	
+	if isinstance(value, Date):
+		return {"$date": value.getTime()}
+	
+	return value
+
+
+def _decodeValue(value):
+	"""
+	Helper that restores value read from spool file
+	"""
+	
+	try:
+		return Date(long(value["$date"]))
+	except:
+		return value
+
+
+def _appendSpool(rows, fileName = SPOOL_FILE):
+	"""
+	Helper that appends rows to spool file, one json document per line
+	"""
+	
+	spoolFile = open(fileName, "a")
+	try:
+		for row in rows:
+			line = {
+				"ticket": row[0],
+				"columns": list(row[1]),
+				"values": [_encodeValue(value) for value in row[2]]
+			}
+			spoolFile.write(system.util.jsonEncode(line) + "\n")
+	finally:
+		spoolFile.close()
+
+
+def _readSpool():
+	"""
+	Helper that reads all spooled rows in order they were queued
+	"""
+	
+	if not os.path.exists(SPOOL_FILE):
+		return []
+	
+	rows = []
+	spoolFile = open(SPOOL_FILE, "r")
+	try:
+		for line in spoolFile:
+			if len(line.strip()) < 1:
+				continue
+			row = system.util.jsonDecode(line)
+			columns = list(row["columns"])
+			values = [_decodeValue(value) for value in row["values"]]
+			
+			# rows spooled with client side id (older writer) get their id from database too
+			if "id" in columns:
+				idx = columns.index("id")
+				del columns[idx]
+				del values[idx]
+			
+			rows.append((row.get("ticket"), tuple(columns), values))
+	finally:
+		spoolFile.close()
+	
+	return rows
+
+
+def _writeSpool(rows):
+	"""
+	Helper that replaces spool file with rows still waiting to be stored
+	"""
+	
+	if len(rows) < 1:
+		if os.path.exists(SPOOL_FILE):
+			os.remove(SPOOL_FILE)
+		return
+	
+	tmpFile = SPOOL_FILE + ".tmp"
+	if os.path.exists(tmpFile):
+		os.remove(tmpFile)
+	
+	_appendSpool(rows, tmpFile)
+	
+	if os.path.exists(SPOOL_FILE):
+		os.remove(SPOOL_FILE)
+	os.rename(tmpFile, SPOOL_FILE)
+
+
+def _ensureIndex():
+	"""
+	Helper that creates index on cycles (press, cycleEndDate) used by replay guard, once per script load
+	"""
+	
+	if _state["indexChecked"]:
+		return
+	
+	sqlQuery = """
+		SELECT COUNT(*)
+		FROM information_schema.statistics s1
+		JOIN information_schema.statistics s2 ON
+			s2.table_schema = s1.table_schema AND
+			s2.table_name = s1.table_name AND
+			s2.index_name = s1.index_name AND
+			s2.seq_in_index = 2
+		WHERE
+			s1.table_schema = DATABASE() AND
+			s1.table_name = ? AND
+			s1.seq_in_index = 1 AND
+			s1.column_name = 'press' AND
+			s2.column_name = 'cycleEndDate'
+	"""
+	
+	if system.db.runScalarPrepQuery(sqlQuery, [TABLE], DATABASE) < 1:
+		system.util.getLogger("PFCE-TW-Press").info("Cycle writer creating index ix_press_cycleEndDate on " + TABLE)
+		system.db.runUpdateQuery("CREATE INDEX ix_press_cycleEndDate ON " + TABLE + " (press, cycleEndDate)", DATABASE)
+	
+	_state["indexChecked"] = True
+
+
+def _consecutiveIds():
+	"""
+	Helper that tells if ids of one multi-row INSERT are consecutive (innodb_autoinc_lock_mode 0 or 1)
+	With interleaved lock mode (2) rows are inserted one by one to read their ids.
+	"""
+	
+	if _state["consecutiveIds"] is None:
+		lockMode = system.db.runScalarQuery("SELECT @@innodb_autoinc_lock_mode", DATABASE)
+		_state["consecutiveIds"] = lockMode is not None and int(lockMode) <= 1
+		
+		if not _state["consecutiveIds"]:
+			system.util.getLogger("PFCE-TW-Press").warn("innodb_autoinc_lock_mode is " + str(lockMode) + ", cycle writer inserts rows one by one")
+	
+	return _state["consecutiveIds"]
+
+
+def _rowKey(row):
+	"""
+	Helper that returns (press, cycleEndDate in millis as stored) identifying a cycle
+	"""
+	
+	rowValues = dict(zip(row[1], row[2]))
+	cycleEndDate = shared.sga.tw.spcRollups.storedDate(rowValues.get("cycleEndDate"))
+	
+	if cycleEndDate is None:
+		return None
+	
+	return (rowValues.get("press"), system.date.toMillis(cycleEndDate))
+
+
+def _storedKeys(rows, transaction):
+	"""
+	Helper that returns keys (see _rowKey) of rows already in cycles table, one query per chunk
+	"""
+	
+	keys = [key for key in set([_rowKey(row) for row in rows]) if key is not None]
+	
+	if len(keys) < 1:
+		return set()
+	
+	args = []
+	for press, cycleEndDate in keys:
+		args.extend([press, system.date.fromMillis(cycleEndDate)])
+	
+	sqlQuery = """
+		SELECT press, cycleEndDate
+		FROM """ + TABLE + """
+		WHERE """ + " OR ".join(["(press = ? AND cycleEndDate = ?)"] * len(keys)) + """
+	"""
+	
+	stored = set()
+	for row in system.db.runPrepQuery(sqlQuery, args, tx = transaction):
+		stored.add((row[0], system.date.toMillis(row[1])))
+	
+	return stored
+
+
+def _insertValues(rows, transaction):
+	"""
+	Helper that inserts rows with one multi-row INSERT per run of rows with same columns
+	Ids are derived from LAST_INSERT_ID() (id of first row) when they are consecutive.
+	
+	Returns
+	-------
+	list
+		cycles.id per row, in order of rows
+	"""
+	
+	ids = []
+	consecutive = _consecutiveIds()
+	start = 0
+	
+	while start < len(rows):
+		columns = rows[start][1]
+		end = start + 1
+		while end < len(rows) and rows[end][1] == columns:
+			end += 1
+		batch = rows[start:end]
+		start = end
+		
+		placeholders = "(" + ",".join(["?"] * len(columns)) + ")"
+		
+		if not consecutive:
+			sqlQuery = "INSERT INTO " + TABLE + " (" + ", ".join(columns) + ") VALUES " + placeholders
+			for ticket, rowColumns, values in batch:
+				ids.append(system.db.runPrepUpdate(sqlQuery, args = values, tx = transaction, getKey = 1))
+			continue
+		
+		args = []
+		for ticket, rowColumns, values in batch:
+			args.extend(values)
+		
+		sqlQuery = """
+			INSERT INTO """ + TABLE + """
+				(""" + ", ".join(columns) + """)
+			VALUES """ + ",".join([placeholders] * len(batch)) + """
+		"""
+		system.db.runPrepUpdate(sqlQuery, args = args, tx = transaction)
+		
+		firstId = system.db.runScalarQuery("SELECT LAST_INSERT_ID()", tx = transaction)
+		ids.extend([firstId + n for n in range(len(batch))])
+	
+	return ids
+
+
+def _insertRows(rows, replay):
+	"""
+	Helper that stores rows with one transaction
+	Spooled rows may have been stored by a commit that failed to answer,
+	on replay rows with same press and end date as a stored row are skipped.
+	
+	Returns
+	-------
+	list
+		(row, id) pairs, id is None for replayed rows that were already stored
+	"""
+	
+	transaction = system.db.beginTransaction(DATABASE)
+	try:
+		skipped = set()
+		toInsert = rows
+		
+		if replay:
+			storedKeys = _storedKeys(rows, transaction)
+			toInsert = []
+			for idx, row in enumerate(rows):
+				key = _rowKey(row)
+				if key in storedKeys:
+					skipped.add(idx)
+					continue
+				if key is not None:
+					storedKeys.add(key)
+				toInsert.append(row)
+		
+		ids = iter(_insertValues(toInsert, transaction))
+		system.db.commitTransaction(transaction)
+	except:
+		system.db.rollbackTransaction(transaction)
+		raise
+	finally:
+		system.db.closeTransaction(transaction)
+	
+	return [(row, None if idx in skipped else ids.next()) for idx, row in enumerate(rows)]
+
+
+def _databaseAvailable():
+	"""
+	Helper that checks if database answers at all
+	"""
+	
+	try:
+		system.db.runScalarQuery("SELECT 1", DATABASE)
+		return True
+	except:
+		return False
+
+
+def _storeRows(rows, replay):
+	"""
+	Helper that stores rows in order
+	
+	Returns
+	-------
+	tuple
+		(row, id) pairs of stored rows, rows that still need to be stored (from first failed transaction on)
+	"""
+	
+	logger = system.util.getLogger("PFCE-TW-Press")
+	stored = []
+	
+	for start in range(0, len(rows), ROWS_PER_TRANSACTION):
+		chunk = rows[start:start + ROWS_PER_TRANSACTION]
+		try:
+			stored.extend(_insertRows(chunk, replay))
+			continue
+		except:
+			if not _databaseAvailable():
+				return stored, rows[start:]
+		
+		# database is there, so transaction failed on data: store rows one by one and put bad ones aside
+		rejected = []
+		for idx, row in enumerate(chunk):
+			try:
+				stored.extend(_insertRows([row], replay))
+			except:
+				if not _databaseAvailable():
+					return stored, rows[start + idx:]
+				rejected.append(row)
+		
+		if len(rejected) > 0:
+			logger.error("Cycle writer rejected " + str(len(rejected)) + " rows, see " + REJECTED_FILE)
+			_appendSpool(rejected, REJECTED_FILE)
+			_stats["rejected"] += len(rejected)
+	
+	return stored, []
+
+
+def _afterStore(stored):
+	"""
+	Helper that publishes ids of stored rows and shreds measurements of rows inserted now
+	Must never block cycle storage.
+	"""
+	
+	alreadyStored = 0
+	
+	with _lock:
+		for row, recordId in stored:
+			if recordId is None or row[0] is None:
+				continue
+			_storedIds[row[0]] = recordId
+		
+		while len(_storedIds) > STORED_IDS:
+			_storedIds.popitem(last = False)
+	
+	for (ticket, columns, values), recordId in stored:
+		# replayed row found in database, its measurements were shredded when it was stored
+		if recordId is None:
+			alreadyStored += 1
+			continue
+		
+		row = dict(zip(columns, values))
+		
+		try:
+			shared.sga.tw.measurements.storeCycleMeasurements(recordId, row["press"], row["cycleEndDate"], row["table1Mold"], row.get("thickness"), row.get("weights"))
+		except:
+			system.util.getLogger("PFCE-TW-Press").warn("Storing cycle measurements failed for cycle " + str(recordId))
+	
+	if alreadyStored > 0:
+		_stats["alreadyStored"] += alreadyStored
+		system.util.getLogger("PFCE-TW-Press").warn("Cycle writer skipped " + str(alreadyStored) + " spooled rows already stored in " + TABLE)
+
+
+def flushNow():
+	"""
+	Function that stores queued rows, replaying spooled rows first
+	Runs on writer thread, call flush() from other threads.
+	
+	Parameters
+	----------
+	None
+	
+	Returns
+	-------
+	int
+		number of rows inserted
+	"""
+	
+	with _lock:
+		rows = _queue[:]
+		del _queue[:]
+	
+	spooled = os.path.exists(SPOOL_FILE)
+	
+	if spooled:
+		# keep order: new rows go behind spooled ones
+		if len(rows) > 0:
+			_appendSpool(rows)
+			_stats["spooled"] += len(rows)
+		
+		if time.time() - _state["lastFailure"] < RETRY_INTERVAL:
+			return 0
+		
+		rows = _readSpool()
+	
+	if len(rows) < 1:
+		return 0
+	
+	try:
+		_ensureIndex()
+	except:
+		system.util.getLogger("PFCE-TW-Press").warn("Cycle writer could not check index on " + TABLE)
+	
+	stored, pending = _storeRows(rows, spooled)
+	
+	if spooled:
+		_writeSpool(pending)
+		_stats["replayed"] += len(stored)
+	elif len(pending) > 0:
+		_appendSpool(pending)
+		_stats["spooled"] += len(pending)
+	
+	if len(pending) > 0:
+		_state["lastFailure"] = time.time()
+		_stats["failedFlushes"] += 1
+		system.util.getLogger("PFCE-TW-Press").warn("Database " + DATABASE + " unavailable, " + str(len(pending)) + " cycles kept in " + SPOOL_FILE)
+	
+	inserted = len([recordId for row, recordId in stored if recordId is not None])
+	_stats["inserted"] += inserted
+	
+	_afterStore(stored)
+	
+	return inserted
+
+
+class _FlushTask(Runnable):
+	"""
+	Runnable that flushes queue, errors are logged so scheduled flushes keep running
+	"""
+	
+	def run(self):
+		try:
+			flushNow()
+		except:
+			system.util.getLogger("PFCE-TW-Press").error("Cycle writer flush failed")
+
+
+def start():
+	"""
+	Function that starts writer thread (called on first queued cycle)
+	Writer of previous script load is stopped, so spool file has single owner.
+	
+	Parameters
+	----------
+	None
+	
+	Returns
+	-------
+	executor
+		running writer executor, use it instead of reading _state again (stop() may clear it)
+	"""
+	
+	with _lock:
+		if _state["executor"] is not None:
+			return _state["executor"]
+	
+	# previous writer flushes before it stops, never wait for it while holding the lock
+	previousStop = system.util.getGlobals().get(_GLOBALS_KEY)
+	if previousStop is not None and previousStop is not stop:
+		try:
+			previousStop()
+		except:
+			pass
+	
+	with _lock:
+		if _state["executor"] is not None:
+			return _state["executor"]
+		
+		executor = Executors.newSingleThreadScheduledExecutor()
+		interval = long(FLUSH_INTERVAL * 1000)
+		executor.scheduleWithFixedDelay(_FlushTask(), interval, interval, TimeUnit.MILLISECONDS)
+		
+		_state["executor"] = executor
+		system.util.getGlobals()[_GLOBALS_KEY] = stop
+	
+	return executor
+
+
+def stop(timeout = 30.0):
+	"""
+	Function that stops writer thread after storing (or spooling) everything queued
+	
+	Parameters
+	----------
+	timeout: float
+		seconds to wait for last flush
+	
+	Returns
+	-------
+	None
+	"""
+	
+	with _lock:
+		executor = _state["executor"]
+		_state["executor"] = None
+	
+	if executor is None:
+		return
+	
+	executor.submit(_FlushTask())
+	executor.shutdown()
+	executor.awaitTermination(long(timeout * 1000), TimeUnit.MILLISECONDS)
+
+
+def flush(timeout = 30.0):
+	"""
+	Function that stores queued rows on writer thread and waits for it
+	
+	Parameters
+	----------
+	timeout: float
+		seconds to wait
+	
+	Returns
+	-------
+	None
+	"""
+	
+	try:
+		future = start().submit(_FlushTask())
+	except RejectedExecutionException:
+		# writer stopped meanwhile, its last flush stored or spooled the queue
+		return
+	
+	future.get(long(timeout * 1000), TimeUnit.MILLISECONDS)
+
+
+def queueCycle(columns, values):
+	"""
+	Function that queues one cycles row to be stored, never touches database
+	
+	Parameters
+	----------
+	columns: list
+		cycles table columns, without id
+	values: list
+		values in same order as columns
+	
+	Returns
+	-------
+	ticket: str
+		reference of queued row, getCycleId(ticket) returns its id once stored
+	"""
+	
+	executor = start()
+	
+	with _lock:
+		_state["ticketCount"] += 1
+		ticket = _state["ticketPrefix"] + "-" + str(_state["ticketCount"])
+		
+		_queue.append((ticket, tuple(columns), list(values)))
+		_stats["queued"] += 1
+		
+		flushRequired = len(_queue) >= BATCH_SIZE
+	
+	if flushRequired:
+		try:
+			executor.execute(_FlushTask())
+		except RejectedExecutionException:
+			# writer stopped meanwhile, row stays queued until next queueCycle starts writer again
+			pass
+	
+	return ticket
+
+
+def getCycleId(ticket, timeout = 0):
+	"""
+	Function that returns id database generated for queued row
+	
+	Parameters
+	----------
+	ticket: str
+		value returned by queueCycle
+	timeout: float
+		seconds to wait for a flush when row is not stored yet, 0 to not wait
+	
+	Returns
+	-------
+	int
+		cycles.id, None while row is queued or spooled (or ticket is too old)
+	"""
+	
+	with _lock:
+		recordId = _storedIds.get(ticket)
+	
+	if recordId is None and timeout > 0:
+		flush(timeout)
+		with _lock:
+			recordId = _storedIds.get(ticket)
+	
+	return recordId
+
+
+def getStats():
+	"""
+	Function that returns writer counters
+	
+	Parameters
+	----------
+	None
+	
+	Returns
+	-------
+	dict
+		queued, inserted, spooled, replayed, alreadyStored, rejected, failedFlushes,
+		pending (in memory) and spoolExists
+	"""
+	
+	with _lock:
+		stats = dict(_stats)
+		stats["pending"] = len(_queue)
+	
+	stats["spoolExists"] = os.path.exists(SPOOL_FILE)
+	
+	return stats
@@ -13,22 +13,8 @@ def getTagValues(parentPath = "", tagPath = "*"):
 		list of tag values ordered, if no values found, return None
 	"""	
 
-	tags = system.tag.browseTags(parentPath = parentPath, tagPath = tagPath, sort = "ASC")
-			
-	tagsToRead = []
-	tagValuesData = []
-	
-	tagsData = {}
-	
-	# loop through tags	
-	for tag in tags:
-		tagsToRead.append(tag.fullPath)
-		
-	tagValues = system.tag.readAll(tagsToRead)
-
-	# get values and build list
-	for tagValue in tagValues:
-		tagValuesData.append(tagValue.value)	
+	# folder content is taken from browse cache, only values are read
+	tagValuesData = shared.sga.tw.tagBrowse.readTagValues(parentPath, tagPath, "ASC")
 		
 	# if values are available, return content, otherwise None
 	if len(tagValuesData) > 0:
@@ -57,7 +43,9 @@ def storeCycleData(data):
 	
 	Returns
 	-------
-	None
+	ticket: str
+		reference of queued cycle, row is stored asynchronously by shared.sga.tw.cycleWriter,
+		shared.sga.tw.cycleWriter.getCycleId(ticket) returns its id once stored
 	"""	
 
 	args = [
@@ -75,26 +63,25 @@ def storeCycleData(data):
 		data["outfeed"]
 	]
 	
-	sqlQuery = """
-		INSERT INTO cycles
-			(
-				press, 
-				cycleEndDate, 
-				table1Mold, 
-				table2Mold, 
-				cycleDuration, 
-				slowestStationName, 
-				thicknessAverage, 
-				thickness, 
-				weightAverage, 
-				weights,
-				rejects,
-				outfeed
-			)
-		VALUES(?,?,?,?,?,?,?,?,?,?,?,?) 
-	"""
+	columns = [
+		"press",
+		"cycleEndDate",
+		"table1Mold",
+		"table2Mold",
+		"cycleDuration",
+		"slowestStationName",
+		"thicknessAverage",
+		"thickness",
+		"weightAverage",
+		"weights",
+		"rejects",
+		"outfeed"
+	]
 	
-	sqlResult = system.db.runPrepUpdate(sqlQuery, args = args, database = "sga_twpress")
+	# queued to buffered writer, measurements are shredded once the row is stored
+	ticket = shared.sga.tw.cycleWriter.queueCycle(columns, args)
+	
+	return ticket
 	
 
 def manageCycle(ignitionTagPath, lastCycleDuration, cycleEndDate, wheelsRejected = False):
@@ -147,7 +134,7 @@ def manageCycle(ignitionTagPath, lastCycleDuration, cycleEndDate, wheelsRejected
 	weightList["w"] = weightData["tagValues"]
 
 	# slowest station
-	slowestStationName, slowestStationCycleTime = getSlowestStationName(ignitionTagPath)
+	slowestStationName, slowestStationCycleTime = shared.sga.tw.stations.getSlowestStationName(ignitionTagPath)
 	
 	# maange outfeed and rejects values
 	rejects = outfeed = 0
@@ -295,8 +282,9 @@ def saveCycle(ignitionTagPath):
 	
 	Returns
 	-------
-	recordId: int
-		Returned database id after insertation
+	ticket: str
+		reference of queued cycle, row is stored asynchronously by shared.sga.tw.cycleWriter,
+		shared.sga.tw.cycleWriter.getCycleId(ticket) returns its id once stored
 	"""
 	
 	# build full path to current T_TW_Press_Cycles udt instance
@@ -329,6 +317,8 @@ def saveCycle(ignitionTagPath):
 	tags.append(build("db/thicknessAverage"))
 	tags.append(build("db/id"))
 	tags.append(build("db/press"))	
+	# live SPC statistics follow the production run
+	tags.append(ignitionTagPath + "/press/analysis/scopeProductionRun/param_startDate")
 	
 	values = system.tag.readAll(tags)
 	
@@ -356,30 +346,35 @@ def saveCycle(ignitionTagPath):
 		cycle["outfeed"]
 	]
 	
-	sqlQuery = """
-		INSERT INTO cycles
-			(
-				press, 
-				cycleEndDate, 
-				table1Mold, 
-				table2Mold, 
-				cycleDuration, 
-				speedLossDuration,
-				speedLossStateCode,
-				slowestStationName, 
-				thickness, 
-				thicknessAverage, 
-				weights,
-				weightAverage, 
-				rejects,
-				outfeed
-			)
-		VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?) 
-	"""
+	columns = [
+		"press",
+		"cycleEndDate",
+		"table1Mold",
+		"table2Mold",
+		"cycleDuration",
+		"speedLossDuration",
+		"speedLossStateCode",
+		"slowestStationName",
+		"thickness",
+		"thicknessAverage",
+		"weights",
+		"weightAverage",
+		"rejects",
+		"outfeed"
+	]
 	
-	recordId = system.db.runPrepUpdate(sqlQuery, args = args, database = "sga_twpress", getKey=1)
+	# queued to buffered writer (stored on writer thread, spooled to file while database is down)
+	# measurements are shredded once the row is stored, live SPC statistics are kept here
+	ticket = shared.sga.tw.cycleWriter.queueCycle(columns, args)
 
-	return recordId	
+	try:
+		for category, measurements in [("thickness", cycle["thickness"]), ("weight", cycle["weights"])]:
+			values = shared.sga.tw.measurements.decodeMeasurements(measurements, category)
+			shared.sga.tw.streamData.recordLiveSpcValues(cycle["press"], cycle["table1Mold"], category, values, cycle["param_startDate"])
+	except:
+		system.util.getLogger("PFCE-TW-Press").warn("Live SPC update failed for " + str(cycle["press"]))
+
+	return ticket
 	
 	
 	
@@ -406,20 +401,8 @@ def getTagValuesData(parentPath = "", tagPath = "*", scope = "w"):
 		two results are returned
 	"""	
 
-	tags = system.tag.browseTags(parentPath = parentPath, tagPath = tagPath, sort = "ASC")
-			
-	tagsToRead = []
-	tagValuesData = []
-	
-	# loop through tags	
-	for tag in tags:
-		tagsToRead.append(tag.fullPath)
-		
-	tagValues = system.tag.readAll(tagsToRead)
-
-	# get values and build list
-	for tagValue in tagValues:
-		tagValuesData.append(tagValue.value)	
+	# folder content is taken from browse cache, only values are read
+	tagValuesData = shared.sga.tw.tagBrowse.readTagValues(parentPath, tagPath, "ASC")
 		
 	# if values are available, return content, otherwise None
 	if len(tagValuesData) > 0:
@@ -0,0 +1,488 @@
+import threading
+import time
+
+# Shared decoder for TW press diagnostic words (flexovit, maternini, poggi)
+# Tag path -> state offset is parsed once per tag and kept in _offsets,
+# words are decoded with byte lookup tables and all active bits are reported.
+# State of bit n is offset + n (maternini: bit n of word with swapped 16 bit halves).
+
+# bit positions set in each byte value, ascending
+_BYTE_BITS = tuple([tuple([bit for bit in range(8) if byte & (1 << bit)]) for byte in range(256)])
+
+_WIDTHS = {"b": 8, "w": 16, "d": 32}
+
+_offsets = {}		# (pressType, tagPath) -> (ignitionTagPath, offset, width, swapHalves) or None
+_offsetsLock = threading.Lock()
+
+
+def activeBits(value, width = 32):
+	"""
+	Function that returns positions of all bits set in diagnostic word
+	
+	Parameters
+	----------
+	value: int
+		diagnostic word (negative values are taken as unsigned word of given width)
+	width: int
+		number of bits in word
+	
+	Returns
+	-------
+	list
+		bit positions, ascending
+	"""
+	
+	if not value:
+		return []
+	
+	value = int(value) & ((1 << width) - 1)
+	
+	bits = []
+	shift = 0
+	while value:
+		byte = value & 0xFF
+		if byte:
+			for bit in _BYTE_BITS[byte]:
+				bits.append(shift + bit)
+		value >>= 8
+		shift += 8
+	
+	return bits
+
+
+def _swapHalves(value):
+	"""
+	Helper that swaps high and low word of dword (rotation by 16 bits)
+	"""
+	
+	value = int(value) & 0xFFFFFFFF
+	return ((value >> 16) | (value << 16)) & 0xFFFFFFFF
+
+
+def _ignitionTagPath(tagPathParts):
+	return "/".join(tagPathParts[:4])
+
+
+def _parseFlexovit(tagPath):
+	"""
+	Helper that computes state offset of flexovit diagnostic tag
+	example: P51/signals/diagnostics/press/table2/st05_d02
+	"""
+	
+	tagPathParts = tagPath.split("/")
+	if len(tagPathParts) < 6:
+		return None
+	
+	lastPart = tagPathParts[-1]
+	tablePart = tagPathParts[-2]
+	categoryPart = tagPathParts[-3]
+	
+	if len(lastPart) < 3 or lastPart[-3] not in _WIDTHS:
+		return None
+	
+	try:
+		addressOffset = int(lastPart[-2:])
+	except ValueError:
+		return None
+	
+	stationOffset = 0
+	if len(lastPart) == 8 and lastPart[-4] == '_' and lastPart[:2] == 'st':
+		stationOffset = int(lastPart[2:4]) * 1000
+	
+	tableOffset = 0
+	if tablePart == 'table1':
+		if categoryPart == 'press':
+			categoryOffset, tableOffset = 200000, 10000
+		else:
+			categoryOffset, tableOffset = 100000, 500
+	elif tablePart == 'table2':
+		if categoryPart == 'press':
+			categoryOffset, tableOffset = 200000, 50000
+		else:
+			categoryOffset, tableOffset = 100000, 750
+	elif tablePart == 'general':
+		categoryOffset = 100000
+	elif tablePart == 'stacking':
+		categoryOffset = 300000
+	else:
+		return None
+	
+	offset = categoryOffset + tableOffset + stationOffset + (addressOffset * 8)
+	
+	return (_ignitionTagPath(tagPathParts), offset, _WIDTHS[lastPart[-3]], False)
+
+
+def _parseMaternini(tagPath):
+	"""
+	Helper that computes state offset of maternini status dword
+	Tag name: 3rd char station, chars 5-6 table (t1/t2), 8th char 1/2, last char dword 1/2
+	"""
+	
+	tagPathParts = tagPath.split("/")
+	tagName = tagPathParts[-1]
+	
+	if len(tagPathParts) < 5 or len(tagName) < 9:
+		return None
+	
+	table = tagName[5:7]
+	if table == "t1":
+		offset = 10000
+	elif table == "t2":
+		offset = 20000
+	else:
+		return None
+	
+	if not (tagName[3] in "0123456789" and tagName[8] in "12"):
+		return None
+	offset += int(tagName[3]) * 100
+	
+	# index 0 is for the station, +32 for next dword
+	dword = tagName[-1:]
+	if dword == "1":
+		offset += 1
+	elif dword == "2":
+		offset += 33
+	else:
+		return None
+	
+	return (_ignitionTagPath(tagPathParts), offset, 32, True)
+
+
+def _parsePoggi(tagPath):
+	"""
+	Helper that computes state of poggi diagnostic flag (diagNN, one state per tag)
+	"""
+	
+	tagPathParts = tagPath.split("/")
+	if len(tagPathParts) < 5:
+		return None
+	
+	try:
+		byteId = int(tagPathParts[-1].replace("diag", ""))
+	except ValueError:
+		return None
+	
+	if byteId < 1:
+		return None
+	
+	return (_ignitionTagPath(tagPathParts), 10000 + (byteId * 10), 1, False)
+
+
+_PARSERS = {
+	"flexovit": _parseFlexovit,
+	"maternini": _parseMaternini,
+	"poggi": _parsePoggi
+}
+
+
+def getOffset(pressType, tagPath):
+	"""
+	Function that returns precomputed offset of diagnostic tag (parsed on first use)
+	
+	Parameters
+	----------
+	pressType: str
+		flexovit, maternini or poggi
+	tagPath: str
+		path of diagnostic tag
+	
+	Returns
+	-------
+	tuple
+		(ignitionTagPath, offset, width, swapHalves), None if tag path is not a diagnostic tag
+	"""
+	
+	key = (pressType, tagPath)
+	
+	try:
+		return _offsets[key]
+	except KeyError:
+		pass
+	
+	entry = _PARSERS[pressType](tagPath)
+	
+	with _offsetsLock:
+		_offsets[key] = entry
+	
+	return entry
+
+
+def compileOffsets(pressType, tagPaths):
+	"""
+	Function that precomputes offsets of all diagnostic tags of a press (e.g. from browse of diagnostics folder)
+	
+	Parameters
+	----------
+	pressType: str
+		flexovit, maternini or poggi
+	tagPaths: list
+		paths of diagnostic tags
+	
+	Returns
+	-------
+	int
+		number of tags recognised as diagnostic tags
+	"""
+	
+	compiled = 0
+	for tagPath in tagPaths:
+		if getOffset(pressType, str(tagPath)) is not None:
+			compiled += 1
+	
+	return compiled
+
+
+def clearOffsets():
+	with _offsetsLock:
+		_offsets.clear()
+
+
+def decode(pressType, tagPath, value):
+	"""
+	Function that decodes one diagnostic word to state codes of all active bits
+	
+	Parameters
+	----------
+	pressType: str
+		flexovit, maternini or poggi
+	tagPath: str
+		path of diagnostic tag
+	value: int or bool
+		value of diagnostic tag
+	
+	Returns
+	-------
+	tuple
+		(ignitionTagPath, states) states ascending (last one is the state of most significant bit),
+		None if tag path is not a diagnostic tag
+	"""
+	
+	entry = getOffset(pressType, tagPath)
+	if entry is None:
+		return None
+	
+	ignitionTagPath, offset, width, swapHalves = entry
+	
+	if not value:
+		return (ignitionTagPath, [])
+	
+	if width == 1:
+		return (ignitionTagPath, [offset])
+	
+	if swapHalves:
+		value = _swapHalves(value)
+	
+	return (ignitionTagPath, [offset + bit for bit in activeBits(value, width)])
+
+
+def decodeBatch(pressType, events):
+	"""
+	Function that decodes batch of diagnostic tag events
+	
+	Parameters
+	----------
+	pressType: str
+		flexovit, maternini or poggi
+	events: list
+		list of (tagPath, value)
+	
+	Returns
+	-------
+	dict
+		ignitionTagPath -> list of active states (in order of events, ascending per event)
+	"""
+	
+	result = {}
+	
+	for tagPath, value in events:
+		decoded = decode(pressType, tagPath, value)
+		if decoded is None or len(decoded[1]) < 1:
+			continue
+		
+		states = result.get(decoded[0])
+		if states is None:
+			result[decoded[0]] = decoded[1]
+		else:
+			states.extend(decoded[1])
+	
+	return result
+
+
+def firstDefinedState(ignitionTagPath, states):
+	"""
+	Function that returns state of most significant active bit that is defined for equipment
+	
+	Parameters
+	----------
+	ignitionTagPath: str
+		path to machine tag pointer (MES_UDT)
+	states: list
+		active states, ascending (see decode)
+	
+	Returns
+	-------
+	tuple
+		(state, row of param_statesDataset), (None, None) if no active state is defined
+	"""
+	
+	for state in reversed(states):
+		stateDetails = shared.mes.equipment.getEquipmentStateOptions(ignitionTagPath, state)
+		if stateDetails:
+			return state, stateDetails
+	
+	return None, None
+
+
+def loadTrace(filePath):
+	"""
+	Function that reads recorded diagnostic trace
+	CSV lines: tagPath,value (optional third column timestamp is ignored), lines starting with # are skipped
+	
+	Parameters
+	----------
+	filePath: str
+		path to trace file
+	
+	Returns
+	-------
+	list
+		list of (tagPath, value)
+	"""
+	
+	events = []
+	
+	traceFile = open(filePath, "r")
+	try:
+		for line in traceFile:
+			line = line.strip()
+			if len(line) < 1 or line.startswith("#"):
+				continue
+			
+			parts = line.split(",")
+			value = parts[1].strip()
+			if value.lower() in ("true", "false"):
+				value = value.lower() == "true"
+			else:
+				value = int(float(value))
+			
+			events.append((parts[0].strip(), value))
+	finally:
+		traceFile.close()
+	
+	return events
+
+
+def traceFromHistory(tagPaths, startDate, endDate):
+	"""
+	Function that builds diagnostic trace from tag history of diagnostic tags
+	
+	Parameters
+	----------
+	tagPaths: list
+		paths of historized diagnostic tags
+	startDate: date
+		start of trace
+	endDate: date
+		end of trace
+	
+	Returns
+	-------
+	list
+		list of (tagPath, value) ordered by time
+	"""
+	
+	history = system.tag.queryTagHistory(paths = tagPaths, startDate = startDate, endDate = endDate, returnFormat = "Tall", noInterpolation = True)
+	pyDs = system.dataset.toPyDataSet(history)
+	
+	rows = []
+	for row in pyDs:
+		if row["value"] is not None:
+			rows.append((row["timestamp"], str(row["path"]), row["value"]))
+	
+	rows.sort(key = lambda row: row[0])
+	
+	return [(row[1], row[2]) for row in rows]
+
+
+def _legacyDecode(pressType, tagPath, value):
+	"""
+	Helper with per event decoding as done by handlers before this module (string parsing + while loop MSB)
+	Kept for replay benchmark only.
+	"""
+	
+	def MSB(n):
+		ndx = 0
+		while ( 1 < n ):
+			n = ( n >> 1 )
+			ndx += 1
+		return ndx
+	
+	entry = _PARSERS[pressType](tagPath)
+	if entry is None or not value:
+		return None
+	
+	if entry[2] == 1:
+		return entry[1]
+	
+	if entry[3]:
+		ror = lambda val, r_bits, max_bits: \
+				((val & (2**max_bits-1)) >> r_bits%max_bits) | \
+				(val << (max_bits-(r_bits%max_bits)) & (2**max_bits-1))
+		value = ror(value, 16, 32)
+	
+	return entry[1] + int(MSB(value))
+
+
+def replayBenchmark(pressType, events, repeat = 10):
+	"""
+	Function that replays recorded diagnostic trace through legacy per event decoding and through this decoder
+	Meant to be run from script console, e.g.
+	shared.sga.tw.diagnostics.replayBenchmark("flexovit", shared.sga.tw.diagnostics.loadTrace(path))
+	
+	Parameters
+	----------
+	pressType: str
+		flexovit, maternini or poggi
+	events: list
+		list of (tagPath, value), see loadTrace / traceFromHistory
+	repeat: int
+		number of replays
+	
+	Returns
+	-------
+	dict
+		events, legacySeconds, decodeSeconds, batchSeconds, eventsPerSecond (decodeBatch),
+		activeBits (all states reported) and msbOnly (states legacy handler would see)
+	"""
+	
+	start = time.time()
+	for idx in range(repeat):
+		msbOnly = 0
+		for tagPath, value in events:
+			if _legacyDecode(pressType, tagPath, value) is not None:
+				msbOnly += 1
+	legacySeconds = time.time() - start
+	
+	clearOffsets()
+	start = time.time()
+	for idx in range(repeat):
+		for tagPath, value in events:
+			decode(pressType, tagPath, value)
+	decodeSeconds = time.time() - start
+	
+	start = time.time()
+	for idx in range(repeat):
+		batch = decodeBatch(pressType, events)
+	batchSeconds = time.time() - start
+	
+	nbEvents = len(events) * repeat
+	
+	return {
+		"events": nbEvents,
+		"legacySeconds": legacySeconds,
+		"decodeSeconds": decodeSeconds,
+		"batchSeconds": batchSeconds,
+		"eventsPerSecond": nbEvents / batchSeconds if batchSeconds > 0 else None,
+		"activeBits": sum([len(states) for states in batch.values()]) if len(events) > 0 else 0,
+		"msbOnly": msbOnly
+	}
@@ -18,22 +18,8 @@ def getTagValues(parentPath = "", tagPath = "*"):
 		list of tag values ordered, if no values found, return None
 	"""	
 
-	tags = system.tag.browseTags(parentPath = parentPath, tagPath = tagPath, sort = "ASC")
-			
-	tagsToRead = []
-	tagValuesData = []
-	
-	tagsData = {}
-	
-	# loop through tags	
-	for tag in tags:
-		tagsToRead.append(tag.fullPath)
-		
-	tagValues = system.tag.readAll(tagsToRead)
-
-	# get values and build list
-	for tagValue in tagValues:
-		tagValuesData.append(tagValue.value)	
+	# folder content is taken from browse cache, only values are read
+	tagValuesData = shared.sga.tw.tagBrowse.readTagValues(parentPath, tagPath, "ASC")
 		
 	# if values are available, return content, otherwise None
 	if len(tagValuesData) > 0:
@@ -69,78 +55,24 @@ def diagnosticsChanged(tagPath, value):
 	
 	"""
 	
-	#Most significant bit calculation
-	def MSB(n):
-		ndx = 0
-		while ( 1 < n ):
-			n = ( n >> 1 )
-			ndx += 1
-		return ndx
-
 	#Exit immediatly if value is 0
 	if value == 0:
 		return False
 
-	#Define all needed variables
-	tableOffset, categoryOffset, addressOffset, stationOffset = 0, 0, 0, 0
-	#Split tag path to get parts
-	tagPathParts = tagPath.split("/")
-	#Prepare igntionTagPath to target MES tag later
-	ignitionTagPath = tagPathParts[0] + "/" + tagPathParts[1] + "/" + tagPathParts[2] + "/" + tagPathParts[3]
-	#Define comparison values  from most significant tag path parts
-	lastPart = tagPathParts[-1]
-	tablePart = tagPathParts[-2]
-	categoryPart = tagPathParts[-3]
-	
-	#If third character from last is d or w or b than tagName is correct and we can take last two characters and turn them in INT and define as addressOffset value
-	if lastPart[-3] == 'd' or lastPart[-3] == 'w' or lastPart[-3] == 'b':
-		addressOffset = int(lastPart[-2:])
-	#If we detect a station identifier in lastPart we define stationOffset value
-		if len(lastPart) == 8 and lastPart[-4] == '_' and lastPart[:2] == 'st':
-			stationId = lastPart[2:4]
-			stationOffset =  int(stationId)*1000
-	#Exit if tagName is not correct
-	else:
-		return False
+	#Offsets are parsed from tag path once (shared.sga.tw.diagnostics), states of all active bits are returned
+	decoded = shared.sga.tw.diagnostics.decode("flexovit", tagPath, value)
 	
-	#If tablePart is table1 check what category is in categoryPart.
-	#If it is not 'press' in can only be 'general'. Define categoryOffset and tableOffset accordingly
-	if tablePart == 'table1':
-		if categoryPart == 'press':
-			categoryOffset = 200000
-			tableOffset = 10000
-		else:
-			categoryOffset = 100000
-			tableOffset = 500
-	
-	#Same check fot table2
-	elif tablePart == 'table2':
-		if categoryPart == 'press':
-			categoryOffset = 200000
-			tableOffset = 50000
-		else:
-			categoryOffset = 100000
-			tableOffset = 750
-	
-	#If table part is 'general' then table is not specified. Only define categoryOffset
-	elif tablePart == 'general':
-		categoryOffset = 100000
-	
-	#If table part is 'stacking' then there can be no table only categoryOffset
-	elif tablePart == 'stacking':
-		categoryOffset = 300000
-	
-	else:
+	#Exit if tagName is not correct
+	if decoded is None:
 		return False
 	
-	#Sum up all offsets to get state starting bit
-	state = categoryOffset + tableOffset + stationOffset + (addressOffset*8)
+	ignitionTagPath, states = decoded
 	
-	#Add a bit value to state root 
-	state = state + int(MSB(value))
+	#Most significant active bit that has state definition
+	state, stateDetails = shared.sga.tw.diagnostics.firstDefinedState(ignitionTagPath, states)
 	
 	# if state is found in definitions
-	if shared.mes.equipment.getEquipmentStateOptions(ignitionTagPath, state):
+	if state is not None:
 		#Write state to /press/cycles/current/prod_tempStateCode press UDT
 		system.tag.write(ignitionTagPath + "/press/cycles/current/prod_tempStateCode", state)
 
@@ -0,0 +1,343 @@
+from array import array
+
+# Narrow, indexed copy of cycles.weights / cycles.thickness
+# One row per (cycle, category, cavity), so SPC can be read as numbers
+# instead of decoding one JSON document per cycle.
+TABLE = "cycle_measurements"
+DATABASE = "sga_twpress"
+
+CATEGORY_KEYS = {
+	"thickness": "t",
+	"weight": "w"
+}
+
+_state = {
+	"tableCreated": False
+}
+
+
+def createMeasurementTable():
+	"""
+	Function that creates measurement table and its indexes if they don't exist yet
+
+	Parameters
+	----------
+	None
+
+	Returns
+	-------
+	None
+	"""
+
+	sqlQuery = """
+		CREATE TABLE IF NOT EXISTS """ + TABLE + """
+			(
+				cycleId INT NOT NULL,
+				press VARCHAR(16) NOT NULL,
+				cycleEndDate DATETIME NOT NULL,
+				mold SMALLINT NOT NULL,
+				category ENUM('thickness', 'weight') NOT NULL,
+				cavity TINYINT NOT NULL,
+				cavities TINYINT NOT NULL,
+				value DOUBLE NULL,
+				PRIMARY KEY (cycleId, category, cavity),
+				INDEX ix_spc (press, category, cycleEndDate, mold, cavity, cavities, value)
+			)
+	"""
+
+	system.db.runUpdateQuery(sqlQuery, DATABASE)
+
+	_state["tableCreated"] = True
+
+
+def decodeMeasurements(measurements, category):
+	"""
+	Function that turns weights / thickness value as stored in cycle tags or cycles table to list of values
+
+	Parameters
+	----------
+	measurements: str or dict
+		json like {"w": [...]} or {"t": [...]}, possibly encoded as string
+	category: str
+		"weight" or "thickness"
+
+	Returns
+	-------
+	list
+		list of measurements per cavity, empty list if nothing can be decoded
+	"""
+
+	if measurements is None:
+		return []
+
+	if isinstance(measurements, basestring):
+		# cycles table holds json encoded as json string: "{\"t\": [...]}"
+		measurements = measurements.strip().strip('"').replace('\\"', '"')
+		if len(measurements) < 1:
+			return []
+		measurements = system.util.jsonDecode(measurements)
+
+	try:
+		return list(measurements[CATEGORY_KEYS[category]])
+	except:
+		return []
+
+
+def _buildRows(cycleId, press, cycleEndDate, mold, category, values):
+	"""
+	Helper that builds insert args for one cycle and category
+	"""
+
+	args = []
+	cavities = len(values)
+
+	for idx, value in enumerate(values):
+		args.extend([cycleId, press, cycleEndDate, mold, category, idx + 1, cavities, value])
+
+	return args
+
+
+def _insertRows(args, rowsPerStatement = 1000, tx = None):
+	"""
+	Helper that stores measurement rows with multi-row statements, existing rows are kept
+	"""
+
+	inserted = 0
+	step = rowsPerStatement * 8
+
+	for start in range(0, len(args), step):
+		chunk = args[start:start + step]
+		sqlQuery = """
+			INSERT IGNORE INTO """ + TABLE + """
+				(cycleId, press, cycleEndDate, mold, category, cavity, cavities, value)
+			VALUES """ + ",".join(["(?,?,?,?,?,?,?,?)"] * (len(chunk) / 8))
+
+		inserted += system.db.runPrepUpdate(sqlQuery, args = chunk, database = DATABASE, tx = tx)
+
+	return inserted
+
+
+def storeCycleMeasurements(cycleId, press, cycleEndDate, mold, thickness, weights):
+	"""
+	Function that shreds thickness and weights of one cycle to measurement table and hourly SPC rollups
+
+	Parameters
+	----------
+	cycleId: int
+		id of the record in cycles table
+	press: str
+		press identifier (P55, P54, ...)
+	cycleEndDate: date
+		end of the cycle
+	mold: int
+		mold on table 1
+	thickness: str or dict
+		thickness as stored in cycles table
+	weights: str or dict
+		weights as stored in cycles table
+
+	Returns
+	-------
+	int
+		number of rows inserted
+	"""
+
+	if cycleId is None or mold is None or cycleEndDate is None:
+		return 0
+
+	if not _state["tableCreated"]:
+		createMeasurementTable()
+
+	# stored rows and rollups are bucketed on the time DATETIME keeps (whole seconds)
+	cycleEndDate = shared.sga.tw.spcRollups.storedDate(cycleEndDate)
+
+	inserted = 0
+
+	transaction = system.db.beginTransaction(DATABASE)
+	try:
+		for category, measurements in [("thickness", thickness), ("weight", weights)]:
+			values = decodeMeasurements(measurements, category)
+			categoryInserted = _insertRows(_buildRows(cycleId, press, cycleEndDate, mold, category, values), tx = transaction)
+
+			# rollups follow rows inserted now only, so a replayed cycle is never counted twice
+			if categoryInserted > 0:
+				shared.sga.tw.spcRollups.addCycle(press, cycleEndDate, mold, category, values, transaction)
+
+			inserted += categoryInserted
+
+		system.db.commitTransaction(transaction)
+	except:
+		system.db.rollbackTransaction(transaction)
+		raise
+	finally:
+		system.db.closeTransaction(transaction)
+
+	return inserted
+
+
+def getMeasurements(startDate, endDate, press, category, molds, cavities = None, dateQueryString = ""):
+	"""
+	Function that reads measurements of requested molds and cavities as numeric columns
+
+	Parameters
+	----------
+	startDate: date
+		start of data period
+	endDate: date
+		end of data period
+	press: str
+		press identifier (P55, P54, ...)
+	category: str
+		"weight" or "thickness"
+	molds: list
+		list of molds
+	cavities: list
+		list of cavities, None for all
+	dateQueryString: str
+		additional filter on cycleEndDate (same as streamData.getRawData)
+
+	Returns
+	-------
+	sqlResult: pyDataSet
+		cycleEndDate, mold, cavity, cavities, value
+	"""
+
+	args = [press, category, startDate, endDate]
+	args.extend(molds)
+
+	cavityFilter = ""
+	if cavities:
+		cavityFilter = " AND cavity IN (" + ",".join(["?"] * len(cavities)) + ")"
+		args.extend(cavities)
+
+	# dynamically build filter based on date periods
+	filter = ""
+	if len(dateQueryString) > 0:
+		filter = " AND (" + dateQueryString + ")"
+
+	sqlQuery = """
+		SELECT
+			cycleEndDate, mold, cavity, cavities, value
+		FROM
+			""" + TABLE + """
+		WHERE
+			press = ? AND
+			category = ? AND
+			cycleEndDate > ? AND
+			cycleEndDate < ? AND
+			mold IN (""" + ",".join(["?"] * len(molds)) + """)
+			""" + cavityFilter + filter + """
+	"""
+
+	return system.db.runPrepQuery(sqlQuery, args, DATABASE)
+
+
+def getSpcData(startDate, endDate, press, spcFilter, dateQueryString = ""):
+	"""
+	Function that replaces streamData.getRawData + prepareSpcData, reading the measurement table
+	Like prepareSpcData, only cycles where all requested cavities were measured are taken.
+
+	Parameters
+	----------
+	startDate: date
+		start of data period
+	endDate: date
+		end of data period
+	press: str
+		press identifier (P55, P54, ...)
+	spcFilter: json
+		filtration of data (reflects what will be returned as result)
+	dateQueryString: str
+		additional filter on cycleEndDate
+
+	Returns
+	-------
+	spcData: array('d')
+		buffer of data for building histogram, None if filter is incomplete
+	"""
+
+	category = spcFilter["filter"]["category"]
+	molds = spcFilter["filter"]["molds"]
+	cavities = spcFilter["filter"]["cavities"]
+
+	if len(category) < 1 or len(molds) < 1:
+		return None
+
+	sqlResult = getMeasurements(startDate, endDate, press, category, molds, cavities, dateQueryString)
+
+	nbCavities = len(cavities)
+	spcData = array('d')
+
+	for row in sqlResult:
+		if row["cavities"] == nbCavities and row["value"] is not None:
+			spcData.append(row["value"])
+
+	return spcData
+
+
+def backfillMeasurements(fromId = 0, batchSize = 500, maxBatches = None):
+	"""
+	Function that shreds existing cycles rows to measurement table
+	Safe to rerun (rows already present are ignored), can be resumed from returned id.
+	Meant to be run from gateway timer or script console until it returns None.
+
+	Parameters
+	----------
+	fromId: int
+		cycles.id to start after
+	batchSize: int
+		number of cycles processed per statement
+	maxBatches: int
+		stop after this many batches, None to process everything
+
+	Returns
+	-------
+	lastId: int
+		last processed cycles.id, None when all cycles are processed
+	"""
+
+	createMeasurementTable()
+
+	sqlQuery = """
+		SELECT
+			id,
+			press,
+			cycleEndDate,
+			table1Mold,
+			TRIM(BOTH '"' FROM CAST(thickness AS CHAR CHARACTER SET utf8)) as thickness,
+			TRIM(BOTH '"' FROM CAST(weights AS CHAR CHARACTER SET utf8)) as weights
+		FROM
+			cycles
+		WHERE
+			id > ?
+		ORDER BY
+			id
+		LIMIT """ + str(int(batchSize))
+
+	lastId = fromId
+	batches = 0
+
+	while maxBatches is None or batches < maxBatches:
+		sqlResult = system.db.runPrepQuery(sqlQuery, [lastId], DATABASE)
+
+		if len(sqlResult) < 1:
+			return None
+
+		args = []
+		for row in sqlResult:
+			if row["table1Mold"] is None or row["cycleEndDate"] is None:
+				continue
+
+			for category, column in [("thickness", "thickness"), ("weight", "weights")]:
+				try:
+					values = decodeMeasurements(row[column], category)
+				except:
+					values = []
+				args.extend(_buildRows(row["id"], row["press"], row["cycleEndDate"], row["table1Mold"], category, values))
+
+		_insertRows(args)
+
+		lastId = sqlResult[len(sqlResult) - 1]["id"]
+		batches += 1
+
+	return lastId
@@ -42,13 +42,11 @@ def storeToMes(ignitionTagPath):
 	
 	if confirmationEnabled:
 		bapiTemplates = prepareTemplates(ignitionTagPath, batchMaterials)
-		# Prepare transaction
-		uuid = shared.sap.bapi.prepareTransaction(confirmationTestMode)
+		# Prepare transaction, all operations stored with one write
+		uuid = shared.sap.bapi.prepareTransaction(confirmationTestMode, bapiTemplates)
 		
-		for bapi in bapiTemplates:
-			shared.sap.bapi.addOperation(uuid, bapi, confirmationTestMode)
-		
-		log = shared.sap.bapi.tryTransaction(uuid, confirmationTestMode,bapiTemplates)
+		# sent in background, tag change / client thread must not wait for hub answer (up to 300 s)
+		shared.sap.bapi.submitTransaction(uuid, confirmationTestMode, bapiTemplates)
 		# TO DO LOGS
 	# 
 
@@ -613,6 +611,7 @@ def buildMaterialConsumptionTag(ignitionTagPath, workorder, outfeed):
 	
 	if not system.tag.exists(ignitionTagPath+"/MESProcessTags/materialConsumption"):
 		system.tag.addTag(parentPath=ignitionTagPath+"/MESProcessTags",name="materialConsumption",tagType="MEMORY", dataType="DataSet")
+		shared.sga.tw.tagBrowse.invalidate(ignitionTagPath+"/MESProcessTags")
 	
 	system.tag.write(ignitionTagPath+"/MESProcessTags/materialConsumption",matConsumptionDs)		
 	#print system.util.jsonEncode(dictGoodsMovement,4)
\ No newline at end of file
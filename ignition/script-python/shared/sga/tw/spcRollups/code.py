@@ -0,0 +1,425 @@
+from math import floor
+
+# Hourly SPC rollups per press / category / mold / cavity
+# spc_rollup_hourly keeps count, sum, sum of squares, min and max,
+# spc_rollup_bins keeps a fixed-bin histogram on the 10^-BIN_DIGITS grid,
+# which is the grid streamData.buildSpcData rounds its bins to, so merged
+# rollups give the same histogram, cp and cpk as the raw measurements.
+DATABASE = "sga_twpress"
+BIN_DIGITS = 3
+SENTINEL = -99.0
+
+_KEY_COLUMNS = "press, category, hourStart, mold, cavity, cavities"
+
+_state = {
+	"tablesCreated": False
+}
+
+
+def createRollupTables():
+	"""
+	Function that creates rollup tables if they don't exist yet
+
+	Parameters
+	----------
+	None
+
+	Returns
+	-------
+	None
+	"""
+
+	sqlQueries = [
+		"""
+		CREATE TABLE IF NOT EXISTS spc_rollup_hourly
+			(
+				press VARCHAR(16) NOT NULL,
+				category ENUM('thickness', 'weight') NOT NULL,
+				hourStart DATETIME NOT NULL,
+				mold SMALLINT NOT NULL,
+				cavity TINYINT NOT NULL,
+				cavities TINYINT NOT NULL,
+				sampleCount INT NOT NULL,
+				sumValue DOUBLE NOT NULL,
+				sumSquares DOUBLE NOT NULL,
+				minValue DOUBLE NOT NULL,
+				maxValue DOUBLE NOT NULL,
+				PRIMARY KEY (press, category, hourStart, mold, cavity, cavities)
+			)
+		""",
+		"""
+		CREATE TABLE IF NOT EXISTS spc_rollup_bins
+			(
+				press VARCHAR(16) NOT NULL,
+				category ENUM('thickness', 'weight') NOT NULL,
+				hourStart DATETIME NOT NULL,
+				mold SMALLINT NOT NULL,
+				cavity TINYINT NOT NULL,
+				cavities TINYINT NOT NULL,
+				bin INT NOT NULL,
+				sampleCount INT NOT NULL,
+				PRIMARY KEY (press, category, hourStart, mold, cavity, cavities, bin)
+			)
+		"""
+	]
+
+	for sqlQuery in sqlQueries:
+		system.db.runUpdateQuery(sqlQuery, DATABASE)
+
+	_state["tablesCreated"] = True
+
+
+def _ensureTables():
+	"""
+	Helper that creates rollup tables on first use after script load
+	"""
+	if not _state["tablesCreated"]:
+		createRollupTables()
+
+
+def storedDate(date):
+	"""
+	Function that rounds date to whole seconds, the way DATETIME columns store it
+	Rollups are bucketed on stored time, so a cycle at hh:59:59.6 goes to the next hour,
+	same as its measurement rows.
+	"""
+	if date is None:
+		return None
+	return system.date.fromMillis(((system.date.toMillis(date) + 500) / 1000) * 1000)
+
+
+def floorHour(date):
+	"""
+	Function that returns start of the hour for given date
+	"""
+	return system.date.setTime(date, system.date.getHour24(date), 0, 0)
+
+
+def ceilHour(date):
+	"""
+	Function that returns start of the next hour for given date, date itself if already on the hour
+	"""
+	hourStart = floorHour(date)
+	if system.date.isBefore(hourStart, date):
+		hourStart = system.date.addHours(hourStart, 1)
+	return hourStart
+
+
+def addCycle(press, cycleEndDate, mold, category, values, tx = None):
+	"""
+	Function that adds measurements of one cycle to the hourly rollup
+	Not idempotent: called by shared.sga.tw.measurements.storeCycleMeasurements only for
+	measurement rows it actually inserted, in the same transaction.
+
+	Parameters
+	----------
+	press: str
+		press identifier (P55, P54, ...)
+	cycleEndDate: date
+		end of the cycle
+	mold: int
+		mold on table 1
+	category: str
+		"weight" or "thickness"
+	values: list
+		measurements per cavity, None and -99.0 are skipped
+	tx: str
+		transaction to run in, None for autocommit
+
+	Returns
+	-------
+	None
+	"""
+
+	if cycleEndDate is None or mold is None:
+		return
+
+	_ensureTables()
+
+	hourStart = floorHour(storedDate(cycleEndDate))
+	roundFactor = 10.0 ** BIN_DIGITS
+	cavities = len(values)
+
+	hourlyArgs = []
+	binArgs = []
+
+	for idx, value in enumerate(values):
+		if value is None or value == SENTINEL:
+			continue
+
+		value = float(value)
+		key = [press, category, hourStart, mold, idx + 1, cavities]
+
+		hourlyArgs.extend(key + [1, value, value * value, value, value])
+		binArgs.extend(key + [int(floor(value * roundFactor)), 1])
+
+	if len(hourlyArgs) < 1:
+		return
+
+	sqlQuery = """
+		INSERT INTO spc_rollup_hourly
+			(""" + _KEY_COLUMNS + """, sampleCount, sumValue, sumSquares, minValue, maxValue)
+		VALUES """ + ",".join(["(?,?,?,?,?,?,?,?,?,?,?)"] * (len(hourlyArgs) / 11)) + """
+		ON DUPLICATE KEY UPDATE
+			sampleCount = sampleCount + VALUES(sampleCount),
+			sumValue = sumValue + VALUES(sumValue),
+			sumSquares = sumSquares + VALUES(sumSquares),
+			minValue = LEAST(minValue, VALUES(minValue)),
+			maxValue = GREATEST(maxValue, VALUES(maxValue))
+	"""
+
+	system.db.runPrepUpdate(sqlQuery, args = hourlyArgs, database = DATABASE, tx = tx)
+
+	sqlQuery = """
+		INSERT INTO spc_rollup_bins
+			(""" + _KEY_COLUMNS + """, bin, sampleCount)
+		VALUES """ + ",".join(["(?,?,?,?,?,?,?,?)"] * (len(binArgs) / 8)) + """
+		ON DUPLICATE KEY UPDATE
+			sampleCount = sampleCount + VALUES(sampleCount)
+	"""
+
+	system.db.runPrepUpdate(sqlQuery, args = binArgs, database = DATABASE, tx = tx)
+
+
+def _buildFilter(press, category, molds, cavities):
+	"""
+	Helper that builds rollup WHERE clause (without hour range) and its args
+	"""
+
+	args = [press, category, len(cavities)]
+	args.extend(molds)
+	args.extend(cavities)
+
+	where = """
+			press = ? AND
+			category = ? AND
+			cavities = ? AND
+			mold IN (""" + ",".join(["?"] * len(molds)) + """) AND
+			cavity IN (""" + ",".join(["?"] * len(cavities)) + """)
+	"""
+
+	return where, args
+
+
+def _mergeRollups(accumulator, fromHour, toHour, press, category, molds, cavities):
+	"""
+	Helper that merges rollups of full hours [fromHour, toHour) into accumulator
+	"""
+
+	where, args = _buildFilter(press, category, molds, cavities)
+	args = args + [fromHour, toHour]
+
+	sqlQuery = """
+		SELECT
+			SUM(sampleCount) as sampleCount,
+			SUM(sumValue) as sumValue,
+			SUM(sumSquares) as sumSquares,
+			MIN(minValue) as minValue,
+			MAX(maxValue) as maxValue
+		FROM
+			spc_rollup_hourly
+		WHERE
+			""" + where + """ AND
+			hourStart >= ? AND
+			hourStart < ?
+	"""
+
+	sqlResult = system.db.runPrepQuery(sqlQuery, args, DATABASE)
+
+	if len(sqlResult) < 1 or not sqlResult[0]["sampleCount"]:
+		return
+
+	row = sqlResult[0]
+	accumulator["count"] += int(row["sampleCount"])
+	accumulator["sum"] += row["sumValue"]
+	accumulator["sumSquares"] += row["sumSquares"]
+	if accumulator["minValue"] is None or row["minValue"] < accumulator["minValue"]:
+		accumulator["minValue"] = row["minValue"]
+	if accumulator["maxValue"] is None or row["maxValue"] > accumulator["maxValue"]:
+		accumulator["maxValue"] = row["maxValue"]
+
+	sqlQuery = """
+		SELECT
+			bin, SUM(sampleCount) as sampleCount
+		FROM
+			spc_rollup_bins
+		WHERE
+			""" + where + """ AND
+			hourStart >= ? AND
+			hourStart < ?
+		GROUP BY
+			bin
+	"""
+
+	gridCounts = accumulator["gridCounts"]
+	for row in system.db.runPrepQuery(sqlQuery, args, DATABASE):
+		key = int(row["bin"])
+		gridCounts[key] = gridCounts.get(key, 0) + int(row["sampleCount"])
+
+
+def _mergeRaw(accumulator, startDate, endDate, press, spcFilter):
+	"""
+	Helper that merges raw measurements of a partial hour (live tail) into accumulator
+	"""
+
+	roundFactor = 10.0 ** BIN_DIGITS
+	gridCounts = accumulator["gridCounts"]
+
+	values = shared.sga.tw.measurements.getSpcData(startDate, endDate, press, spcFilter)
+
+	for value in values or []:
+		if value == SENTINEL:
+			continue
+
+		accumulator["count"] += 1
+		accumulator["sum"] += value
+		accumulator["sumSquares"] += value * value
+		if accumulator["minValue"] is None or value < accumulator["minValue"]:
+			accumulator["minValue"] = value
+		if accumulator["maxValue"] is None or value > accumulator["maxValue"]:
+			accumulator["maxValue"] = value
+
+		key = int(floor(value * roundFactor))
+		gridCounts[key] = gridCounts.get(key, 0) + 1
+
+
+def getSpcAccumulators(startDate, endDate, press, spcFilter):
+	"""
+	Function that merges SPC figures for any window from hourly rollups
+	Full hours come from rollups, only partial hours at both ends are read from raw measurements.
+
+	Parameters
+	----------
+	startDate: date
+		start of data period
+	endDate: date
+		end of data period
+	press: str
+		press identifier (P55, P54, ...)
+	spcFilter: json
+		filtration of data (molds, cavities, category)
+
+	Returns
+	-------
+	dict
+		accumulators for streamData.finalizeSpcKernel / buildSpcData:
+		count, meanValue, m2, minValue, maxValue, gridCounts
+		None if filter is incomplete
+	"""
+
+	category = spcFilter["filter"]["category"]
+	molds = spcFilter["filter"]["molds"]
+	cavities = spcFilter["filter"]["cavities"]
+
+	if len(category) < 1 or len(molds) < 1 or len(cavities) < 1:
+		return None
+
+	accumulator = {
+		"count": 0,
+		"sum": 0.0,
+		"sumSquares": 0.0,
+		"minValue": None,
+		"maxValue": None,
+		"gridCounts": {}
+	}
+
+	firstHour = ceilHour(startDate)
+	lastHour = floorHour(endDate)
+
+	if system.date.isBefore(firstHour, lastHour):
+		_mergeRaw(accumulator, startDate, firstHour, press, spcFilter)
+		_mergeRollups(accumulator, firstHour, lastHour, press, category, molds, cavities)
+		# raw reader is exclusive on start, cycles exactly on the hour belong to the tail
+		_mergeRaw(accumulator, system.date.addSeconds(lastHour, -1), endDate, press, spcFilter)
+	else:
+		_mergeRaw(accumulator, startDate, endDate, press, spcFilter)
+
+	count = accumulator["count"]
+	meanValue = m2 = 0.0
+	if count > 0:
+		meanValue = accumulator["sum"] / count
+		m2 = max(0.0, accumulator["sumSquares"] - accumulator["sum"] * meanValue)
+
+	return {
+		"count": count,
+		"meanValue": meanValue,
+		"m2": m2,
+		"minValue": accumulator["minValue"],
+		"maxValue": accumulator["maxValue"],
+		"gridCounts": accumulator["gridCounts"]
+	}
+
+
+def rebuildRollups(startDate, endDate, press = None):
+	"""
+	Function that rebuilds rollups of all hours touching [startDate, endDate) from measurement table
+	Used to backfill history (after shared.sga.tw.measurements.backfillMeasurements) or to repair hours.
+
+	Parameters
+	----------
+	startDate: date
+		start of period, rounded down to the hour
+	endDate: date
+		end of period, rounded up to the hour
+	press: str
+		press identifier, None for all presses
+
+	Returns
+	-------
+	None
+	"""
+
+	createRollupTables()
+
+	fromHour = floorHour(startDate)
+	toHour = ceilHour(endDate)
+
+	pressFilter = ""
+	args = [fromHour, toHour]
+	if press is not None:
+		pressFilter = " AND press = ?"
+		args.append(press)
+
+	hourExpression = "DATE_FORMAT(cycleEndDate, '%Y-%m-%d %H:00:00')"
+	sourceFilter = """
+		FROM
+			""" + shared.sga.tw.measurements.TABLE + """
+		WHERE
+			cycleEndDate >= ? AND
+			cycleEndDate < ? AND
+			value IS NOT NULL AND
+			value <> """ + str(SENTINEL) + pressFilter + """
+		GROUP BY
+			press, category, """ + hourExpression + """, mold, cavity, cavities"""
+
+	transaction = system.db.beginTransaction(DATABASE)
+	try:
+		for table in ["spc_rollup_hourly", "spc_rollup_bins"]:
+			system.db.runPrepUpdate("DELETE FROM " + table + " WHERE hourStart >= ? AND hourStart < ?" + pressFilter, args, tx = transaction)
+
+		sqlQuery = """
+			INSERT INTO spc_rollup_hourly
+				(""" + _KEY_COLUMNS + """, sampleCount, sumValue, sumSquares, minValue, maxValue)
+			SELECT
+				press, category, """ + hourExpression + """, mold, cavity, cavities,
+				COUNT(*), SUM(value), SUM(value * value), MIN(value), MAX(value)
+			""" + sourceFilter
+
+		system.db.runPrepUpdate(sqlQuery, args, tx = transaction)
+
+		sqlQuery = """
+			INSERT INTO spc_rollup_bins
+				(""" + _KEY_COLUMNS + """, bin, sampleCount)
+			SELECT
+				press, category, """ + hourExpression + """, mold, cavity, cavities,
+				FLOOR(value * """ + str(int(10 ** BIN_DIGITS)) + """) as bin, COUNT(*)
+			""" + sourceFilter + """, bin"""
+
+		system.db.runPrepUpdate(sqlQuery, args, tx = transaction)
+
+		system.db.commitTransaction(transaction)
+	except:
+		system.db.rollbackTransaction(transaction)
+		raise
+	finally:
+		system.db.closeTransaction(transaction)
@@ -1,3 +1,5 @@
+import threading
+
 def getTagValues(parentPath = "", tagPath = "*"):
 	"""
 	Function that scans tag folder path defined and provides array of values
@@ -13,22 +15,8 @@ def getTagValues(parentPath = "", tagPath = "*"):
 		list of tag values ordered, if no values found, return None
 	"""	
 
-	tags = system.tag.browseTags(parentPath = parentPath, tagPath = tagPath, sort = "ASC")
-			
-	tagsToRead = []
-	tagValuesData = []
-	
-	tagsData = {}
-	
-	# loop through tags	
-	for tag in tags:
-		tagsToRead.append(tag.fullPath)
-		
-	tagValues = system.tag.readAll(tagsToRead)
-
-	# get values and build list
-	for tagValue in tagValues:
-		tagValuesData.append(tagValue.value)	
+	# folder content is taken from browse cache, only values are read
+	tagValuesData = shared.sga.tw.tagBrowse.readTagValues(parentPath, tagPath, "ASC")
 		
 	# if values are available, return content, otherwise None
 	if len(tagValuesData) > 0:
@@ -46,7 +34,196 @@ def getTagValues(parentPath = "", tagPath = "*"):
 
 
 
-def getSlowestStationName(ignitionTagPath, fromTimeStamp = None):
+# Compiled station index per press (ignitionTagPath)
+# Holds station tag paths and their station names, so per cycle only a tag read is needed.
+# Rebuilt when param_stationDefinitions content changes or when a station tag is not found.
+_stationIndex = {}
+_stationIndexLock = threading.Lock()
+
+
+def parseStationTagName(tagName):
+	"""
+	Function that gets table id and station id from station tag name
+	
+	Parameters
+	----------
+	tagName : str
+		station tag name, like prod_t01st05
+	
+	Returns
+	-------
+	tuple
+		(tableId, stationId), None if name standard is not respected
+	"""	
+	
+	# NOTE: name standard needs to be respected!!!
+	# Like: prod_t01st05
+	try:
+		stationPartsData = tagName.split("_")[1]
+		return int(stationPartsData[2:3]), int(stationPartsData[-2:])
+	except:
+		return None
+
+
+def _definitionsSignature(stationDefinitions):
+	"""
+	Helper that builds comparable content of station definitions dataset
+	"""
+	
+	signature = []
+	for station in system.dataset.toPyDataSet(stationDefinitions):
+		signature.append((station["table"], station["station"], station["stationName"], bool(station["includeInCalculations"])))
+	
+	return tuple(signature)
+
+
+def getStationIndex(ignitionTagPath, stationDefinitions = None):
+	"""
+	Function that returns compiled station index of press, built once per station definitions
+	
+	Parameters
+	----------
+	ignitionTagPath : tagPath
+		path to equipment in tag path structure
+	stationDefinitions: dataset
+		content of param_stationDefinitions, read from tag when None
+	
+	Returns
+	-------
+	dict
+		signature: tuple
+			content of station definitions index was built from
+		stations: dict
+			(tableId, stationId) -> stationName, only stations included in calculations
+		tagNames: list
+			names of all station tags
+		tagPaths: list
+			full paths of all station tags
+		includedPaths: list
+			full paths of station tags included in calculations
+		includedNames: list
+			station names matching includedPaths
+	"""	
+	
+	if stationDefinitions is None:
+		stationDefinitions = system.tag.readBlocking([ignitionTagPath + "/press/param_stationDefinitions"])[0].value
+	
+	signature = _definitionsSignature(stationDefinitions)
+	
+	with _stationIndexLock:
+		index = _stationIndex.get(ignitionTagPath)
+		if index is not None and index["signature"] == signature:
+			return index
+	
+	# (table, station) -> station name
+	stations = {}
+	for station in signature:
+		if station[3]:
+			stations[(station[0], station[1])] = station[2]
+	
+	# get all station tags specified in station tag folder
+	stationCyclesPath = ignitionTagPath + "/signals/cycles/stations"
+	tags = system.tag.browseTags(parentPath = stationCyclesPath)
+	
+	tagNames = []
+	tagPaths = []
+	includedPaths = []
+	includedNames = []
+	
+	for tag in tags:
+		tagPath = str(tag.fullPath)
+		tagName = tagPath.split("/")[-1]
+		
+		tagNames.append(tagName)
+		tagPaths.append(tagPath)
+		
+		stationName = stations.get(parseStationTagName(tagName))
+		if stationName is not None:
+			includedPaths.append(tagPath)
+			includedNames.append(stationName)
+	
+	index = {
+		"signature": signature,
+		"stations": stations,
+		"tagNames": tagNames,
+		"tagPaths": tagPaths,
+		"includedPaths": includedPaths,
+		"includedNames": includedNames
+	}
+	
+	with _stationIndexLock:
+		_stationIndex[ignitionTagPath] = index
+	
+	return index
+
+
+def invalidateStationIndex(ignitionTagPath = None):
+	"""
+	Function that drops compiled station index, so it's rebuilt on next use
+	
+	Parameters
+	----------
+	ignitionTagPath : tagPath
+		path to equipment in tag path structure, None drops index of all presses
+	
+	Returns
+	-------
+	None
+	"""	
+	
+	with _stationIndexLock:
+		if ignitionTagPath is None:
+			_stationIndex.clear()
+		else:
+			_stationIndex.pop(ignitionTagPath, None)
+
+
+def readIncludedStationCycleValues(ignitionTagPath, stationDefinitions = None):
+	"""
+	Function that reads cycle times of stations included in calculations, named based on definitions
+	
+	Parameters
+	----------
+	ignitionTagPath : tagPath
+		path to equipment in tag path structure
+	stationDefinitions: dataset
+		content of param_stationDefinitions, read from tag when None
+	
+	Returns
+	-------
+	tagValuesData : array
+		list of stations (stationName, cycle and timestamp of each station)
+	"""	
+	
+	index = getStationIndex(ignitionTagPath, stationDefinitions)
+	
+	if len(index["includedPaths"]) < 1:
+		return []
+	
+	tagValues = system.tag.readBlocking(index["includedPaths"])
+	
+	tagValuesData = []
+	valid = True
+	
+	for stationName, tagValue in zip(index["includedNames"], tagValues):
+		# other bad qualities belong to existing tags, browsing again won't change them
+		if shared.sga.tw.tagBrowse.isNotFound(tagValue.quality):
+			valid = False
+		
+		tagValuesData.append([
+			stationName,
+			tagValue.value,
+			tagValue.timestamp
+		])
+	
+	# station tags were removed or renamed, browse again on next cycle
+	if not valid:
+		invalidateStationIndex(ignitionTagPath)
+	
+	return tagValuesData
+
+
+def getSlowestStationName(ignitionTagPath, fromTimeStamp = None, stationDefinitions = None):
 	"""
 	Function that gets slowest station name and duration 
 	
@@ -57,6 +234,8 @@ def getSlowestStationName(ignitionTagPath, fromTimeStamp = None):
 	fromTimeStamp: date
 		date used to filter stations that were updated after fromTimeStamp
 		None is used when all stations are included in calculation
+	stationDefinitions: dataset
+		content of param_stationDefinitions, read from tag when None
 	
 	Returns
 	-------
@@ -67,47 +246,44 @@ def getSlowestStationName(ignitionTagPath, fromTimeStamp = None):
 			slowest cycle time duration
 	"""	
 	
-	parentPath = ignitionTagPath + "/signals/cycles/stations"
-	stationCycleTimes = readStationCycleValues(ignitionTagPath)
-	
-	# collect press definition from press UDT
-	stationDefinitions = system.tag.read(ignitionTagPath + "/press/param_stationDefinitions").value
-	
-	count = 0
 	maxCycleTime = 0
 	slowestStationName = ""
 
-	for station in stationCycleTimes:
-		# NOTE: name standard needs to be respected!!!
-		# Like: prod_t01st05
-		# getting table id, station id and actual cycle duration per station
-		stationPartsData = station[0].split("_")[1]
-		tableId = int(stationPartsData[2:3])
-		stationId = int(stationPartsData[-2:])
-		stationCycleTime = station[1]
-		stationTimeStamp = station[2]
-		
-		# loop through station definitions
-		for station in system.dataset.toPyDataSet(stationDefinitions):
-			if tableId == station["table"] and stationId == station["station"] and station["includeInCalculations"]:
-				stationName = station["stationName"]
-							
-				# check if cycle time is higher than highest cycleTime
-				if stationCycleTime > maxCycleTime:
-					if fromTimeStamp is None:
-						maxCycleTime = stationCycleTime
-						slowestStationName = stationName
-					else:
-						if system.date.isAfter(stationTimeStamp, fromTimeStamp):
-							maxCycleTime = stationCycleTime
-							slowestStationName = stationName
-						
-						
-			count += 1	
+	for stationName, stationCycleTime, stationTimeStamp in readIncludedStationCycleValues(ignitionTagPath, stationDefinitions):
+		# check if cycle time is higher than highest cycleTime
+		if stationCycleTime > maxCycleTime:
+			if fromTimeStamp is None or system.date.isAfter(stationTimeStamp, fromTimeStamp):
+				maxCycleTime = stationCycleTime
+				slowestStationName = stationName
 
 	return slowestStationName, maxCycleTime
 	
 	
+def getCycleTimesPerStation(ignitionTagPath, stationDefinitions = None):
+	"""
+	Function that gets cycle times of stations included in calculation, named based on definitions
+	
+	Parameters
+	----------
+	ignitionTagPath : tagPath
+		path to equipment in tag path structure
+	stationDefinitions: dataset
+		content of param_stationDefinitions, read from tag when None
+	
+	Returns
+	-------
+	dict
+		stationName -> cycle time
+	"""	
+	
+	cycleTimeDict = {}
+	
+	for stationName, stationCycleTime, stationTimeStamp in readIncludedStationCycleValues(ignitionTagPath, stationDefinitions):
+		cycleTimeDict[stationName] = stationCycleTime
+	
+	return cycleTimeDict
+	
+	
 def readStationCycleValues(ignitionTagPath):
 	"""
 	Function that gets slowest station name and duration 
@@ -123,31 +299,21 @@ def readStationCycleValues(ignitionTagPath):
 		list of stations (tagname, cycle and timestamp of each station)
 	"""	
 	
-	# get cycle times of all station specified in station tag folder
-	stationCyclesPath = ignitionTagPath + "/signals/cycles/stations"
-	tags = system.tag.browseTags(parentPath = stationCyclesPath)
+	# station tags are taken from compiled index instead of browsing on every call
+	index = getStationIndex(ignitionTagPath)
 	
-	tagsToRead = []
-	tagValuesData = []
+	if len(index["tagPaths"]) < 1:
+		return []
 	
-	for tag in tags:
-		tagsToRead.append(tag.fullPath)
-		
-	tagValues = system.tag.readAll(tagsToRead)
+	tagValues = system.tag.readBlocking(index["tagPaths"])
 	
 	# get values and build list
-	count = 0
-	for tagValue in tagValues:
-		tagPath = tagsToRead[count]
-		tagName = tagPath.split("/")[-1]
-		
+	tagValuesData = []
+	for tagName, tagValue in zip(index["tagNames"], tagValues):
 		tagValuesData.append([
 			tagName,
 			tagValue.value,
 			tagValue.timestamp
 		])
 		
-		count += 1
-		
 	return tagValuesData
-	
\ No newline at end of file
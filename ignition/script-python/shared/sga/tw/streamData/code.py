@@ -1,5 +1,11 @@
 import bisect
+import sys
+import threading
+import time
+from array import array
 from math import floor, ceil
+from java.util import Date
+from java.util.concurrent import Callable
 
 class _StatsProperty(object):
     def __init__(self, name, func):
@@ -557,14 +563,690 @@ class Stats(object):
         return ret
 
 
+class StreamingStats(object):
+    """The ``StreamingStats`` type is the incremental counterpart of
+    :class:`Stats`. Datapoints are fed one at a time (``add``) or in
+    batches (``extend``) and are never stored; instead the object keeps
+    running central moments (Welford/Terriberry update), exact min/max
+    and a bounded quantile sketch of at most ``max_centroids``
+    centroids. Memory is O(max_centroids) regardless of how many points
+    have been added, and every measure is answered without a rescan.
+    While fewer distinct values than ``max_centroids`` have been seen,
+    quantiles are exact and match :class:`Stats`.
+    Args:
+        data (list): Optional initial iterable of numeric values.
+        default (float): A value to be returned when a given
+            statistical measure is not defined. 0.0 by default.
+        max_centroids (int): Size bound of the quantile sketch.
+            Defaults to 200.
+    """
+    def __init__(self, data=None, default=0.0, max_centroids=200):
+        if max_centroids < 2:
+            raise ValueError('expected max_centroids >= 2, not %r'
+                             % max_centroids)
+        self.default = default
+        self.max_centroids = int(max_centroids)
+        self.clear()
+        if data is not None:
+            self.extend(data)
+
+    def clear(self):
+        """Drop every datapoint, returning the object to its empty state."""
+        self._count = 0
+        self._mean = 0.0
+        self._m2 = self._m3 = self._m4 = 0.0
+        self._min = self._max = None
+        # sketch: sorted centroid means, their weights and whether a
+        # centroid only ever absorbed identical values (exact)
+        self._c_means = []
+        self._c_counts = []
+        self._c_exact = []
+
+    def __len__(self):
+        return self._count
+
+    def add(self, value):
+        """Add a single datapoint."""
+        x = float(value)
+        n1 = self._count
+        n = n1 + 1
+        delta = x - self._mean
+        delta_n = delta / n
+        delta_n2 = delta_n * delta_n
+        term1 = delta * delta_n * n1
+        self._mean += delta_n
+        self._m4 += (term1 * delta_n2 * (n * n - 3 * n + 3) +
+                     6 * delta_n2 * self._m2 - 4 * delta_n * self._m3)
+        self._m3 += term1 * delta_n * (n - 2) - 3 * delta_n * self._m2
+        self._m2 += term1
+        self._count = n
+
+        if self._min is None or x < self._min:
+            self._min = x
+        if self._max is None or x > self._max:
+            self._max = x
+
+        means = self._c_means
+        idx = bisect.bisect_left(means, x)
+        if idx < len(means) and means[idx] == x:
+            self._c_counts[idx] += 1
+            return
+        means.insert(idx, x)
+        self._c_counts.insert(idx, 1)
+        self._c_exact.insert(idx, True)
+        if len(means) > self.max_centroids:
+            self._compress()
+
+    def extend(self, values):
+        """Add every datapoint of an iterable."""
+        add = self.add
+        for value in values:
+            add(value)
+
+    def merge(self, other):
+        """Fold another ``StreamingStats`` into this one, as if all of its
+        datapoints had been added here. Moments are combined exactly
+        (Chan et al.), the sketches are merged and re-bounded.
+        """
+        if not other._count:
+            return self
+        if not self._count:
+            self._count, self._mean = other._count, other._mean
+            self._m2, self._m3, self._m4 = other._m2, other._m3, other._m4
+            self._min, self._max = other._min, other._max
+            self._c_means = list(other._c_means)
+            self._c_counts = list(other._c_counts)
+            self._c_exact = list(other._c_exact)
+            while len(self._c_means) > self.max_centroids:
+                self._compress()
+            return self
+
+        na, nb = float(self._count), float(other._count)
+        n = na + nb
+        delta = other._mean - self._mean
+        delta2 = delta * delta
+        m2a, m3a = self._m2, self._m3
+        m2b, m3b = other._m2, other._m3
+        self._m4 = (self._m4 + other._m4 +
+                    delta2 * delta2 * na * nb * (na * na - na * nb + nb * nb) / (n ** 3) +
+                    6 * delta2 * (na * na * m2b + nb * nb * m2a) / (n * n) +
+                    4 * delta * (na * m3b - nb * m3a) / n)
+        self._m3 = (m3a + m3b +
+                    delta * delta2 * na * nb * (na - nb) / (n * n) +
+                    3 * delta * (na * m2b - nb * m2a) / n)
+        self._m2 = m2a + m2b + delta2 * na * nb / n
+        self._mean += delta * nb / n
+        self._count += other._count
+        self._min = min(self._min, other._min)
+        self._max = max(self._max, other._max)
+
+        merged = sorted(zip(self._c_means + other._c_means,
+                            self._c_counts + other._c_counts,
+                            self._c_exact + other._c_exact))
+        means, counts, exact = [], [], []
+        for m, c, e in merged:
+            if means and means[-1] == m:
+                counts[-1] += c
+                exact[-1] = exact[-1] and e
+            else:
+                means.append(m)
+                counts.append(c)
+                exact.append(e)
+        self._c_means, self._c_counts, self._c_exact = means, counts, exact
+        while len(self._c_means) > self.max_centroids:
+            self._compress()
+        return self
+
+    def _compress(self):
+        """Merge the pair of adjacent centroids that costs the least
+        (weight times gap), which keeps the tails sharp and the sketch
+        bounded.
+        """
+        means, counts = self._c_means, self._c_counts
+        best_idx, best_cost = 0, None
+        for i in range(len(means) - 1):
+            cost = (counts[i] + counts[i + 1]) * (means[i + 1] - means[i])
+            if best_cost is None or cost < best_cost:
+                best_idx, best_cost = i, cost
+        i = best_idx
+        c = counts[i] + counts[i + 1]
+        means[i] = (means[i] * counts[i] + means[i + 1] * counts[i + 1]) / float(c)
+        counts[i] = c
+        self._c_exact[i] = False
+        del means[i + 1], counts[i + 1], self._c_exact[i + 1]
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def mean(self):
+        if not self._count:
+            return self.default
+        return self._mean
+
+    @property
+    def min(self):
+        if not self._count:
+            return self.default
+        return self._min
+
+    @property
+    def max(self):
+        if not self._count:
+            return self.default
+        return self._max
+
+    @property
+    def variance(self):
+        """Population variance, same definition as :attr:`Stats.variance`."""
+        if not self._count:
+            return self.default
+        return self._m2 / self._count
+
+    @property
+    def std_dev(self):
+        if not self._count:
+            return self.default
+        return self.variance ** 0.5
+
+    @property
+    def rel_std_dev(self):
+        abs_mean = abs(self.mean)
+        if self._count and abs_mean:
+            return self.std_dev / abs_mean
+        return self.default
+
+    @property
+    def skewness(self):
+        """Same definition as :attr:`Stats.skewness`."""
+        s_dev = self.std_dev
+        if self._count > 1 and s_dev > 0:
+            return self._m3 / float((self._count - 1) * (s_dev ** 3))
+        return self.default
+
+    @property
+    def kurtosis(self):
+        """Same definition as :attr:`Stats.kurtosis`."""
+        s_dev = self.std_dev
+        if self._count > 1 and s_dev > 0:
+            return self._m4 / float((self._count - 1) * (s_dev ** 4))
+        return 0.0
+
+    @property
+    def median(self):
+        return self.get_quantile(0.5)
+
+    @property
+    def iqr(self):
+        return self.get_quantile(0.75) - self.get_quantile(0.25)
+
+    @property
+    def trimean(self):
+        gq = self.get_quantile
+        return (gq(0.25) + (2 * gq(0.5)) + gq(0.75)) / 4.0
+
+    def get_quantile(self, q):
+        """Get a quantile from the sketch, ``0.0`` being the minimum and
+        ``1.0`` the maximum. Exact as long as the sketch has not been
+        compressed, linearly interpolated between centroids afterwards.
+        """
+        q = float(q)
+        if not 0.0 <= q <= 1.0:
+            raise ValueError('expected q between 0.0 and 1.0, not %r' % q)
+        elif not self._count:
+            return self.default
+        idx = q * (self._count - 1)
+
+        # anchor points (rank, value); exact centroids span their ranks
+        ranks, values = [0.0], [self._min]
+        start = 0
+        for m, c, e in zip(self._c_means, self._c_counts, self._c_exact):
+            if e:
+                ranks.extend([start, start + c - 1])
+                values.extend([m, m])
+            else:
+                ranks.append(start + (c - 1) / 2.0)
+                values.append(m)
+            start += c
+        ranks.append(self._count - 1)
+        values.append(self._max)
+
+        pos = bisect.bisect_left(ranks, idx)
+        if pos < len(ranks) and ranks[pos] == idx:
+            return values[pos]
+        lo_r, hi_r = ranks[pos - 1], ranks[pos]
+        lo_v, hi_v = values[pos - 1], values[pos]
+        return lo_v + (hi_v - lo_v) * (idx - lo_r) / (hi_r - lo_r)
+
+    def get_zscore(self, value):
+        """See :meth:`Stats.get_zscore`."""
+        mean = self.mean
+        if self.std_dev == 0:
+            if value == mean:
+                return 0
+            if value > mean:
+                return float('inf')
+            if value < mean:
+                return float('-inf')
+        return (float(value) - mean) / self.std_dev
+
+    def _get_bin_bounds(self, count=None):
+        if not self._count:
+            return [0.0]
+        min_data, max_data = self._min, self._max
+        if count is None:
+            # freedman algorithm for fixed-width bin selection
+            dx = 2 * self.iqr / (self._count ** (1 / 3.0))
+            if dx <= 0:
+                return [min_data]
+            bin_count = max(1, int(ceil((max_data - min_data) / dx)))
+            bins = [min_data + (dx * i) for i in range(bin_count + 1)]
+            return [b for b in bins if b < max_data] or [min_data]
+        dx = (max_data - min_data) / float(count)
+        return [min_data + (dx * i) for i in range(count)]
+
+    def histogram(self, bins=None, **kw):
+        """Produces a list of ``(bin, count)`` pairs, with the same bin
+        handling as :meth:`Stats.histogram`. Counts are taken from the
+        sketch, so the cost is O(bins + max_centroids).
+        """
+        bin_digits = int(kw.pop('bin_digits', 1))
+        if kw:
+            raise TypeError('unexpected keyword arguments: %r' % kw.keys())
+
+        if not bins:
+            bins = self._get_bin_bounds()
+        else:
+            try:
+                bin_count = int(bins)
+            except TypeError:
+                try:
+                    bins = [float(x) for x in bins]
+                except Exception:
+                    raise ValueError('bins expected integer bin count or list of float bin boundaries, not %r' % bins)
+                if self.min < bins[0]:
+                    bins = [self.min] + bins
+            else:
+                bins = self._get_bin_bounds(bin_count)
+
+        round_factor = 10.0 ** bin_digits
+        bins = [floor(b * round_factor) / round_factor for b in bins]
+        bins = sorted(set(bins))
+
+        counts = [0] * len(bins)
+        for m, c in zip(self._c_means, self._c_counts):
+            idx = bisect.bisect(bins, m) - 1
+            if idx >= 0:
+                counts[idx] += c
+        return zip(bins, counts)
+
+    def describe(self, quantiles=None):
+        """Summary statistics as a dict, see :meth:`Stats.describe`."""
+        quantiles = quantiles or [0.25, 0.5, 0.75]
+        ret = {'count': self.count,
+               'mean': self.mean,
+               'std_dev': self.std_dev,
+               'kurtosis': self.kurtosis,
+               'skewness': self.skewness,
+               'min': self.min,
+               'max': self.max}
+        for q in quantiles:
+            ret[str(q)] = self.get_quantile(q)
+        return ret
+
+
+###################################################
+# Live SPC statistics kept in gateway memory per press/mold/category/cavity for the running production run
+# key: (press, mold, category, cavity, cavities) like shared.sga.tw.spcRollups
+_liveSpcStats = {}
+# press: {"startDate": production run start, "complete": True once the run was seen starting}
+_liveSpcRuns = {}
+_liveSpcLock = threading.Lock()
+
+def _dropLiveSpcPress(press):
+	# caller holds _liveSpcLock
+	for key in _liveSpcStats.keys():
+		if press is None or key[0] == press:
+			del _liveSpcStats[key]
+
+def recordLiveSpcValues(press, mold, category, values, runStartDate = None):
+	"""
+	Function that feeds measurements of one cycle into the live SPC statistics
+	Statistics of a press are dropped when its production run start date changes,
+	so they always cover the running production run only.
+
+	Parameters
+	----------
+	press: str
+		press identifier (P55, P54, ...)
+	mold: int
+		mold on table 1 for this cycle
+	category: str
+		"weight" or "thickness"
+	values: list
+		cavity measurements, -99.0 (no measurement) is skipped
+	runStartDate: date
+		start of the running production run (scopeProductionRun/param_startDate)
+
+	Returns
+	-------
+	None
+	"""
+	cavities = len(values)
+
+	with _liveSpcLock:
+		run = _liveSpcRuns.get(press)
+		if run is None or run["startDate"] != runStartDate:
+			_dropLiveSpcPress(press)
+			# after a gateway restart the first run seen is only partially covered
+			_liveSpcRuns[press] = {"startDate": runStartDate, "complete": run is not None and runStartDate is not None}
+
+		for idx, value in enumerate(values):
+			if value is None or value == -99.0:
+				continue
+
+			key = (press, mold, category, idx + 1, cavities)
+			stats = _liveSpcStats.get(key)
+			if stats is None:
+				stats = _liveSpcStats[key] = StreamingStats()
+			stats.add(value)
+
+
+def getLiveSpcStats(press, category, molds = None, cavities = None):
+	"""
+	Function that returns live SPC statistics of a press, merged over the molds / cavities requested
+
+	Parameters
+	----------
+	press: str
+		press identifier (P55, P54, ...)
+	category: str
+		"weight" or "thickness"
+	molds: list
+		molds to include, None for all molds
+	cavities: list
+		cavities to include (cycles with exactly len(cavities) cavities), None for all cavities
+
+	Returns
+	-------
+	stats: StreamingStats
+		merged copy, safe to read while new cycles are recorded
+	"""
+	stats = StreamingStats()
+
+	with _liveSpcLock:
+		for key, cavityStats in _liveSpcStats.items():
+			if key[0] != press or key[2] != category:
+				continue
+			if molds is not None and key[1] not in molds:
+				continue
+			if cavities is not None and (key[4] != len(cavities) or key[3] not in cavities):
+				continue
+			stats.merge(cavityStats)
+
+	return stats
+
+
+def getLiveSpcAccumulators(press, spcFilter, runStartDate):
+	"""
+	Function that answers SPC accumulators of a production run from live statistics,
+	without any database round trip
+
+	Parameters
+	----------
+	press: str
+		press identifier (P55, P54, ...)
+	spcFilter: json
+		filtration of data (molds, cavities, category)
+	runStartDate: date
+		start of the production run asked for
+
+	Returns
+	-------
+	dict
+		accumulators for finalizeSpcKernel / buildSpcData (see shared.sga.tw.spcRollups.getSpcAccumulators)
+		None when live statistics do not cover this whole production run
+	"""
+	with _liveSpcLock:
+		run = _liveSpcRuns.get(press)
+		if run is None or not run["complete"] or run["startDate"] != runStartDate:
+			return None
+
+	category = spcFilter["filter"]["category"]
+	stats = getLiveSpcStats(press, category, spcFilter["filter"]["molds"], spcFilter["filter"]["cavities"])
+
+	count = len(stats)
+	if count < 1:
+		return None
+
+	# histogram comes from the quantile sketch, exact while fewer than max_centroids values are distinct
+	roundFactor = 10.0 ** 3
+	gridCounts = {}
+	for centroid, samples in zip(stats._c_means, stats._c_counts):
+		gridKey = int(floor(centroid * roundFactor))
+		gridCounts[gridKey] = gridCounts.get(gridKey, 0) + samples
+
+	return {
+		"count": count,
+		"meanValue": stats.mean,
+		"m2": stats.variance * count,
+		"minValue": stats.min,
+		"maxValue": stats.max,
+		"gridCounts": gridCounts
+	}
+
+
+def resetLiveSpcStats(press = None):
+	"""
+	Function that clears live SPC statistics, e.g. when a production run is closed
+
+	Parameters
+	----------
+	press: str
+		press identifier, None clears every press
+
+	Returns
+	-------
+	None
+	"""
+	with _liveSpcLock:
+		_dropLiveSpcPress(press)
+		for runPress in _liveSpcRuns.keys():
+			if press is None or runPress == press:
+				del _liveSpcRuns[runPress]
+
+
+def computeSpcKernel(buffer, bins = 20, lsp = None, hsp = None, binDigits = 3, sentinel = -99.0):
+	"""
+	Function that computes all SPC figures in a single pass over a measurement buffer
+	
+	Count, mean and M2 (Welford), min and max are accumulated while every value
+	is quantized to the histogram grid (10^-binDigits), so the histogram is
+	resolved afterwards from the distinct quantized values only. Result is the
+	same as Stats.histogram(bins, bin_digits) and system.math.standardDeviation.
+	
+	Parameters
+	----------
+	buffer: array('d')
+		measurements, any iterable of floats is accepted
+	bins: int
+		number of histogram bins
+	lsp: float
+		lower specification limit, None if unknown
+	hsp: float
+		higher specification limit, None if unknown
+	binDigits: int
+		number of digits used to round down the bin boundaries
+	sentinel: float
+		value marking a missing measurement, skipped
+		
+	Returns
+	-------
+	dict
+		count, meanValue, minValue, maxValue, standardDev (sample),
+		histogram ([[bin, samples], ...]), cp, cpk
+	"""
+	roundFactor = 10.0 ** binDigits
+	
+	count = 0
+	meanValue = m2 = 0.0
+	minValue = maxValue = None
+	gridCounts = {}
+	
+	for value in buffer:
+		if value == sentinel:
+			continue
+		
+		count += 1
+		delta = value - meanValue
+		meanValue += delta / count
+		m2 += delta * (value - meanValue)
+		
+		if minValue is None or value < minValue:
+			minValue = value
+		if maxValue is None or value > maxValue:
+			maxValue = value
+		
+		key = int(floor(value * roundFactor))
+		gridCounts[key] = gridCounts.get(key, 0) + 1
+	
+	return finalizeSpcKernel(count, meanValue, m2, minValue, maxValue, gridCounts, bins, lsp, hsp, binDigits)
+
+
+def finalizeSpcKernel(count, meanValue, m2, minValue, maxValue, gridCounts, bins = 20, lsp = None, hsp = None, binDigits = 3):
+	"""
+	Function that turns accumulated SPC moments to final SPC figures
+	Shared by computeSpcKernel and SPC rollups (shared.sga.tw.spcRollups), which merge
+	the same accumulators from pre-aggregated hours.
+	
+	Parameters
+	----------
+	count: int
+		number of measurements
+	meanValue: float
+		mean of measurements
+	m2: float
+		sum of squared differences from the mean
+	minValue, maxValue: float
+		extremes of measurements
+	gridCounts: dict
+		number of measurements per floor(value * 10^binDigits)
+	bins, lsp, hsp, binDigits:
+		see computeSpcKernel
+		
+	Returns
+	-------
+	dict
+		see computeSpcKernel
+	"""
+	roundFactor = 10.0 ** binDigits
+	
+	result = {
+		"count": count,
+		"meanValue": meanValue if count else None,
+		"minValue": minValue,
+		"maxValue": maxValue,
+		"standardDev": (m2 / (count - 1)) ** 0.5 if count > 1 else 0.0,
+		"histogram": [],
+		"cp": 0.0,
+		"cpk": 0.0
+	}
+	
+	standardDev = result["standardDev"]
+	if standardDev <= 0:
+		return result
+	
+	# fixed-width bin boundaries from min to max, rounded down to the grid
+	dx = (maxValue - minValue) / float(bins)
+	boundaryKeys = sorted(set([int(floor((minValue + dx * i) * roundFactor)) for i in range(bins)]))
+	
+	binCounts = [0] * len(boundaryKeys)
+	for key, samples in gridCounts.iteritems():
+		idx = bisect.bisect(boundaryKeys, key) - 1
+		if idx >= 0:
+			binCounts[idx] += samples
+	
+	result["histogram"] = [[key / roundFactor, binCounts[i]] for i, key in enumerate(boundaryKeys)]
+	
+	if hsp > 0.0 and lsp > 0.0:
+		result["cp"] = (hsp - lsp) / (6 * standardDev)
+		result["cpk"] = min((hsp - meanValue) / (3 * standardDev), (meanValue - lsp) / (3 * standardDev))
+	
+	return result
+
+
+def benchmarkSpcKernel(size = 1000000, bins = 20, lsp = 27.0, hsp = 37.0):
+	"""
+	Function that benchmarks computeSpcKernel against the previous buildSpcData path
+	(filter, system.math mean/min/max/standardDeviation and Stats.histogram)
+	on synthetic weight and thickness data. Meant to be run from the script console.
+	
+	Parameters
+	----------
+	size: int
+		number of synthetic measurements per category
+	bins: int
+		number of histogram bins
+	lsp, hsp: float
+		specification limits used for cp and cpk
+		
+	Returns
+	-------
+	results: dict
+		per category: legacy and kernel durations in ms and if both histograms match
+	"""
+	import random
+	
+	categories = {
+		"weight": (32.0, 1.2, 1),
+		"thickness": (6.5, 0.05, 2)
+	}
+	
+	results = {}
+	for category, (mu, sigma, decimals) in categories.items():
+		rnd = random.Random(4459)
+		values = []
+		for i in xrange(size):
+			# roughly one sensor dropout per 1000 measurements
+			if rnd.random() < 0.001:
+				values.append(-99.0)
+			else:
+				values.append(round(rnd.gauss(mu, sigma), decimals))
+		
+		start = time.time()
+		legacyData = filter(lambda value: value != -99.0, values)
+		statistics = Stats(legacyData)
+		system.math.mean(legacyData)
+		system.math.min(legacyData)
+		system.math.max(legacyData)
+		system.math.standardDeviation(legacyData)
+		legacyHistogram = [[b, int(c)] for b, c in statistics.histogram(bins=bins, bin_digits=3)]
+		legacyMs = (time.time() - start) * 1000
+		
+		buffer = array('d', values)
+		start = time.time()
+		kernel = computeSpcKernel(buffer, bins, lsp, hsp)
+		kernelMs = (time.time() - start) * 1000
+		
+		results[category] = {
+			"legacyMs": round(legacyMs, 1),
+			"kernelMs": round(kernelMs, 1),
+			"histogramMatch": legacyHistogram == kernel["histogram"]
+		}
+	
+	return results
+	
+
 def buildSpcData(inputData, ignitionTagPath, spcFilter):
 	"""
 	Function used to build histogram chart data
 	
 	Parameters
 	----------
-	inputData: list
-		list of data
+	inputData: array('d')
+		buffer of measurements (any iterable of floats is accepted)
+		or dict of accumulators from shared.sga.tw.spcRollups.getSpcAccumulators
 		
 	Returns
 	-------
@@ -577,15 +1259,6 @@ def buildSpcData(inputData, ignitionTagPath, spcFilter):
 			
 	from com.inductiveautomation.ignition.common import TypeUtilities
 	
-	inputData = filter(lambda value: value != -99.0, inputData)
-	# load statistics library
-	statistics = Stats(inputData)
-	# calculate data
-	meanValue = system.math.mean(inputData)
-	minValue = system.math.min(inputData)
-	maxValue = system.math.max(inputData)
-	standardDev = system.math.standardDeviation(inputData)
-	
 	# TO DO - DYNAMICALLY BRING LIMITS AND SETPOINT
 	category = spcFilter["filter"]["category"]
 	eqPath = system.tag.read(ignitionTagPath + "/mes/param_mesObject").value 
@@ -652,31 +1325,24 @@ def buildSpcData(inputData, ignitionTagPath, spcFilter):
 	headers = ["Label", "Value"]
 	data = []
 	
-	# setting default values
-	cp = cpk = 0.00
+	# accumulators merged from SPC rollups only need to be finalized
+	if isinstance(inputData, dict):
+		kernel = finalizeSpcKernel(bins = bins, lsp = lsp, hsp = hsp, **inputData)
 	
-	# standard deviation is needed to calculate cp and cpk values
-	# if standard deviation > 0 build, otherwise return as none
-	if standardDev > 0:
-		histogram = statistics.histogram(bins=bins, bin_digits=3)
-				
-		# build data for histogram
-		for dataPoint in histogram:
-			value = dataPoint[0]
-			samples = int(dataPoint[1])
-			data.append([value, samples])
-		
-		if hsp > 0.0 and lsp > 0.0:
-			cp = (hsp - lsp) / (6 * standardDev)
-			cpk1 = (hsp - meanValue) / (3 * standardDev)
-			cpk2 = (meanValue - lsp) / (3 * standardDev)
-			
-			cpkList = [cpk1, cpk2]
-			cpk = system.math.min(cpkList)
-		
-		else:
-			cpk = 0.0
-			cp = 0.0
+	# mean, min, max, std dev, histogram, cp and cpk in one pass (-99.0 skipped inline)
+	else:
+		if not isinstance(inputData, array):
+			inputData = array('d', inputData)
+		kernel = computeSpcKernel(inputData, bins, lsp, hsp)
+	
+	minValue = kernel["minValue"]
+	maxValue = kernel["maxValue"]
+	cp = kernel["cp"]
+	cpk = kernel["cpk"]
+	
+	# histogram is only built when standard deviation > 0
+	if kernel["standardDev"] > 0:
+		data = kernel["histogram"]
 		
 	dataDS = system.dataset.toDataSet(headers, data)
 	
@@ -773,8 +1439,8 @@ def prepareSpcData(data, spcFilter):
 		
 	Returns
 	-------
-	spcData: list
-		list of data for building histogram
+	spcData: array('d')
+		buffer of data for building histogram
 	"""	
 	if data is None:
 		return None 
@@ -783,7 +1449,7 @@ def prepareSpcData(data, spcFilter):
 	molds = spcFilter["filter"]["molds"]
 	cavities = spcFilter["filter"]["cavities"]
 	
-	spcData = []
+	spcData = array('d')
 	
 	for row in data:
 		rowData = system.util.jsonDecode((row[0]))
@@ -796,7 +1462,8 @@ def prepareSpcData(data, spcFilter):
 		if len(measurementData) == len(cavities):
 			for cavity in cavities:
 				value = measurementData[cavity - 1]
-				spcData.append(value)
+				if value is not None:
+					spcData.append(value)
 	
 	return spcData	
 
@@ -994,21 +1661,162 @@ def getTriggerData(ignitionTagPath, journalName, startDate, endDate):
 	
 	return dataDS
 
-def selectFeedbackStatus(feedbackId):
+###################################################
+# Alarm journal cursors per (ignitionTagPath, journalName)
+_triggerCursors = {}
+_triggerCursorLock = threading.Lock()
+
+_TRIGGER_HEADERS = [
+	"Active Time",
+	"Name",
+	"Current State",
+	"Priority",
+	"Action",
+	"Ack. Note",
+	"Ack. User",
+	"checkListName",
+	"checkListExec"
+]
+
+def _extractTriggerRow(alarm, dateFormat):
 	"""
-	Function to select status of feedbackSteps
+	Helper that turns one alarm journal event to (epoch millis, trigger row)
+	"""
+	if alarm.isCleared():
+		triggerData = alarm.getClearedData()
+	elif alarm.isAcked():
+		triggerData = alarm.getAckData()
+	else:
+		triggerData = alarm.getActiveData()
+	
+	# single pass over event properties
+	properties = {}
+	for triggerProperty in triggerData.getValues():
+		name = str(triggerProperty.getProperty())
+		if name in ("ackUser", "checklistName", "ackNotes", "action"):
+			properties[name] = triggerProperty.getValue()
+	
+	ackUser = str(properties.get("ackUser", "")).split(":")[-1]
+	checkListName = properties.get("checklistName", "")
+	ackNote = str(properties.get("ackNotes", ""))
+	action = str(properties.get("action", ""))
+	
+	#0 = Not executed yet
+	#1 = Executed
+	#2 = Declined
+	checkListExec = 0
+	if "action" in properties:
+		if "*EXECUTED*" in ackNote:
+			checkListExec = 1
+		elif "*DECLINED*" in ackNote:
+			checkListExec = 2
+	
+	# formatted once, straight from epoch millis (second precision as before)
+	eventMillis = triggerData.getTimestamp()
+	eventTime = dateFormat.format(Date(eventMillis - eventMillis % 1000))
+	
+	return eventMillis, [
+		eventTime,
+		alarm.getName(),
+		alarm.getState(),
+		alarm.getPriority(),
+		action,
+		ackNote,
+		ackUser,
+		checkListName,
+		checkListExec
+	]
+
+def getTriggerDataIncremental(ignitionTagPath, journalName, startDate, endDate, overlapSeconds = 300):
+	"""
+	Function that returns same dataset as getTriggerData, but keeps a cursor per press and journal.
+	Only events since the last call (minus overlapSeconds, for late journal writes) are queried
+	and merged into a cached row store keyed by alarm event id, so an event that got acked or
+	cleared since is updated. A different startDate or an earlier endDate starts over.
 	
 	Parameters
 	----------
-	feedbackId: int
-		internal id for feedback
+	ignitionTagPath: str
+		tag path to machine
+	journalName: str
+		alarm journal
+	startDate: date
+		start of period (production run start)
+	endDate: date
+		end of period
+	overlapSeconds: int
+		seconds re-read before the previous end
 	
 	Returns
 	-------
-	Pydataset
-		Dataset containing feedback status
+	dataset
+		trigger data sorted by Active Time, newest first
+	"""
+	from java.text import SimpleDateFormat
+	
+	ignitionTagPathSplit = ignitionTagPath.split("[default]")
+	
+	if len(ignitionTagPathSplit) > 1:
+		source = "*"+ignitionTagPathSplit[1]+"*"
+	else:
+		source = "*"+ignitionTagPath+"*"
+	
+	key = (ignitionTagPath, journalName)
+	startMillis = system.date.toMillis(startDate)
+	endMillis = system.date.toMillis(endDate)
+	
+	with _triggerCursorLock:
+		cursor = _triggerCursors.get(key)
+		if cursor is None or cursor["startMillis"] != startMillis or endMillis < cursor["endMillis"]:
+			cursor = {"startMillis": startMillis, "endMillis": startMillis, "rows": {}}
+			queryStart = startDate
+		else:
+			queryStart = system.date.fromMillis(max(startMillis, cursor["endMillis"] - overlapSeconds * 1000))
+	
+	alarms = system.alarm.queryJournal(
+		journalName = journalName, 
+		path = [source],
+		startDate = queryStart, 
+		endDate = endDate,
+		includeSystem = False,
+		includeData = True
+	)
+	
+	dateFormat = SimpleDateFormat("yyyy-MM-dd HH:mm:ss")
+	newRows = {}
+	for alarm in alarms:
+		newRows[str(alarm.getId())] = _extractTriggerRow(alarm, dateFormat)
+	
+	with _triggerCursorLock:
+		cursor["rows"].update(newRows)
+		cursor["endMillis"] = endMillis
+		_triggerCursors[key] = cursor
+		rows = cursor["rows"].values()
+	
+	rows.sort(key = lambda row: row[0], reverse = True)
+	
+	return system.dataset.toDataSet(_TRIGGER_HEADERS, [row[1] for row in rows])
+
+def resetTriggerCursor(ignitionTagPath = None):
 	"""
-	sql = """SELECT 
+	Function that drops cached alarm journal cursors
+	
+	Parameters
+	----------
+	ignitionTagPath: str
+		tag path to machine, None drops all cursors
+	
+	Returns
+	-------
+	None
+	"""
+	with _triggerCursorLock:
+		for key in _triggerCursors.keys():
+			if ignitionTagPath is None or key[0] == ignitionTagPath:
+				del _triggerCursors[key]
+
+# status per latest feedback step, shared by selectFeedbackStatus and selectAnalyticChecklistBulk
+_FEEDBACK_STATUS_COLUMNS = """
 			(
 			    CASE 
 			        WHEN solved = 1 AND f3.stepType = 1 THEN "YES"
@@ -1030,17 +1838,47 @@ def selectFeedbackStatus(feedbackId):
 					WHEN f3.stepType = 5 THEN "Overview step"
 				ELSE "UNKNOWN STEP TYPE"
 				END) as stepTypeName,
-				f3.issue as issue  
+				f3.issue as issue"""
+
+_FEEDBACK_STATUS_HEADERS = ["status", "stepNumber", "user", "startTime", "endTime", "stepTypeName", "issue"]
+
+
+def _checklistQuery(runPrepQuery = None):
+	"""
+	Helper returning query runner for sga_checklist, replaceable by a stand-in (see benchmarkChecklistAnalytics)
+	"""
+	if runPrepQuery is not None:
+		return runPrepQuery
+	return lambda query, args: system.db.runPrepQuery(query=query, args=args, database="sga_checklist")
+
+
+def selectFeedbackStatus(feedbackId, runPrepQuery = None):
+	"""
+	Function to select status of feedbackSteps
+	
+	Parameters
+	----------
+	feedbackId: int
+		internal id for feedback
+	runPrepQuery: function
+		query runner (query, args), None for sga_checklist database
+	
+	Returns
+	-------
+	Pydataset
+		Dataset containing feedback status
+	"""
+	sql = """SELECT """ + _FEEDBACK_STATUS_COLUMNS + """
 			FROM feedbackstep f1
 			LEFT JOIN feedback f2 on f1.feedbackId = f2.feedbackId
 			LEFT JOIN step f3 on f3.stepId = f1.stepId 
-			RIGHT JOIN (SELECT stepNumber, min(startTime), max(stepFeedbackId) id FROM feedbackstep where feedbackid = ? group by stepNumber) f2 ON f1.stepFeedbackId = f2.id  
+			JOIN (SELECT stepNumber, max(stepFeedbackId) id FROM feedbackstep where feedbackid = ? group by stepNumber) latest ON f1.stepFeedbackId = latest.id  
 			Order by f1.stepnumber 
 			"""
 	
-	return system.db.runPrepQuery(query=sql, args=[feedbackId], database="sga_checklist")
+	return _checklistQuery(runPrepQuery)(sql, [feedbackId])
 
-def selectAnalyticChecklistV3(checkListExecData, startDate, endDate):
+def selectAnalyticChecklistV3(checkListExecData, startDate, endDate, runPrepQuery = None):
 	"""
 	Function to select few analytic for checklists
 	
@@ -1048,6 +1886,8 @@ def selectAnalyticChecklistV3(checkListExecData, startDate, endDate):
 	----------
 	category: str
 		category for filtering
+	runPrepQuery: function
+		query runner (query, args), None for sga_checklist database
 	
 	Returns
 	-------
@@ -1055,6 +1895,7 @@ def selectAnalyticChecklistV3(checkListExecData, startDate, endDate):
 		Dataset containing analytic table
 	"""
 	
+	runQuery = _checklistQuery(runPrepQuery)
 	checkListData = {}
 	feedbackSql = """
 	SELECT feedback.feedbackId, feedback.comment as comment, feedback.duration / 60000 as duration
@@ -1073,15 +1914,15 @@ def selectAnalyticChecklistV3(checkListExecData, startDate, endDate):
 		checkListUUID = checkListExecData[key]["uuid"]
 		# Loop over checklists and give me the analytics
 		#for checklist in checklists:
-		feedbackDs = system.db.runPrepQuery(query=feedbackSql, args=[checkListUUID,startDate, endDate], database="sga_checklist")
+		feedbackDs = runQuery(feedbackSql, [checkListUUID,startDate, endDate])
 		feedbackDsPy = system.dataset.toPyDataSet(feedbackDs)
 		
-		sqlResult = system.db.runPrepQuery(query=stepCountSql, args=[checkListUUID], database="sga_checklist")
+		sqlResult = runQuery(stepCountSql, [checkListUUID])
 		stepCount = sqlResult[0]["stepsNumber"]
 	
 		
 		for row in feedbackDsPy:
-			status = selectFeedbackStatus(row["feedbackId"])
+			status = selectFeedbackStatus(row["feedbackId"], runPrepQuery)
 			checkListData[key][row["feedbackId"]] = {
 				"totalSteps": stepCount, 
 				"stepsProcessed": status.getRowCount(), 
@@ -1094,6 +1935,233 @@ def selectAnalyticChecklistV3(checkListExecData, startDate, endDate):
 	
 	return	checkListData	
 
+def resolveChecklistUuids(checkListNames, runPrepQuery = None):
+	"""
+	Function that resolves checklist codes to uuids in one query
+	
+	Parameters
+	----------
+	checkListNames: list
+		checklist codes (checkListName in trigger data)
+	runPrepQuery: function
+		query runner (query, args), None for sga_checklist database
+	
+	Returns
+	-------
+	dict
+		code: uuid, None for unknown codes
+	"""
+	checkListNames = list(set(checkListNames))
+	uuids = dict([(name, None) for name in checkListNames])
+	
+	if len(checkListNames) < 1:
+		return uuids
+	
+	sql = "SELECT code, uuid FROM checklist WHERE code IN (" + ",".join(["?"] * len(checkListNames)) + ")"
+	
+	for row in system.dataset.toPyDataSet(_checklistQuery(runPrepQuery)(sql, checkListNames)):
+		if uuids.get(row["code"]) is None:
+			uuids[row["code"]] = row["uuid"]
+	
+	return uuids
+
+def selectAnalyticChecklistBulk(checkListExecData, startDate, endDate, runPrepQuery = None, chunkSize = 500):
+	"""
+	Function to select few analytic for checklists
+	Same result as selectAnalyticChecklistV3, but step counts, feedbacks and statuses of all
+	checklists in the period are read with 3 set-based queries (per chunkSize feedbacks) instead
+	of 2 + 1 per feedback queries per checklist.
+	
+	Parameters
+	----------
+	checkListExecData: dict
+		checklists as built in buildRunStreamData, each with "uuid"
+	startDate: date
+		start of period
+	endDate: date
+		end of period
+	runPrepQuery: function
+		query runner (query, args), None for sga_checklist database
+	chunkSize: int
+		max number of ids in one IN list
+	
+	Returns
+	-------
+	dict
+		checklist: {feedbackId: analytics}
+	"""
+	runQuery = _checklistQuery(runPrepQuery)
+	checkListData = dict([(key, {}) for key in checkListExecData.keys()])
+	
+	uuids = list(set([value["uuid"] for value in checkListExecData.values() if value["uuid"] is not None]))
+	if len(uuids) < 1:
+		return checkListData
+	
+	uuidPlaceholders = ",".join(["?"] * len(uuids))
+	
+	# step count per checklist
+	stepCountSql = "SELECT checkListId, count(stepId) as stepsNumber FROM step WHERE checkListId IN (" + uuidPlaceholders + ") GROUP BY checkListId"
+	stepCounts = {}
+	for row in system.dataset.toPyDataSet(runQuery(stepCountSql, uuids)):
+		stepCounts[row["checkListId"]] = row["stepsNumber"]
+	
+	# feedbacks of all checklists in period
+	feedbackSql = """
+	SELECT feedback.feedbackId, feedback.checkListId, feedback.comment as comment, feedback.duration / 60000 as duration
+		FROM feedback 
+		JOIN feedbackstep ON (feedback.feedbackId = feedbackstep.feedbackId) 
+		WHERE feedback.checkListId IN (""" + uuidPlaceholders + """) 
+		AND startTimeStamp BETWEEN ? AND ?
+		GROUP BY feedback.feedbackId
+	"""
+	feedbacks = system.dataset.toPyDataSet(runQuery(feedbackSql, uuids + [startDate, endDate]))
+	feedbackIds = [row["feedbackId"] for row in feedbacks]
+	
+	# latest status of every step of every feedback
+	statusValues = dict([(feedbackId, []) for feedbackId in feedbackIds])
+	for start in range(0, len(feedbackIds), chunkSize):
+		chunk = feedbackIds[start:start + chunkSize]
+		statusSql = """SELECT f1.feedbackId as feedbackId, """ + _FEEDBACK_STATUS_COLUMNS + """
+				FROM feedbackstep f1
+				LEFT JOIN feedback f2 on f1.feedbackId = f2.feedbackId
+				LEFT JOIN step f3 on f3.stepId = f1.stepId 
+				JOIN (SELECT max(stepFeedbackId) id FROM feedbackstep where feedbackid IN (""" + ",".join(["?"] * len(chunk)) + """) group by feedbackId, stepNumber) latest ON f1.stepFeedbackId = latest.id  
+				Order by f1.feedbackId, f1.stepnumber 
+				"""
+		for row in system.dataset.toPyDataSet(runQuery(statusSql, chunk)):
+			statusValues[row["feedbackId"]].append([row[header] for header in _FEEDBACK_STATUS_HEADERS])
+	
+	# assemble same structure as selectAnalyticChecklistV3
+	for key, value in checkListExecData.items():
+		stepCount = stepCounts.get(value["uuid"], 0)
+		for row in feedbacks:
+			if row["checkListId"] != value["uuid"]:
+				continue
+			values = statusValues[row["feedbackId"]]
+			checkListData[key][row["feedbackId"]] = {
+				"totalSteps": stepCount, 
+				"stepsProcessed": len(values), 
+				"skippedSteps": stepCount - len(values),
+				"operatorComment" : row["comment"],
+				"durationTotalMin": row["duration"],
+				"feedbackDetails": {"headers": list(_FEEDBACK_STATUS_HEADERS), "values": values}
+				}
+	
+	return checkListData
+
+def benchmarkChecklistAnalytics(nbChecklists = 25, nbFeedbacks = 3000, stepsPerChecklist = 8):
+	"""
+	Function that benchmarks per checklist / per feedback queries (selectAnalyticChecklistV3)
+	against selectAnalyticChecklistBulk on an in-memory SQLite stand-in of sga_checklist.
+	Uses the SQLite JDBC driver shipped with the gateway. Meant to be run from the script console.
+	
+	Parameters
+	----------
+	nbChecklists: int
+		number of checklists
+	nbFeedbacks: int
+		number of feedbacks spread over the checklists
+	stepsPerChecklist: int
+		number of steps per checklist
+	
+	Returns
+	-------
+	dict
+		queries and duration (ms) for both variants and if results match
+	"""
+	import random
+	from java.lang import Class
+	from java.sql import DriverManager
+	
+	Class.forName("org.sqlite.JDBC")
+	connection = DriverManager.getConnection("jdbc:sqlite::memory:")
+	
+	try:
+		statement = connection.createStatement()
+		for ddl in [
+			"CREATE TABLE checklist (uuid TEXT PRIMARY KEY, code TEXT)",
+			"CREATE TABLE step (stepId INTEGER PRIMARY KEY, checkListId TEXT, stepType INTEGER, issue TEXT)",
+			"CREATE TABLE feedback (feedbackId INTEGER PRIMARY KEY, checkListId TEXT, comment TEXT, duration INTEGER, user TEXT)",
+			"CREATE TABLE feedbackstep (stepFeedbackId INTEGER PRIMARY KEY, feedbackId INTEGER, stepId INTEGER, stepNumber INTEGER, solved INTEGER, startTime INTEGER, endTime INTEGER, startTimeStamp INTEGER)",
+			"CREATE INDEX ix_step ON step (checkListId)",
+			"CREATE INDEX ix_feedback ON feedback (checkListId)",
+			"CREATE INDEX ix_feedbackstep ON feedbackstep (feedbackId, stepNumber)"
+		]:
+			statement.executeUpdate(ddl)
+		
+		def insertRows(sql, rows):
+			prepared = connection.prepareStatement(sql)
+			for row in rows:
+				for idx, value in enumerate(row):
+					prepared.setObject(idx + 1, value)
+				prepared.addBatch()
+			prepared.executeBatch()
+			prepared.close()
+		
+		rnd = random.Random(4459)
+		codes = ["CL%03d" % i for i in range(nbChecklists)]
+		insertRows("INSERT INTO checklist VALUES (?,?)", [["uuid-" + code, code] for code in codes])
+		
+		steps = []
+		for c, code in enumerate(codes):
+			for s in range(stepsPerChecklist):
+				steps.append([c * stepsPerChecklist + s + 1, "uuid-" + code, rnd.randint(1, 5), "issue %d" % s])
+		insertRows("INSERT INTO step VALUES (?,?,?,?)", steps)
+		
+		feedbacks = []
+		feedbackSteps = []
+		for feedbackId in range(1, nbFeedbacks + 1):
+			c = rnd.randrange(nbChecklists)
+			feedbacks.append([feedbackId, "uuid-" + codes[c], "comment %d" % feedbackId, rnd.randint(60000, 600000), "operator"])
+			startTime = feedbackId * 1000
+			for s in range(rnd.randint(1, stepsPerChecklist)):
+				# some steps are answered twice, only the latest counts
+				for attempt in range(rnd.choice([1, 1, 2])):
+					feedbackSteps.append([None, feedbackId, c * stepsPerChecklist + s + 1, s + 1, rnd.choice([-1, 1, 2]), startTime, startTime + 500, startTime])
+		insertRows("INSERT INTO feedback VALUES (?,?,?,?,?)", feedbacks)
+		insertRows("INSERT INTO feedbackstep VALUES (?,?,?,?,?,?,?,?)", feedbackSteps)
+		
+		counter = {"queries": 0}
+		def runPrepQuery(query, args):
+			counter["queries"] += 1
+			prepared = connection.prepareStatement(query)
+			for idx, value in enumerate(args):
+				prepared.setObject(idx + 1, value)
+			resultSet = prepared.executeQuery()
+			metaData = resultSet.getMetaData()
+			headers = [metaData.getColumnLabel(i) for i in range(1, metaData.getColumnCount() + 1)]
+			rows = []
+			while resultSet.next():
+				rows.append([resultSet.getObject(i) for i in range(1, len(headers) + 1)])
+			prepared.close()
+			return system.dataset.toPyDataSet(system.dataset.toDataSet(headers, rows))
+		
+		startDate, endDate = 0, (nbFeedbacks + 1) * 1000
+		results = {}
+		
+		# per checklist / per feedback, uuid resolution as in buildRunStreamData before
+		start = time.time()
+		execData = {}
+		for code in codes:
+			sqlResult = runPrepQuery("SELECT uuid FROM checklist WHERE code = ?", [code])
+			execData[code] = {"execCount": 0, "declineCount": 0, "uuid": sqlResult[0]["uuid"]}
+		legacy = selectAnalyticChecklistV3(execData, startDate, endDate, runPrepQuery)
+		results["legacy"] = {"queries": counter["queries"], "ms": round((time.time() - start) * 1000, 1)}
+		
+		counter["queries"] = 0
+		start = time.time()
+		uuids = resolveChecklistUuids(codes, runPrepQuery)
+		execData = dict([(code, {"execCount": 0, "declineCount": 0, "uuid": uuids[code]}) for code in codes])
+		bulk = selectAnalyticChecklistBulk(execData, startDate, endDate, runPrepQuery)
+		results["bulk"] = {"queries": counter["queries"], "ms": round((time.time() - start) * 1000, 1)}
+		
+		normalize = lambda data: system.util.jsonDecode(system.util.jsonEncode(data))
+		results["match"] = normalize(legacy) == normalize(bulk)
+		return results
+	
+	finally:
+		connection.close()
+
 def stateDurationAndCountTw(eqPath, startDate, endDate):
 	
 	"""
@@ -1405,21 +2473,125 @@ def buildDefualtSpcFilters(param_nbMolds, prod_nbCavities):
 	return [spcFilterThickness, spcFilterWeight]  
 		
 
+def buildCPKandTargets(startDate, endDate, press, spcFilter, ignitionTagPath):
+	
+	# live statistics answer the running production run from memory,
+	# otherwise hourly rollups merged with the live tail of raw measurements
+	spcData = getLiveSpcAccumulators(press, spcFilter, startDate)
+	if spcData is None:
+		spcData = shared.sga.tw.spcRollups.getSpcAccumulators(startDate, endDate, press, spcFilter)
+	spcData = buildSpcData(spcData, ignitionTagPath, spcFilter)
+
+	#spcData["histogram"] = system.util.jsonDecode(spcData["histogram"])
+	del spcData["histogram"]
+	return spcData
+
 def buildCPKandTargetsDict(startDate, endDate, press, param_nbMolds, prod_nbCavities, ignitionTagPath):	
 	
 	spcFilters = buildDefualtSpcFilters(param_nbMolds, prod_nbCavities)
 	spcDataDict = {}
 	
 	for spcFilter in spcFilters:
-		rawData = getRawData(startDate, endDate, press, spcFilter)
-		spcData = prepareSpcData(rawData, spcFilter)
-		spcData = buildSpcData(spcData, ignitionTagPath, spcFilter)
-	
-		#spcData["histogram"] = system.util.jsonDecode(spcData["histogram"])
-		del spcData["histogram"]
-		spcDataDict[spcFilter["filter"]["category"]] = spcData
+		spcDataDict[spcFilter["filter"]["category"]] = buildCPKandTargets(startDate, endDate, press, spcFilter, ignitionTagPath)
 	return spcDataDict
 
+class _SectionTask(Callable):
+	"""
+	Callable running one section of runSections and timing it
+	"""
+	def __init__(self, func, args):
+		self.func = func
+		self.args = args
+		self.startTime = None
+		self.endTime = None
+	
+	def call(self):
+		self.startTime = time.time()
+		try:
+			return self.func(*self.args)
+		finally:
+			self.endTime = time.time()
+
+def runSections(sections, maxWorkers = 4, timeout = 60.0):
+	"""
+	Function that runs independent sections (DB, MES or alarm journal round trips) concurrently
+	on a bounded thread pool. A section that fails or does not finish in time is replaced by
+	its fallback, so a slow section can not block the caller.
+	
+	Parameters
+	----------
+	sections: list
+		[name, function, args, fallback] or [name, function, args, fallback, timeout]
+	maxWorkers: int
+		maximum number of sections running at the same time
+	timeout: float
+		seconds each section may take (counted from the moment it starts running), unless section has its own
+		a section still queued after every earlier wave of the pool could have timed out is given up
+	
+	Returns
+	-------
+	list
+		results: dict
+			name: section result or fallback
+		timings: dict
+			name: {"status": "ok" / "timeout" / "error", "ms": duration}
+	"""
+	from java.util.concurrent import Executors, TimeUnit, TimeoutException
+	
+	logger = system.util.getLogger("PFCE-TW-Press")
+	results = {}
+	timings = {}
+	
+	if len(sections) < 1:
+		return results, timings
+	
+	workers = max(1, min(maxWorkers, len(sections)))
+	executor = Executors.newFixedThreadPool(workers)
+	
+	try:
+		submitted = time.time()
+		futures = []
+		
+		for section in sections:
+			name, func, args, fallback = section[:4]
+			sectionTimeout = section[4] if len(section) > 4 else timeout
+			task = _SectionTask(func, args)
+			futures.append([name, fallback, sectionTimeout, task, executor.submit(task)])
+		
+		for idx, (name, fallback, sectionTimeout, task, future) in enumerate(futures):
+			# queued sections wait for a free worker, their own timeout starts with them
+			queueDeadline = submitted + sectionTimeout * (idx // workers + 1)
+			
+			try:
+				while task.startTime is None and not future.isDone() and time.time() < queueDeadline:
+					try:
+						future.get(100, TimeUnit.MILLISECONDS)
+					except TimeoutException:
+						pass
+				
+				startTime = task.startTime or submitted
+				remaining = max(0.0, startTime + sectionTimeout - time.time())
+				results[name] = future.get(long(remaining * 1000), TimeUnit.MILLISECONDS)
+				status = "ok"
+			except TimeoutException:
+				future.cancel(True)
+				results[name] = fallback
+				status = "timeout"
+			except:
+				results[name] = fallback
+				status = "error"
+				logger.warn("Section " + name + " failed: " + str(sys.exc_info()[1]))
+			
+			startTime = task.startTime or submitted
+			endTime = task.endTime or time.time()
+			timings[name] = {"status": status, "ms": int((endTime - startTime) * 1000)}
+	finally:
+		executor.shutdownNow()
+	
+	logger.info("Sections finished in " + str(int((time.time() - submitted) * 1000)) + " ms: " + str(timings))
+	
+	return results, timings
+
 def buildRunStreamData(ignitionTagPath):
 	"""
 	Function to build stream data for production run.
@@ -1470,66 +2642,90 @@ def buildRunStreamData(ignitionTagPath):
 	#Rejects per mould#
 	###################
 	
-	rejectPerMoldDS = getRejectsPerMould(ignitionTagPath, runPeriod = True)
-	
-	rejectPerMoldDSPy = system.dataset.toPyDataSet(rejectPerMoldDS)
-	rejectPerMoldDict = {}
-	
-	for row in rejectPerMoldDSPy:
-		rejectPerMoldDict[row["moldId"]] = {
-			"totalRejectsPerMold": 		row["totalRejectsPerMold"],
-			"rejectsPerMoldPercentage": row["rejectsPerMoldPercentage"]
-		}
+	def rejectsPerMold():
+		rejectPerMoldDS = getRejectsPerMould(ignitionTagPath, runPeriod = True)
 		
-	#####################################
-	#Duration of MES states + occurences#
-	#####################################
-	stateDurationAndCount = stateDurationAndCountTw(eqPath, prodRunStartDate, prodRunEndDate)
-	
-	
-	##############
-	#Trigger data#
-	##############
-
-	triggerData = getTriggerData(ignitionTagPath, param_alarm_journal, prodRunStartDate, prodRunEndDate)
-	triggerDataPy = system.dataset.toPyDataSet(triggerData)
-	
-	triggerDataDict = 		{}
-	checklistExecData = 	{}
-	
-	# Browse rows
-	triggerDataDict = {"headers": triggerData.getColumnNames(),   "values": [] }
-	sqlQueryChecklist = "SELECT uuid FROM checklist WHERE code = ?"
-	for rowIdx in range(triggerData.getRowCount()):
-		# Build lists of each line
+		rejectPerMoldDSPy = system.dataset.toPyDataSet(rejectPerMoldDS)
+		rejectPerMoldDict = {}
+		
+		for row in rejectPerMoldDSPy:
+			rejectPerMoldDict[row["moldId"]] = {
+				"totalRejectsPerMold": 		row["totalRejectsPerMold"],
+				"rejectsPerMoldPercentage": row["rejectsPerMoldPercentage"]
+			}
+		
+		return rejectPerMoldDict
+		
+	##############################
+	#Trigger data + checklist data#
+	##############################
 
-		if triggerData.getValueAt(rowIdx, "checkListExec") > 0:
-			if triggerData.getValueAt(rowIdx, "checkListName") not in checklistExecData:
-				checklistExecData[triggerData.getValueAt(rowIdx, "checkListName")] = {
-					"execCount" : 	0,
-					"declineCount": 0,
-					"uuid":	system.db.runScalarPrepQuery(sqlQueryChecklist, [triggerData.getValueAt(rowIdx, "checkListName")], "sga_checklist")			
-				}
+	def triggersAndChecklists():
+		# only alarms raised since the previous call are read from the journal
+		triggerData = getTriggerDataIncremental(ignitionTagPath, param_alarm_journal, prodRunStartDate, prodRunEndDate)
+		
+		triggerDataDict = 		{}
+		checklistExecData = 	{}
+		
+		# Browse rows
+		triggerDataDict = {"headers": triggerData.getColumnNames(),   "values": [] }
+		for rowIdx in range(triggerData.getRowCount()):
+			# Build lists of each line
+	
+			if triggerData.getValueAt(rowIdx, "checkListExec") > 0:
+				if triggerData.getValueAt(rowIdx, "checkListName") not in checklistExecData:
+					checklistExecData[triggerData.getValueAt(rowIdx, "checkListName")] = {
+						"execCount" : 	0,
+						"declineCount": 0,
+						"uuid":	None
+					}
+				
+				if triggerData.getValueAt(rowIdx, "checkListName") in checklistExecData:
+					if triggerData.getValueAt(rowIdx, "checkListExec") == 1:
+						checklistExecData[triggerData.getValueAt(rowIdx, "checkListName")]["execCount"] 	+= 1
+					elif triggerData.getValueAt(rowIdx, "checkListExec") == 2:
+						checklistExecData[triggerData.getValueAt(rowIdx, "checkListName")]["declineCount"] += 1
 			
-			if triggerData.getValueAt(rowIdx, "checkListName") in checklistExecData:
-				if triggerData.getValueAt(rowIdx, "checkListExec") == 1:
-					checklistExecData[triggerData.getValueAt(rowIdx, "checkListName")]["execCount"] 	+= 1
-				elif triggerData.getValueAt(rowIdx, "checkListExec") == 2:
-					checklistExecData[triggerData.getValueAt(rowIdx, "checkListName")]["declineCount"] += 1
+			# Build lists of each line
+			triggerDataDict["values"].append( [triggerData.getValueAt(rowIdx, colIdx) for colIdx in range(triggerData.getColumnCount())])
 		
-		# Build lists of each line
-		triggerDataDict["values"].append( [triggerData.getValueAt(rowIdx, colIdx) for colIdx in range(triggerData.getColumnCount())])
+		# resolve all checklist uuids in one query
+		checklistUuids = resolveChecklistUuids(checklistExecData.keys())
+		for checkListName in checklistExecData:
+			checklistExecData[checkListName]["uuid"] = checklistUuids[checkListName]
+		
+		# checklist analytics depend on checklists found in trigger data
+		checkListData = selectAnalyticChecklistBulk(checklistExecData, prodRunStartDate, prodRunEndDate)
+		
+		return triggerDataDict, checklistExecData, checkListData
 	
+	#####################################
+	#Independent sections run in parallel#
+	#####################################
+	
+	spcFilterThickness, spcFilterWeight = buildDefualtSpcFilters(param_nbMolds, prod_nbCavities)
+	emptyTriggerData = {"headers": list(_TRIGGER_HEADERS), "values": []}
+	
+	sections = [
+		["rejectPerMold", 			rejectsPerMold, 		[], 	{}],
+		#Duration of MES states + occurences
+		["stateDurationAndCount", 	stateDurationAndCountTw, [eqPath, prodRunStartDate, prodRunEndDate], {}],
+		["triggersAndChecklists", 	triggersAndChecklists, 	[], 	[emptyTriggerData, {}, {}]],
+		#Custom proeprty data - SCP targets
+		["spcThickness", 			buildCPKandTargets, 	[prodRunStartDate, prodRunEndDate, press, spcFilterThickness, ignitionTagPath], {}],
+		["spcWeight", 				buildCPKandTargets, 	[prodRunStartDate, prodRunEndDate, press, spcFilterWeight, ignitionTagPath], {}],
+		["rejects", 				shared.sga.tw.rejection.formatTWRejectJson, [ignitionTagPath], {}]
+	]
 	
-	################
-	#Checklist data#
-	################
+	sectionResults, sectionTimings = runSections(sections)
 	
-	checkListData = selectAnalyticChecklistV3(checklistExecData, prodRunStartDate, prodRunEndDate)
-	####################################
-	#Custom proeprty data - SCP targets#  
-	####################################
-	spcData = buildCPKandTargetsDict(prodRunStartDate, prodRunEndDate, press, param_nbMolds, prod_nbCavities, ignitionTagPath)
+	rejectPerMoldDict = 	sectionResults["rejectPerMold"]
+	stateDurationAndCount = sectionResults["stateDurationAndCount"]
+	triggerDataDict, checklistExecData, checkListData = sectionResults["triggersAndChecklists"]
+	spcData = {
+		"thickness": 	sectionResults["spcThickness"],
+		"weight": 		sectionResults["spcWeight"]
+	}
 	
 	
 	####################
@@ -1610,7 +2806,7 @@ def buildRunStreamData(ignitionTagPath):
 	additionalJson["checkListExecData"] =	checklistExecData
 	additionalJson["checkListData"] =		checkListData
 	
-	additionalJson["rejects"] =				shared.sga.tw.rejection.formatTWRejectJson(ignitionTagPath)		
+	additionalJson["rejects"] =				sectionResults["rejects"]
 	
 	return additionalJson
 
@@ -1651,53 +2847,6 @@ def buildCycleStreamData(ignitionTagPath):
 			
 			return weightsJson, thicknessJson 
 	
-	def getCycleTimesDictPerStationDefinition(stationDefinitions, ignitionTagPath):
-	
-		"""
-		Function that gets all station cycle times and compiles to show only the station times that are included
-		in calculation and are named based on definitions
-		
-		Parameters
-		----------
-		ignitionTagPath : tagPath
-			path to equipment in tag path structure
-		
-		Returns
-		-------
-		list
-			slowestStationName: str
-				name of the slowest station from press station definitions
-			maxCycleTime: float
-				slowest cycle time duration
-		"""	
-		
-		parentPath = ignitionTagPath + "/signals/cycles/stations"
-		stationCycleTimes = shared.sga.tw.stations.readStationCycleValues(ignitionTagPath)
-		
-		count = 0
-		
-		cycleTimeDict = {}
-		
-		for station in stationCycleTimes:
-			# NOTE: name standard needs to be respected!!!
-			# Like: prod_t01st05
-			# getting table id, station id and actual cycle duration per station
-			stationPartsData = station[0].split("_")[1]
-			tableId = int(stationPartsData[2:3])
-			stationId = int(stationPartsData[-2:])
-			stationCycleTime = station[1]
-			
-			# loop through station definitions
-			for station in system.dataset.toPyDataSet(stationDefinitions):
-				if tableId == station["table"] and stationId == station["station"] and station["includeInCalculations"]:
-					stationName = station["stationName"]
-					
-					cycleTimeDict[stationName] = stationCycleTime
-	
-				count += 1	
-	
-		return cycleTimeDict
-	
 	#Must be special casae for Flexovit
 	#We identify by robotTable tag
 	flexovitCase = system.tag.exists(ignitionTagPath + "/signals/molds/robotTable1Mold")
@@ -1727,7 +2876,7 @@ def buildCycleStreamData(ignitionTagPath):
 	stationDefinitions = 	tagValues[3].value
 	currentShift = 			tagValues[4].value
 	
-	cycleTimes = getCycleTimesDictPerStationDefinition(stationDefinitions, ignitionTagPath)
+	cycleTimes = shared.sga.tw.stations.getCycleTimesPerStation(ignitionTagPath, stationDefinitions)
 	
 	#############################
 	#Missing CP, CPK and Targets#
@@ -0,0 +1,171 @@
+import threading
+import time
+
+# Cache of system.tag.browseTags results (full tag paths)
+# Key is (parentPath, tagPath, sort), value is (browse time, list of full paths).
+# Station / measurement / mold folders are fixed per UDT, so hot paths only need readAll.
+DEFAULT_MAX_AGE = 300
+
+_browseCache = {}
+_browseStats = {"hits": 0, "misses": 0, "invalidations": 0}
+_browseLock = threading.Lock()
+
+
+def browseTagPaths(parentPath = "", tagPath = "*", sort = "ASC", maxAge = DEFAULT_MAX_AGE):
+	"""
+	Function that returns full paths of tags in folder, browsing only when cached result is missing or old
+	
+	Parameters
+	----------
+	parentPath: string
+		path to tag folder
+	tagPath: string
+		additional filtering within folder (accepts wildcard *)
+	sort: string
+		"ASC" or "DESC", same as system.tag.browseTags
+	maxAge: float
+		seconds cached result stays valid, 0 to always browse
+	
+	Returns
+	-------
+	list
+		list of full tag paths
+	"""
+	
+	key = (parentPath, tagPath, sort)
+	now = time.time()
+	
+	with _browseLock:
+		cached = _browseCache.get(key)
+		if cached is not None and now - cached[0] < maxAge:
+			_browseStats["hits"] += 1
+			return cached[1]
+		
+		_browseStats["misses"] += 1
+	
+	tags = system.tag.browseTags(parentPath = parentPath, tagPath = tagPath, sort = sort)
+	
+	tagPaths = []
+	for tag in tags:
+		tagPaths.append(str(tag.fullPath))
+	
+	with _browseLock:
+		_browseCache[key] = (now, tagPaths)
+	
+	return tagPaths
+
+
+def isNotFound(quality):
+	"""
+	Function that tells if tag quality means the tag itself is missing (removed or renamed)
+	Other bad qualities are values of existing tags, browsing again won't change them.
+	"""
+	
+	return str(quality.name) == "Bad_NotFound"
+
+
+def readTagValues(parentPath = "", tagPath = "*", sort = "ASC", maxAge = DEFAULT_MAX_AGE):
+	"""
+	Function that reads values of all tags in folder using cached browse result
+	If any of the tags is not found (removed or renamed), folder is browsed again once.
+	
+	Parameters
+	----------
+	parentPath: string
+		path to tag folder
+	tagPath: string
+		additional filtering within folder (accepts wildcard *)
+	sort: string
+		"ASC" or "DESC", same as system.tag.browseTags
+	maxAge: float
+		seconds cached browse result stays valid
+	
+	Returns
+	-------
+	list
+		list of tag values ordered same as browse
+	"""
+	
+	tagsToRead = browseTagPaths(parentPath, tagPath, sort, maxAge)
+	tagValues = system.tag.readAll(tagsToRead)
+	
+	if any(isNotFound(tagValue.quality) for tagValue in tagValues):
+		invalidate(parentPath)
+		tagsToRead = browseTagPaths(parentPath, tagPath, sort, maxAge)
+		tagValues = system.tag.readAll(tagsToRead)
+	
+	return [tagValue.value for tagValue in tagValues]
+
+
+def invalidate(parentPath = None):
+	"""
+	Function that drops cached browse results, to be called after UDT / tag structure edits
+	
+	Parameters
+	----------
+	parentPath: string
+		path to folder or UDT instance, all cached folders below it are dropped
+		None drops the whole cache
+	
+	Returns
+	-------
+	int
+		number of dropped entries
+	"""
+	
+	with _browseLock:
+		if parentPath is None:
+			keys = _browseCache.keys()
+		else:
+			# folder itself and folders below it, siblings sharing name prefix ("P5" / "P55") are kept
+			folderPrefix = parentPath.rstrip("/") + "/"
+			keys = [key for key in _browseCache if key[0] == parentPath or key[0].startswith(folderPrefix)]
+		
+		for key in keys:
+			del _browseCache[key]
+		
+		_browseStats["invalidations"] += len(keys)
+	
+	return len(keys)
+
+
+def getStats():
+	"""
+	Function that returns cache counters for tuning maxAge
+	
+	Parameters
+	----------
+	None
+	
+	Returns
+	-------
+	dict
+		hits, misses, invalidations, entries and hitRate
+	"""
+	
+	with _browseLock:
+		stats = dict(_browseStats)
+		stats["entries"] = len(_browseCache)
+	
+	lookups = stats["hits"] + stats["misses"]
+	stats["hitRate"] = float(stats["hits"]) / lookups if lookups > 0 else 0.0
+	
+	return stats
+
+
+def resetStats():
+	"""
+	Function that resets cache counters
+	
+	Parameters
+	----------
+	None
+	
+	Returns
+	-------
+	None
+	"""
+	
+	with _browseLock:
+		for key in _browseStats:
+			_browseStats[key] = 0